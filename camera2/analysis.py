@@ -0,0 +1,233 @@
+"""
+Per-frame analysis of the camera preview by plugins, off the UI thread.
+
+Plugins subclass AnalysisPlugin and implement analyze(), which is called
+on a worker thread of a FrameAnalyzer's thread pool with a small
+downsampled copy of the frame. Its return value is set as the plugin's
+result property back on the main thread (through the camera event
+queue), so widgets can bind to it like any other Kivy property.
+
+Cameras read each preview frame back at no more than the analyzer's
+max_size through a readback.ReadbackRing, so the read doesn't stall
+rendering, and pass it to FrameAnalyzer.submit. Each plugin analyzes at
+most one frame at a time and keeps at most one more pending: a frame
+arriving while the plugin is busy replaces the pending frame, which is
+dropped. A plugin that can't keep up therefore analyzes fewer but always
+recent frames, without queueing work or holding up the other plugins.
+
+    analyzer = FrameAnalyzer()
+    plugin = ColourNamePlugin()
+    plugin.bind(result=lambda plugin, name: print(name))
+    analyzer.register(plugin)
+    camera.start_analysis(analyzer)
+"""
+
+import logging
+import threading
+import traceback
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from kivy.event import EventDispatcher
+from kivy.properties import NumericProperty, ObjectProperty, StringProperty
+
+from cameraevents import camera_event_queue
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_MAX_SIZE = (320, 240)
+
+
+def downsample(frame, size, flip_vertical=False):
+    """Return a nearest-neighbour resampling of a (height, width, ...)
+    frame to the given (width, height).
+    """
+    height, width = frame.shape[:2]
+    out_width, out_height = size
+    rows = ((np.arange(out_height) + 0.5) * height / out_height).astype(np.intp)
+    columns = ((np.arange(out_width) + 0.5) * width / out_width).astype(np.intp)
+    if flip_vertical:
+        rows = rows[::-1]
+    return frame[rows[:, np.newaxis], columns]
+
+
+class AnalysisPlugin(EventDispatcher, metaclass=ABCMeta):
+    """Base class of per-frame analyses.
+
+    Subclasses implement analyze(). The properties are only updated on
+    the main thread.
+    """
+
+    name = StringProperty()
+
+    result = ObjectProperty(None, allownone=True, force_dispatch=True)
+    '''Return value of the latest analyze() call. Dispatched for every
+    result, even one equal to the last, so results may be arrays.'''
+
+    result_timestamp = NumericProperty(0.)
+    '''Timestamp of the frame result was computed from.'''
+
+    frames_analyzed = NumericProperty(0)
+    frames_dropped = NumericProperty(0)
+    errors = NumericProperty(0)
+
+    @abstractmethod
+    def analyze(self, frame, timestamp):
+        """Analyze one frame and return the result.
+
+        frame is a read-only (height, width, 4) uint8 RGBA array, top row
+        first. Called on a worker thread, never concurrently for the same
+        plugin.
+        """
+
+
+class FrameAnalyzer:
+    """Runs registered AnalysisPlugins over submitted frames on a pool of
+    max_workers threads, dropping stale frames for plugins that fall
+    behind.
+
+    Frames are downsampled by the camera to fit within max_size.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_workers=2):
+        self.max_size = tuple(max_size)
+        self.plugins = []
+        self.frames_submitted = 0
+        self.conversion_errors = 0
+
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='FrameAnalyzer')
+        self._lock = threading.Lock()
+        # Plugins with an analysis running, and the frame each will take
+        # next
+        self._busy = set()
+        self._pending = {}
+
+    def register(self, plugin):
+        if plugin in self.plugins:
+            raise ValueError("Analysis plugin {} is already registered".format(plugin))
+        self.plugins.append(plugin)
+
+    def unregister(self, plugin):
+        self.plugins.remove(plugin)
+        with self._lock:
+            self._pending.pop(plugin, None)
+
+    def submit(self, frame, timestamp):
+        """Queue a frame for every registered plugin. Called on the main
+        thread; the frame must not be modified afterwards.
+        """
+        self.frames_submitted += 1
+        for plugin in self.plugins:
+            with self._lock:
+                if plugin in self._busy:
+                    if plugin in self._pending:
+                        plugin.frames_dropped += 1
+                    self._pending[plugin] = (frame, timestamp)
+                    continue
+                self._busy.add(plugin)
+            self._executor.submit(self._run, plugin, frame, timestamp)
+
+    def submit_conversion(self, convert, timestamp, done=None):
+        """Call convert() on a worker thread and submit the frame it
+        returns, for frames that are themselves costly to produce (see
+        PyCameraDevice.cpu_preview). done, if given, is called on the
+        main thread afterwards, whether or not convert succeeded. Called
+        on the main thread.
+        """
+        self._executor.submit(self._convert, convert, timestamp, done)
+
+    def _convert(self, convert, timestamp, done):
+        try:
+            frame = convert()
+        except Exception:
+            camera_event_queue.post(self._converted, traceback.format_exc(), timestamp, done, True)
+        else:
+            camera_event_queue.post(self._converted, frame, timestamp, done, False)
+
+    def _converted(self, frame, timestamp, done, failed):
+        if done is not None:
+            done()
+        if failed:
+            # Like plugin errors, a broken conversion would log every frame
+            if not self.conversion_errors:
+                logger.error("Frame conversion failed, further errors are only counted:\n{}".format(frame))
+            self.conversion_errors += 1
+        elif self.plugins:
+            self.submit(frame, timestamp)
+
+    def _run(self, plugin, frame, timestamp):
+        # Keep analyzing for this plugin while frames arrived in the
+        # meantime
+        while True:
+            try:
+                result = plugin.analyze(frame, timestamp)
+            except Exception:
+                camera_event_queue.post(self._deliver, plugin, traceback.format_exc(), timestamp, True)
+            else:
+                camera_event_queue.post(self._deliver, plugin, result, timestamp, False)
+
+            with self._lock:
+                pending = self._pending.pop(plugin, None)
+                if pending is None:
+                    self._busy.discard(plugin)
+                    return
+            frame, timestamp = pending
+
+    def _deliver(self, plugin, result, timestamp, failed):
+        if plugin not in self.plugins:
+            # Unregistered while its analysis was running
+            return
+        if failed:
+            # A broken plugin would otherwise log every frame
+            if not plugin.errors:
+                logger.error("Analysis plugin {} failed, further errors are only counted:\n{}".format(
+                    plugin.name or plugin, result))
+            plugin.errors += 1
+            return
+        plugin.result = result
+        plugin.result_timestamp = timestamp
+        plugin.frames_analyzed += 1
+
+    def shutdown(self, wait=False):
+        """Unregister every plugin and stop the worker threads."""
+        self.plugins = []
+        with self._lock:
+            self._pending.clear()
+        self._executor.shutdown(wait=wait)
+
+
+class ColourNamePlugin(AnalysisPlugin):
+    """Names the colour at the centre of the frame, e.g. for reading out
+    colours the user can't tell apart.
+    """
+
+    name = StringProperty('colour_name')
+
+    COLOURS = {
+        'black': (0, 0, 0), 'white': (255, 255, 255), 'grey': (128, 128, 128),
+        'red': (220, 30, 30), 'orange': (245, 140, 20), 'yellow': (245, 225, 40),
+        'green': (40, 170, 60), 'cyan': (40, 200, 210), 'blue': (30, 70, 210),
+        'purple': (130, 50, 170), 'pink': (245, 150, 190), 'brown': (130, 80, 40),
+    }
+
+    def __init__(self, sample_fraction=0.1, **kwargs):
+        from audit import srgb_to_lab
+
+        super().__init__(**kwargs)
+        self.sample_fraction = sample_fraction
+        self._srgb_to_lab = srgb_to_lab
+        self._names = list(self.COLOURS)
+        self._labs = srgb_to_lab(np.array(list(self.COLOURS.values()), dtype=np.uint8))
+
+    def analyze(self, frame, timestamp):
+        height, width = frame.shape[:2]
+        half_height = max(1, int(height * self.sample_fraction / 2))
+        half_width = max(1, int(width * self.sample_fraction / 2))
+        centre = frame[height // 2 - half_height:height // 2 + half_height,
+                       width // 2 - half_width:width // 2 + half_width, :3]
+        colour = centre.reshape(-1, 3).mean(axis=0)
+
+        lab = self._srgb_to_lab(colour)
+        return self._names[int(np.argmin(np.linalg.norm(self._labs - lab, axis=-1)))]
@@ -0,0 +1,274 @@
+"""
+Palette-level colour blindness audit of screenshots and design mockups.
+
+Each image is reduced to its dominant palette by quantizing every
+channel to a few bits and counting the occupied bins, which is a single
+vectorised pass over the pixels. The palette is then simulated for
+protanopia, deuteranopia and tritanopia with the same registry models
+the camera shader is generated from (see simulation.py), and every
+pair of palette colours that is distinguishable in the original but
+falls below the perceptual distance threshold after simulation is
+reported. Distances are CIE76 delta E in CIELAB.
+
+Comparing palette colours rather than pixels keeps the work
+independent of the image size, so the audit can run on every UI build.
+
+Usage:
+    python audit.py screenshot.png [more.png | directory ...]
+                    [--colours 16] [--threshold 10] [--model machado]
+                    [--severity 1.0] [--linearize]
+                    [--coverage-dir coverage/] [--json report.json]
+                    [--fail-on-collapse]
+
+With --coverage-dir, a coverage map is written per image and
+deficiency, showing the pixels whose colours collapse in full colour
+and dimming everything else. With --fail-on-collapse, the exit status
+is 1 if any image has a collapsing pair, for use in CI.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import cpuengine
+from simulation import DEFAULT_MODEL
+
+DEFICIENCIES = ('protanopia', 'deuteranopia', 'tritanopia')
+
+# CIE76 delta E below which two colours are treated as the same. Around
+# 2.3 is a just noticeable difference; UI colours that need telling
+# apart should be much further apart than that.
+DEFAULT_THRESHOLD = 10.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+# D65 white point of sRGB, in XYZ
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+SRGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+
+
+class Palette:
+    """The dominant colours of an image.
+
+    colours is a uint8 (n, 3) array, most common first, and coverage the
+    fraction of the image's pixels in each. labels is an int16 array of
+    the image's shape giving each pixel's palette index, or -1 for
+    pixels whose colour didn't make the palette.
+    """
+
+    __slots__ = ('colours', 'coverage', 'labels')
+
+    def __init__(self, colours, coverage, labels):
+        self.colours = colours
+        self.coverage = coverage
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.colours)
+
+
+def extract_palette(image, max_colours=16, bits=4, min_coverage=0.001):
+    """Return the dominant Palette of a uint8 RGB(A) image.
+
+    Each channel is quantized to bits bits, and the max_colours most
+    populated bins covering at least min_coverage of the image are kept.
+    Each palette colour is the mean of the pixels in its bin, so flat
+    UI colours come out exactly.
+    """
+    rgb = np.asarray(image)[..., :3]
+    shift = 8 - bits
+    quantized = (rgb >> shift).astype(np.int32)
+    bins = (quantized[..., 0] << (2 * bits)) | (quantized[..., 1] << bits) | quantized[..., 2]
+
+    flat_bins = bins.ravel()
+    bin_count = 1 << (3 * bits)
+    counts = np.bincount(flat_bins, minlength=bin_count)
+
+    order = np.argsort(counts, kind='stable')[::-1][:max_colours]
+    order = order[counts[order] >= max(1, min_coverage * flat_bins.size)]
+
+    sums = np.stack([
+        np.bincount(flat_bins, weights=rgb[..., channel].ravel(), minlength=bin_count)[order]
+        for channel in range(3)], axis=-1)
+    colours = np.rint(sums / counts[order][:, np.newaxis]).astype(np.uint8)
+
+    lookup = np.full(bin_count, -1, dtype=np.int16)
+    lookup[order] = np.arange(len(order))
+
+    return Palette(colours, counts[order] / flat_bins.size, lookup[bins])
+
+
+def srgb_to_lab(rgb):
+    """Convert uint8 sRGB colours of shape (..., 3) to CIELAB."""
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ SRGB_TO_XYZ.T / D65_WHITE
+
+    epsilon = 216. / 24389.
+    kappa = 24389. / 27.
+    f = np.where(xyz > epsilon, np.cbrt(xyz), (kappa * xyz + 16.) / 116.)
+
+    return np.stack([116. * f[..., 1] - 16.,
+                     500. * (f[..., 0] - f[..., 1]),
+                     200. * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def pairwise_delta_e(lab):
+    """Return the (n, n) CIE76 distances between n Lab colours."""
+    return np.linalg.norm(lab[:, np.newaxis, :] - lab[np.newaxis, :, :], axis=-1)
+
+
+def hex_colour(colour):
+    return '#{:02x}{:02x}{:02x}'.format(*(int(value) for value in colour))
+
+
+def collapsing_pairs(palette, transformation, threshold=DEFAULT_THRESHOLD, severity=1.0,
+                     linearize=False, model=DEFAULT_MODEL):
+    """Return (i, j, delta_e, simulated_delta_e) for each pair of palette
+    colours at least threshold apart that are less than threshold apart
+    after simulating the given transformation, largest coverage first.
+    """
+    if not len(palette):
+        return []
+
+    simulated = cpuengine.simulate(
+        palette.colours[np.newaxis], transformation, severity,
+        linearize=linearize, model=model, memoize=False)[0]
+
+    original_distances = pairwise_delta_e(srgb_to_lab(palette.colours))
+    simulated_distances = pairwise_delta_e(srgb_to_lab(simulated))
+
+    collapsed = (original_distances >= threshold) & (simulated_distances < threshold)
+    rows, columns = np.nonzero(np.triu(collapsed, 1))
+
+    pairs = [(int(i), int(j), float(original_distances[i, j]), float(simulated_distances[i, j]))
+             for i, j in zip(rows, columns)]
+    pairs.sort(key=lambda pair: palette.coverage[pair[0]] + palette.coverage[pair[1]], reverse=True)
+    return pairs
+
+
+def coverage_mask(palette, pairs):
+    """Return a boolean mask of the pixels whose colour is in any of the
+    given pairs.
+    """
+    involved = np.zeros(len(palette) + 1, dtype=np.bool_)
+    for i, j, _, _ in pairs:
+        involved[i] = involved[j] = True
+    # Index -1 (pixels outside the palette) maps to the final False entry
+    return involved[palette.labels]
+
+
+def coverage_map(image, mask, dim=0.2):
+    """Return a uint8 RGB copy of image with the pixels outside mask
+    dimmed.
+    """
+    output = np.array(np.asarray(image)[..., :3])
+    output[~mask] = (output[~mask] * dim).astype(np.uint8)
+    return output
+
+
+def audit_image(image, threshold=DEFAULT_THRESHOLD, max_colours=16, severity=1.0,
+                linearize=False, model=DEFAULT_MODEL, deficiencies=DEFICIENCIES):
+    """Audit a uint8 RGB(A) image, returning (report, palette, masks).
+
+    report is a JSON-serialisable dict, and masks maps each deficiency
+    to the coverage mask of its collapsing pairs.
+    """
+    palette = extract_palette(image, max_colours)
+
+    report = {
+        'palette': [{'colour': hex_colour(colour), 'coverage': float(coverage)}
+                    for colour, coverage in zip(palette.colours, palette.coverage)],
+        'deficiencies': {},
+    }
+    masks = {}
+    for transformation in deficiencies:
+        pairs = collapsing_pairs(palette, transformation, threshold, severity, linearize, model)
+        masks[transformation] = coverage_mask(palette, pairs)
+        report['deficiencies'][transformation] = {
+            'affected_coverage': float(masks[transformation].mean()) if pairs else 0.,
+            'collapsing_pairs': [
+                {'colours': [hex_colour(palette.colours[i]), hex_colour(palette.colours[j])],
+                 'coverage': [float(palette.coverage[i]), float(palette.coverage[j])],
+                 'delta_e': round(delta_e, 2),
+                 'simulated_delta_e': round(simulated_delta_e, 2)}
+                for i, j, delta_e, simulated_delta_e in pairs],
+        }
+    return report, palette, masks
+
+
+def find_images(paths):
+    """Expand directories in paths to the image files they contain."""
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(path, filename)
+        else:
+            yield path
+
+
+def load_image(filename):
+    from PIL import Image
+    with Image.open(filename) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit images for colours that collapse under colour blindness")
+    parser.add_argument('paths', nargs='+', help="Image files, or directories of images")
+    parser.add_argument('--colours', type=int, default=16, help="Maximum palette size")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="CIE76 delta E below which colours are indistinguishable")
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--severity', type=float, default=1.0)
+    parser.add_argument('--linearize', action='store_true')
+    parser.add_argument('--coverage-dir', help="Directory to write coverage map PNGs to")
+    parser.add_argument('--json', help="File to write the full report to")
+    parser.add_argument('--fail-on-collapse', action='store_true',
+                        help="Exit with status 1 if any image has collapsing colours")
+    args = parser.parse_args(argv)
+
+    if args.coverage_dir is not None:
+        from PIL import Image
+        os.makedirs(args.coverage_dir, exist_ok=True)
+
+    reports = {}
+    any_collapse = False
+    for filename in find_images(args.paths):
+        image = load_image(filename)
+        report, palette, masks = audit_image(
+            image, args.threshold, args.colours, args.severity, args.linearize, args.model)
+        reports[filename] = report
+
+        print("{}: {} palette colours".format(filename, len(palette)))
+        for transformation, result in report['deficiencies'].items():
+            pairs = result['collapsing_pairs']
+            any_collapse = any_collapse or bool(pairs)
+            print("  {:<13} {} collapsing pairs, {:.1%} of pixels affected".format(
+                transformation, len(pairs), result['affected_coverage']))
+            for pair in pairs:
+                print("    {} / {}  delta E {:.1f} -> {:.1f}".format(
+                    pair['colours'][0], pair['colours'][1], pair['delta_e'], pair['simulated_delta_e']))
+
+            if args.coverage_dir is not None and pairs:
+                name = os.path.splitext(os.path.basename(filename))[0]
+                Image.fromarray(coverage_map(image, masks[transformation])).save(
+                    os.path.join(args.coverage_dir, '{}_{}.png'.format(name, transformation)))
+
+    if args.json is not None:
+        with open(args.json, 'w') as fileh:
+            json.dump({'threshold': args.threshold, 'model': args.model,
+                       'severity': args.severity, 'images': reports}, fileh, indent=2)
+
+    return 1 if args.fail_on_collapse and any_collapse else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,637 @@
+"""
+Resumable colour blindness simulation of large image sets, sharded
+across worker processes on one or more machines.
+
+A job simulates each transformation for every image under the input
+paths with cpuengine, writing <output>/<transformation>/<name>.png. The
+images are split into shards of a few images each, and a coordinator
+hands the shards out one at a time to the workers connected to it, so
+faster workers take more shards. Each worker shares one ColourCache
+across every shard it processes.
+
+Once all of a shard's outputs are written, the shard is appended to
+<output>/manifest.jsonl. Running the same job again skips the shards
+already recorded there, so an interrupted run resumes where it stopped.
+A job whose images or settings differ from the manifest's is refused
+rather than mixing their outputs. Shards that fail, or whose worker
+disconnects, are retried on another worker, and are left for the next
+run after max_attempts.
+
+Usage, with four worker processes on this machine:
+
+    python batchjob.py run images/ [more/ ...] --output simulated/
+                       [--local-workers 4] [--shard-size 8]
+                       [--transformations protanopia,deuteranopia,tritanopia]
+                       [--severity 1.0] [--model machado] [--linearize]
+                       [--host 127.0.0.1] [--port 0] [--report report.json]
+
+Workers on other machines connect with
+
+    python batchjob.py worker coordinator-host:port
+
+given a coordinator run with --host 0.0.0.0 and a fixed --port. Workers
+need no access to the images: the coordinator sends them the encoded
+image files and receives PNGs back. The protocol has no authentication,
+so only listen on trusted networks.
+
+Messages in both directions are a big-endian uint32 header length and
+uint32 payload length, a JSON header, then the payload: binary blobs
+concatenated, with their sizes listed in the header.
+
+The throughput of the run is printed at the end, overall and per worker,
+and written to --report as JSON.
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import time
+import traceback
+
+import numpy as np
+
+import cpuengine
+from audit import DEFICIENCIES, find_images
+from simulation import DEFAULT_MODEL, DEFAULT_MONOCHROMACY_MODEL
+
+logger = logging.getLogger(__file__)
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+DEFAULT_SHARD_SIZE = 8
+
+MESSAGE_LENGTHS = struct.Struct('>II')
+
+
+def encode_message(header, blobs=()):
+    """Return the bytes of a message with the given JSON-serialisable
+    header and binary blobs.
+    """
+    header = dict(header, sizes=[len(blob) for blob in blobs])
+    header_bytes = json.dumps(header).encode()
+    payload = b''.join(blobs)
+    return MESSAGE_LENGTHS.pack(len(header_bytes), len(payload)) + header_bytes + payload
+
+
+def decode_message(header_bytes, payload):
+    header = json.loads(header_bytes.decode())
+    blobs = []
+    offset = 0
+    for size in header.pop('sizes', ()):
+        blobs.append(payload[offset:offset + size])
+        offset += size
+    return header, blobs
+
+
+async def read_message(reader):
+    """Read a (header, blobs) message from an asyncio StreamReader.
+
+    Raises asyncio.IncompleteReadError if the connection closes.
+    """
+    header_length, payload_length = MESSAGE_LENGTHS.unpack(await reader.readexactly(MESSAGE_LENGTHS.size))
+    header_bytes = await reader.readexactly(header_length)
+    return decode_message(header_bytes, await reader.readexactly(payload_length))
+
+
+def receive_message(stream):
+    """Read a (header, blobs) message from a binary file object, or
+    return (None, None) if the connection closed.
+    """
+    def read_exactly(size):
+        data = stream.read(size)
+        if len(data) < size:
+            raise EOFError()
+        return data
+
+    try:
+        header_length, payload_length = MESSAGE_LENGTHS.unpack(read_exactly(MESSAGE_LENGTHS.size))
+        header_bytes = read_exactly(header_length)
+        return decode_message(header_bytes, read_exactly(payload_length))
+    except EOFError:
+        return None, None
+
+
+def fsync_directory(path):
+    """Flush renames into the directory at path to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_png(image):
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.fromarray(image).save(output, format='PNG')
+    return output.getvalue()
+
+
+class BatchJob:
+    """The images to simulate and the simulation settings, split into
+    shards of shard_size images.
+
+    Images are sorted by path, so the same inputs always give the same
+    shards. Outputs are named after the images, so image names (without
+    extension) must be unique.
+    """
+
+    def __init__(self, paths, output, transformations=DEFICIENCIES, severity=1.0, linearize=False,
+                 model=DEFAULT_MODEL, monochromacy_model=DEFAULT_MONOCHROMACY_MODEL,
+                 shard_size=DEFAULT_SHARD_SIZE):
+        if shard_size < 1:
+            raise ValueError("shard_size must be at least 1, got {}".format(shard_size))
+
+        self.images = sorted(set(os.path.abspath(path) for path in find_images(paths)))
+        if not self.images:
+            raise ValueError("No images found in {}".format(paths))
+        self.names = {}
+        for image in self.images:
+            name = self.output_name(image)
+            if name in self.names:
+                raise ValueError("Images {} and {} would have the same outputs".format(self.names[name], image))
+            self.names[name] = image
+
+        self.output = output
+        self.transformations = list(transformations)
+        self.settings = {'severity': float(severity), 'linearize': bool(linearize),
+                         'model': model, 'monochromacy_model': monochromacy_model}
+        self.shard_size = shard_size
+        self.shards = [self.images[start:start + shard_size]
+                       for start in range(0, len(self.images), shard_size)]
+
+    @staticmethod
+    def output_name(image):
+        return os.path.splitext(os.path.basename(image))[0]
+
+    def output_path(self, name, transformation):
+        return os.path.join(self.output, transformation, name + '.png')
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.output, MANIFEST_NAME)
+
+    def fingerprint(self):
+        """Return a hash of everything determining the job's outputs and
+        shards: the images (by path and size), transformations, settings
+        and shard size.
+        """
+        description = {
+            'images': [(image, os.path.getsize(image)) for image in self.images],
+            'transformations': self.transformations,
+            'settings': self.settings,
+            'shard_size': self.shard_size,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """Append-only JSON lines record of a job's completed shards.
+
+    Each entry is flushed to disk as it is appended. A last line cut
+    short by a crash is ignored, and removed before appending.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as fileh:
+            data = fileh.read()
+        return [json.loads(line) for line in data.split(b'\n')[:-1] if line.strip()]
+
+    def start(self, job):
+        """Record job in the manifest if it is new, and return the indices
+        of its completed shards.
+
+        Raises ValueError if the manifest belongs to a different job.
+        """
+        self._truncate_partial_line()
+        entries = self.entries()
+        fingerprint = job.fingerprint()
+
+        jobs = [entry for entry in entries if entry['type'] == 'job']
+        if not jobs:
+            self.append({'type': 'job', 'fingerprint': fingerprint, 'images': len(job.images),
+                         'shards': len(job.shards), 'transformations': job.transformations,
+                         'settings': job.settings, 'shard_size': job.shard_size, 'time': time.time()})
+            return set()
+        if jobs[0]['fingerprint'] != fingerprint:
+            raise ValueError("{} records a different job; use another output directory, or delete it "
+                             "to start over".format(self.path))
+        return {entry['shard'] for entry in entries if entry['type'] == 'shard'}
+
+    def append(self, entry):
+        with open(self.path, 'a') as fileh:
+            fileh.write(json.dumps(entry) + '\n')
+            fileh.flush()
+            os.fsync(fileh.fileno())
+
+    def _truncate_partial_line(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as fileh:
+            data = fileh.read()
+            if data and not data.endswith(b'\n'):
+                logger.warning("Discarding incomplete last line of {}".format(self.path))
+                fileh.truncate(data.rfind(b'\n') + 1)
+
+
+class WorkerStats:
+    """Work done by one worker during a run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.shards = 0
+        self.images = 0
+        self.pixels = 0
+        self.busy_seconds = 0.
+        self.failures = 0
+
+    def report(self):
+        return {'shards': self.shards, 'images': self.images,
+                'megapixels': round(self.pixels / 1e6, 3),
+                'busy_seconds': round(self.busy_seconds, 3), 'failures': self.failures,
+                'images_per_second': round(self.images / self.busy_seconds, 3) if self.busy_seconds else 0.}
+
+
+class Coordinator:
+    """Asyncio TCP server handing a BatchJob's remaining shards to the
+    workers that connect to it, and recording their results in the
+    job's manifest.
+    """
+
+    def __init__(self, job, host='127.0.0.1', port=0, max_attempts=3):
+        self.job = job
+        self.host = host
+        self.port = port
+        self.max_attempts = max_attempts
+
+        self.manifest = Manifest(job.manifest_path)
+        self.skipped_shards = 0
+        self.failed_shards = set()
+        self.workers = {}
+
+        self._pending = collections.deque()
+        self._in_progress = set()
+        self._attempts = collections.Counter()
+        self._connected = 0
+        self._changed = None
+        self._server = None
+
+    @property
+    def finished(self):
+        return not self._pending and not self._in_progress
+
+    async def start(self):
+        os.makedirs(self.job.output, exist_ok=True)
+        for transformation in self.job.transformations:
+            os.makedirs(os.path.join(self.job.output, transformation), exist_ok=True)
+
+        completed = self.manifest.start(self.job)
+        self.skipped_shards = len(completed)
+        self._pending.extend(index for index in range(len(self.job.shards)) if index not in completed)
+        self._changed = asyncio.Condition()
+
+        self._server = await asyncio.start_server(self._handle_worker, self.host, self.port)
+        # Port 0 binds an arbitrary free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Coordinating {} of {} shards on {}:{}".format(
+            len(self._pending), len(self.job.shards), self.host, self.port))
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def run(self, local_workers=0):
+        """Run the job to completion, with local_workers worker processes
+        started on this machine in addition to any connecting remotely,
+        and return the throughput report.
+
+        Raises RuntimeError if every local worker exits with shards left
+        and no remote worker is connected.
+        """
+        start_time = time.perf_counter()
+        await self.start()
+
+        processes = []
+        host = '127.0.0.1' if self.host in ('', '0.0.0.0') else self.host
+        # Nothing to start workers for if every shard is already complete
+        for index in range(local_workers if not self.finished else 0):
+            processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), 'worker', '{}:{}'.format(host, self.port),
+                '--name', '{}-local{}'.format(socket.gethostname(), index)))
+
+        try:
+            async with self._changed:
+                while not self.finished:
+                    if processes and self._connected == 0 and \
+                            all(process.returncode is not None for process in processes):
+                        raise RuntimeError("All workers exited with {} shards left".format(
+                            len(self._pending) + len(self._in_progress)))
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), 1.)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await self.stop()
+            for process in processes:
+                if process.returncode is None:
+                    try:
+                        await asyncio.wait_for(process.wait(), 10.)
+                    except asyncio.TimeoutError:
+                        process.kill()
+                        await process.wait()
+
+        return self.report(time.perf_counter() - start_time)
+
+    async def _next_shard(self):
+        """Return the index of the next shard to process, or None once
+        there are none left. Waits while shards are in progress, in case
+        they fail and need another worker.
+        """
+        async with self._changed:
+            while not self._pending:
+                if not self._in_progress:
+                    return None
+                await self._changed.wait()
+            index = self._pending.popleft()
+            self._in_progress.add(index)
+            return index
+
+    async def _shard_finished(self, index, failure=None):
+        async with self._changed:
+            self._in_progress.discard(index)
+            if failure is not None:
+                self._attempts[index] += 1
+                if self._attempts[index] < self.max_attempts:
+                    logger.warning("Shard {} failed, retrying: {}".format(index, failure))
+                    self._pending.append(index)
+                else:
+                    logger.error("Shard {} failed {} times, leaving it for the next run: {}".format(
+                        index, self._attempts[index], failure))
+                    self.failed_shards.add(index)
+            self._changed.notify_all()
+
+    async def _handle_worker(self, reader, writer):
+        try:
+            hello, _ = await read_message(reader)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            writer.close()
+            return
+
+        name = hello.get('worker') or 'worker'
+        while name in self.workers:
+            name += "'"
+        stats = self.workers[name] = WorkerStats(name)
+        self._connected += 1
+        logger.info("Worker {} connected".format(name))
+
+        try:
+            while True:
+                index = await self._next_shard()
+                if index is None:
+                    writer.write(encode_message({'type': 'done'}))
+                    await writer.drain()
+                    return
+
+                # Whatever goes wrong, the shard is released for retrying,
+                # so no other worker waits on it forever
+                try:
+                    blobs = self._read_shard(index)
+                except OSError as error:
+                    await self._shard_finished(index, "reading shard: {!r}".format(error))
+                    continue
+
+                failure = "worker {} disconnected".format(name)
+                try:
+                    failure = await self._serve_shard(index, name, stats, blobs, reader, writer)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    return
+                except Exception as error:
+                    # The message stream may be out of step, so drop the
+                    # worker rather than serve it another shard
+                    logger.debug("Serving shard {} to worker {} failed".format(index, name), exc_info=True)
+                    failure = "serving worker {}: {!r}".format(name, error)
+                    return
+                finally:
+                    await self._shard_finished(index, failure)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connected -= 1
+            async with self._changed:
+                self._changed.notify_all()
+            writer.close()
+
+    def _read_shard(self, index):
+        """Return the encoded image files of a shard."""
+        blobs = []
+        for image in self.job.shards[index]:
+            with open(image, 'rb') as fileh:
+                blobs.append(fileh.read())
+        return blobs
+
+    async def _serve_shard(self, index, worker, stats, blobs, reader, writer):
+        """Have worker process a shard, given its images, and save its
+        results, returning None, or the failure the worker reported.
+        """
+        images = self.job.shards[index]
+        writer.write(encode_message({
+            'type': 'shard', 'shard': index, 'names': [self.job.output_name(image) for image in images],
+            'transformations': self.job.transformations, 'settings': self.job.settings}, blobs))
+        await writer.drain()
+
+        header, blobs = await read_message(reader)
+        if header['type'] == 'error':
+            stats.failures += 1
+            return "worker {}: {}".format(worker, header['message'])
+        if header['type'] != 'result' or header['shard'] != index or \
+                len(header['outputs']) != len(blobs) or \
+                len(header['outputs']) != len(images) * len(self.job.transformations):
+            raise ValueError("Unexpected reply to shard {}: {}".format(index, header))
+        self._save_results(index, worker, header, blobs, stats)
+        return None
+
+    def _save_results(self, index, worker, header, blobs, stats):
+        directories = set()
+        for (name, transformation), data in zip(header['outputs'], blobs):
+            path = self.job.output_path(name, transformation)
+            # Written whole or not at all, should the coordinator crash
+            with open(path + '.tmp', 'wb') as fileh:
+                fileh.write(data)
+                fileh.flush()
+                os.fsync(fileh.fileno())
+            os.replace(path + '.tmp', path)
+            directories.add(os.path.dirname(path))
+
+        # The outputs and their renames must be on disk before the
+        # manifest vouches for them, or a power loss could leave a
+        # completed shard with missing or empty outputs
+        for directory in directories:
+            fsync_directory(directory)
+
+        images = len(self.job.shards[index])
+        self.manifest.append({'type': 'shard', 'shard': index, 'images': images, 'pixels': header['pixels'],
+                              'seconds': round(header['seconds'], 3), 'worker': worker, 'time': time.time()})
+        stats.shards += 1
+        stats.images += images
+        stats.pixels += header['pixels']
+        stats.busy_seconds += header['seconds']
+
+    def report(self, wall_seconds):
+        """Return the throughput of the shards processed in this run, over
+        wall_seconds, overall and per worker.
+        """
+        images = sum(stats.images for stats in self.workers.values())
+        pixels = sum(stats.pixels for stats in self.workers.values())
+        return {
+            'shards': len(self.job.shards),
+            'shards_processed': sum(stats.shards for stats in self.workers.values()),
+            'shards_skipped': self.skipped_shards,
+            'shards_failed': sorted(self.failed_shards),
+            'images': images,
+            'outputs': images * len(self.job.transformations),
+            'megapixels': round(pixels / 1e6, 3),
+            'wall_seconds': round(wall_seconds, 3),
+            'images_per_second': round(images / wall_seconds, 3) if wall_seconds else 0.,
+            'megapixels_per_second': round(pixels / 1e6 / wall_seconds, 3) if wall_seconds else 0.,
+            'workers': {name: stats.report() for name, stats in self.workers.items()},
+        }
+
+
+def process_shard(header, blobs, cache=None):
+    """Simulate a shard message's images, returning the result header and
+    the encoded PNGs.
+    """
+    from PIL import Image
+
+    start = time.perf_counter()
+    settings = header['settings']
+    outputs = []
+    pngs = []
+    pixels = 0
+    for name, data in zip(header['names'], blobs):
+        with Image.open(io.BytesIO(data)) as image:
+            rgb = np.asarray(image.convert('RGB'))
+        pixels += rgb.shape[0] * rgb.shape[1]
+        for transformation in header['transformations']:
+            simulated = cpuengine.simulate(rgb, transformation, settings['severity'], settings['linearize'],
+                                           settings['model'], settings['monochromacy_model'], cache=cache)
+            outputs.append([name, transformation])
+            pngs.append(encode_png(simulated))
+    result = {'type': 'result', 'shard': header['shard'], 'outputs': outputs, 'pixels': pixels,
+              'seconds': time.perf_counter() - start}
+    return result, pngs
+
+
+def run_worker(host, port, name=None):
+    """Process shards from the coordinator at host:port until it has no
+    more, returning the number of shards processed.
+    """
+    name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+    cache = cpuengine.ColourCache()
+    shards = 0
+
+    with socket.create_connection((host, port)) as connection:
+        stream = connection.makefile('rwb')
+        stream.write(encode_message({'type': 'hello', 'worker': name}))
+        stream.flush()
+
+        while True:
+            header, blobs = receive_message(stream)
+            if header is None or header['type'] == 'done':
+                return shards
+
+            try:
+                result, pngs = process_shard(header, blobs, cache)
+            except Exception:
+                logger.error("Shard {} failed:\n{}".format(header['shard'], traceback.format_exc()))
+                message = encode_message({'type': 'error', 'shard': header['shard'],
+                                          'message': traceback.format_exc(limit=1).strip()})
+            else:
+                shards += 1
+                message = encode_message(result, pngs)
+            stream.write(message)
+            stream.flush()
+
+
+def print_report(report):
+    print("{images} images ({megapixels} MP) in {shards_processed} shards in {wall_seconds}s: "
+          "{images_per_second} images/s, {megapixels_per_second} MP/s".format(**report))
+    if report['shards_skipped']:
+        print("{} shards already completed".format(report['shards_skipped']))
+    print("{:<32} {:>7} {:>7} {:>9} {:>9} {:>9}".format('worker', 'shards', 'images', 'MP', 'busy s', 'images/s'))
+    for name, stats in sorted(report['workers'].items()):
+        print("{:<32} {shards:>7} {images:>7} {megapixels:>9.2f} {busy_seconds:>9.2f} {images_per_second:>9.2f}".format(
+            name, **stats))
+    if report['shards_failed']:
+        print("FAILED shards, left for the next run: {}".format(report['shards_failed']))
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Coordinate a job, resuming it if interrupted")
+    run_parser.add_argument('paths', nargs='+', help="Image files, or directories of images")
+    run_parser.add_argument('--output', required=True, help="Directory for the outputs and the manifest")
+    run_parser.add_argument('--local-workers', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes to start on this machine")
+    run_parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    run_parser.add_argument('--transformations', default=','.join(DEFICIENCIES))
+    run_parser.add_argument('--severity', type=float, default=1.0)
+    run_parser.add_argument('--model', default=DEFAULT_MODEL)
+    run_parser.add_argument('--monochromacy-model', default=DEFAULT_MONOCHROMACY_MODEL)
+    run_parser.add_argument('--linearize', action='store_true')
+    run_parser.add_argument('--host', default='127.0.0.1')
+    run_parser.add_argument('--port', type=int, default=0)
+    run_parser.add_argument('--max-attempts', type=int, default=3, help="Attempts per shard per run")
+    run_parser.add_argument('--report', help="Write the throughput report to this JSON file")
+
+    worker_parser = subparsers.add_parser('worker', help="Process shards for a coordinator")
+    worker_parser.add_argument('address', type=parse_address, help="Coordinator host:port")
+    worker_parser.add_argument('--name', help="Name in the throughput report")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'worker':
+        try:
+            run_worker(*args.address, name=args.name)
+        except ConnectionError as error:
+            logger.error("Lost connection to the coordinator: {}".format(error))
+            return 1
+        return 0
+
+    job = BatchJob(args.paths, args.output, args.transformations.split(','), args.severity,
+                   args.linearize, args.model, args.monochromacy_model, args.shard_size)
+    coordinator = Coordinator(job, args.host, args.port, args.max_attempts)
+    report = asyncio.run(coordinator.run(args.local_workers))
+
+    print_report(report)
+    if args.report is not None:
+        with open(args.report, 'w') as fileh:
+            json.dump(report, fileh, indent=2)
+    return 1 if report['shards_failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
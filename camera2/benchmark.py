@@ -0,0 +1,258 @@
+"""
+Benchmark of the GPU cost of the colour blindness shader variants,
+reproducible without a GPU or a phone.
+
+Each variant (every registered simulation model, with each combination
+of daltonize, linearize and colorimetric_modification) is rendered
+offscreen through a Kivy Fbo, at each resolution and float precision.
+Costs are reported relative to a passthrough shader at the same
+resolution and precision, which cancels out most of the speed of the
+machine, so the relative costs can be compared against a saved
+baseline and the run failed on regressions.
+
+Run under Mesa's software renderer (llvmpipe), e.g. in CI:
+
+    LIBGL_ALWAYS_SOFTWARE=1 SDL_VIDEODRIVER=offscreen \\
+        python benchmark.py [--resolutions 640x480,1280x720]
+                            [--precisions highp,mediump] [--frames 20]
+                            [--rounds 3]
+                            [--save-baseline benchmark.json]
+                            [--baseline benchmark.json] [--tolerance 0.25]
+
+The exit status is 1 if any variant's relative cost exceeds its
+baseline by more than the tolerance.
+
+Precision qualifiers only take effect on OpenGL ES. On desktop GL,
+which ignores them, each variant is timed once per resolution, with
+its precision reported as 'ignored'.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import shaders
+from simulation import models, error_matrix
+
+DEFAULT_RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080))
+
+PRECISIONS = ('highp', 'mediump')
+
+# Flag uniforms, and their names in variant names
+FLAGS = {'daltonize': 'daltonize', 'linearize': 'linearize', 'colorimetric_modification': 'colorimetric'}
+
+# Every combination of the flags, named by the flags set, e.g.
+# 'daltonize+linearize'
+FLAG_SETS = {
+    '+'.join(FLAGS[flag] for flag, value in zip(FLAGS, values) if value) or 'plain':
+        dict(zip(FLAGS, values))
+    for values in itertools.product((0, 1), repeat=len(FLAGS))
+}
+
+IGNORED_PRECISION = 'ignored'
+
+PASSTHROUGH = 'passthrough'
+
+
+def with_precision(fs, precision):
+    """Return the fragment shader fs using the given float precision."""
+    if precision == IGNORED_PRECISION:
+        return fs
+    return fs.replace('precision highp float;', 'precision {} float;'.format(precision))
+
+
+def shader_variants():
+    """Yield (name, fragment shader, uniforms) for every variant, with
+    the passthrough shader first.
+    """
+    yield PASSTHROUGH, shaders.shader_normal, {}
+
+    for model in models.values():
+        # Transformations of a model share its shader, and differ only in
+        # uniform values
+        transformation = model.transformations[1]
+        uniforms = model.uniforms(transformation)
+        uniforms['error_matrix'] = error_matrix(transformation)
+        for flag_name, flags in FLAG_SETS.items():
+            variant_uniforms = dict(uniforms)
+            variant_uniforms.update(flags)
+            yield ('{}/{}'.format(model.name, flag_name),
+                   shaders.shader_for_model(model), variant_uniforms)
+
+
+class ShaderBenchmark:
+    """Renders fragment shaders over a camera-like frame in an offscreen
+    Fbo of the given resolution.
+    """
+
+    def __init__(self, resolution):
+        from kivy.base import EventLoop
+        EventLoop.ensure_window()
+
+        from kivy.graphics import Fbo, Rectangle, Color
+        from kivy.graphics.texture import Texture
+        from framesource import SyntheticFrameSource
+
+        self.resolution = tuple(resolution)
+        frame, _ = SyntheticFrameSource(self.resolution).read()
+        self.texture = Texture.create(size=self.resolution, colorfmt='rgba')
+        self.texture.blit_buffer(frame.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+
+        self.fbo = Fbo(size=self.resolution)
+        with self.fbo:
+            Color(1, 1, 1, 1)
+            Rectangle(size=self.resolution, texture=self.texture)
+
+    def time_shader(self, fs, uniforms, frames=20, batch=5, warmup=3):
+        """Return the time in seconds to render one frame with the given
+        fragment shader and uniforms.
+
+        Frames are rendered in batches of batch frames, each ended by
+        glFinish, and the fastest batch is used, since scheduling noise
+        only ever adds time.
+        """
+        from kivy.graphics.opengl import glFinish
+        from colourswidget import to_uniform_value
+
+        self.fbo.shader.fs = fs
+        if not self.fbo.shader.success:
+            raise RuntimeError("Failed to compile shader")
+
+        self.fbo['transform_cutoff'] = float(self.resolution[0])
+        for name in FLAGS:
+            self.fbo[name] = 0
+        for name, value in uniforms.items():
+            self.fbo[name] = value if isinstance(value, int) else to_uniform_value(value)
+
+        for _ in range(warmup):
+            self._draw()
+        glFinish()
+
+        durations = []
+        for _ in range(max(1, frames // batch)):
+            start = time.perf_counter()
+            for _ in range(batch):
+                self._draw()
+            glFinish()
+            durations.append((time.perf_counter() - start) / batch)
+        return min(durations)
+
+    def _draw(self):
+        self.fbo.ask_update()
+        self.fbo.draw()
+
+
+def run_benchmark(resolutions=DEFAULT_RESOLUTIONS, precisions=PRECISIONS, frames=20, rounds=3):
+    """Time every shader variant, returning a list of result dicts.
+
+    The variants are timed in turn, rounds times over, keeping each
+    one's fastest time, so that drift in the machine's speed during the
+    run affects them all alike.
+    """
+    variants = list(shader_variants())
+    results = []
+    for resolution in resolutions:
+        benchmark = ShaderBenchmark(resolution)
+        if not is_gles():
+            # Every precision would render identically
+            precisions = [IGNORED_PRECISION]
+        for precision in precisions:
+            durations = [float('inf')] * len(variants)
+            for _ in range(rounds):
+                for index, (name, fs, uniforms) in enumerate(variants):
+                    durations[index] = min(durations[index], benchmark.time_shader(
+                        with_precision(fs, precision), uniforms, frames))
+
+            passthrough_time = durations[0]
+            for (name, _, _), duration in zip(variants, durations):
+                results.append({
+                    'variant': name,
+                    'resolution': '{}x{}'.format(*resolution),
+                    'precision': precision,
+                    'ms': round(1000 * duration, 4),
+                    'relative': round(duration / passthrough_time, 4),
+                })
+    return results
+
+
+def result_key(result):
+    return (result['variant'], result['resolution'], result['precision'])
+
+
+def find_regressions(results, baseline, tolerance=0.25):
+    """Return (result, baseline relative cost) for each result whose
+    relative cost exceeds the baseline's by more than tolerance.
+    """
+    baseline_costs = {result_key(result): result['relative'] for result in baseline}
+    regressions = []
+    for result in results:
+        baseline_cost = baseline_costs.get(result_key(result))
+        if baseline_cost is not None and result['relative'] > baseline_cost * (1. + tolerance):
+            regressions.append((result, baseline_cost))
+    return regressions
+
+
+def is_gles():
+    from kivy.graphics.opengl import glGetString, GL_VERSION
+    return glGetString(GL_VERSION).decode().startswith('OpenGL ES')
+
+
+def gl_renderer():
+    from kivy.graphics.opengl import glGetString, GL_RENDERER, GL_VERSION
+    return '{} ({})'.format(glGetString(GL_RENDERER).decode(), glGetString(GL_VERSION).decode())
+
+
+def parse_resolutions(text):
+    return [tuple(int(value) for value in item.split('x')) for item in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--resolutions', type=parse_resolutions, default=DEFAULT_RESOLUTIONS,
+                        help='Comma separated, e.g. 640x480,1280x720')
+    parser.add_argument('--precisions', default=','.join(PRECISIONS))
+    parser.add_argument('--frames', type=int, default=20, help='Timed frames per variant per round')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save-baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed fractional increase in relative cost over the baseline')
+    args = parser.parse_args(argv)
+
+    precisions = args.precisions.split(',')
+    results = run_benchmark(args.resolutions, precisions, args.frames, args.rounds)
+    renderer = gl_renderer()
+
+    print("renderer: {}".format(renderer))
+    if any(result['precision'] == IGNORED_PRECISION for result in results):
+        print("precision qualifiers are ignored by this renderer, so only one precision was timed")
+    width = max(len(result['variant']) for result in results)
+    print("{:<{}} {:>10} {:>9} {:>10} {:>9}".format(
+        'variant', width, 'resolution', 'precision', 'ms', 'relative'))
+    for result in results:
+        print("{variant:<{width}} {resolution:>10} {precision:>9} {ms:>10.3f} {relative:>9.2f}".format(
+            width=width, **result))
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as fileh:
+            json.dump({'renderer': renderer, 'frames': args.frames, 'results': results}, fileh, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as fileh:
+            baseline = json.load(fileh)
+        if baseline.get('renderer') != renderer:
+            print("warning: baseline was recorded with renderer {}".format(baseline.get('renderer')))
+        regressions = find_regressions(results, baseline['results'], args.tolerance)
+        for result, baseline_cost in regressions:
+            print("REGRESSION: {} at {} {}: relative cost {:.2f}, baseline {:.2f}".format(
+                result['variant'], result['resolution'], result['precision'],
+                result['relative'], baseline_cost))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,23 @@
 from kivy.event import EventDispatcher
 from kivy.graphics.texture import Texture
 from kivy.graphics import Fbo, Callback, Rectangle
-from kivy.properties import (BooleanProperty, StringProperty, ObjectProperty, OptionProperty, ListProperty)
+from kivy.properties import (
+    BooleanProperty, StringProperty, ObjectProperty, OptionProperty, ListProperty, NumericProperty)
 from kivy.clock import Clock
 
-from jnius import autoclass, cast, PythonJavaClass, java_method, JavaClass, MetaJavaClass, JavaMethod
+from jnius import autoclass, cast, detach, PythonJavaClass, java_method, JavaClass, MetaJavaClass, JavaMethod
 
 import logging
 from enum import Enum
+from functools import partial
+
+from cameraevents import camera_event_queue
+from lifecycle import CAMERA_STATES, check_transition, resource_ledger
+from zoom import (
+    FULL_FRAME, ROI_UPDATE_DELAY, tex_coords_for_region, region_pixel_size, region_within, with_frame_aspect,
+    crop_rect, is_centered)
+from framerate import (
+    POWER_MODES, POWER_SAVING_FPS, CadenceMeter, choose_fps_range, full_rate_fps_range, render_interval)
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
@@ -32,13 +42,16 @@ Surface = autoclass('android.view.Surface')
 GL_TEXTURE_EXTERNAL_OES = autoclass(
     'android.opengl.GLES11Ext').GL_TEXTURE_EXTERNAL_OES
 ImageFormat = autoclass('android.graphics.ImageFormat')
+Rect = autoclass('android.graphics.Rect')
+Range = autoclass('android.util.Range')
+ImageReader = autoclass('android.media.ImageReader')
+Integer = autoclass('java.lang.Integer')
 
 Handler = autoclass("android.os.Handler")
 Looper = autoclass("android.os.Looper")
 
 MyStateCallback = autoclass("net.inclem.camera2.MyStateCallback")
 CameraActions = autoclass("net.inclem.camera2.MyStateCallback$CameraActions")
-# MyStateCallback = autoclass("org.kivy.android.MyStateCallback")
 
 MyCaptureSessionCallback = autoclass("net.inclem.camera2.MyCaptureSessionCallback")
 CameraCaptureEvents = autoclass("net.inclem.camera2.MyCaptureSessionCallback$CameraCaptureEvents")
@@ -54,25 +67,44 @@ class LensFacing(Enum):
     LENS_FACING_EXTERNAL = 2
 
 class ControlAfMode(Enum):
+    CONTROL_AF_MODE_AUTO = 1
     CONTROL_AF_MODE_CONTINUOUS_PICTURE = 4
 
 class ControlAeMode(Enum):
     CONTROL_AE_MODE_ON = 1
 
-class Runnable(PythonJavaClass):
-    __javainterfaces__ = ['java/lang/Runnable']
+class ScalerCroppingType(Enum):
+    SCALER_CROPPING_TYPE_CENTER_ONLY = 0
+    SCALER_CROPPING_TYPE_FREEFORM = 1
+
+class StateListener(PythonJavaClass):
+    """Receives MyStateCallback events on the Android UI thread, and
+    queues them for the Kivy main thread.
+    """
+    __javainterfaces__ = ['net/inclem/camera2/MyStateCallback$Listener']
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    @java_method('(Ljava/lang/String;Landroid/hardware/camera2/CameraDevice;I)V')
+    def onStateEvent(self, action, camera_device, error):
+        camera_event_queue.post(self.handler, action, camera_device, error)
+
+
+class CaptureSessionListener(PythonJavaClass):
+    """Receives MyCaptureSessionCallback events on the Android UI thread,
+    and queues them for the Kivy main thread.
+    """
+    __javainterfaces__ = ['net/inclem/camera2/MyCaptureSessionCallback$Listener']
 
-    def __init__(self, func):
-        super(Runnable, self).__init__()
-        self.func = func
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
 
-    @java_method('()V')
-    def run(self):
-        try:
-            self.func()
-        except:
-            import traceback
-            traceback.print_exc()
+    @java_method('(Ljava/lang/String;Landroid/hardware/camera2/CameraCaptureSession;)V')
+    def onCaptureSessionEvent(self, event, capture_session):
+        camera_event_queue.post(self.handler, event, capture_session)
 
 
 class PyCameraInterface(EventDispatcher):
@@ -122,21 +154,68 @@ class PyCameraInterface(EventDispatcher):
 
         return outputs
 
+
+def _convert_yuv_image(image, resolution, size, region):
+    """Copy the planes out of a YUV_420_888 android.media.Image and close
+    it, then return it converted with yuv420_to_rgba, top row first. Run
+    on a FrameAnalyzer worker thread.
+    """
+    # fallback imports NumPy and the CPU engine, only needed once the GL
+    # preview has failed
+    from fallback import yuv420_to_rgba
+
+    try:
+        planes = []
+        for plane in image.getPlanes():
+            buffer = plane.getBuffer()
+            # pyjnius copies what Java writes into the bytearray
+            data = bytearray(buffer.remaining())
+            buffer.get(data)
+            planes.append((data, plane.getRowStride(), plane.getPixelStride()))
+    finally:
+        image.close()
+        # Threads calling into Java must detach before they exit, and the
+        # pool's threads exit without warning
+        detach()
+    # Plugins take frames top row first
+    return yuv420_to_rgba(planes, resolution, size, region)[::-1]
+
+
 class PyCameraDevice(EventDispatcher):
 
     camera_id = StringProperty()
 
+    state = OptionProperty("closed", options=CAMERA_STATES)
+    '''Lifecycle state, see lifecycle.py.'''
+
     output_texture = ObjectProperty(None, allownone=True)
 
     preview_active = BooleanProperty(False)
     preview_texture = ObjectProperty(None, allownone=True)
     preview_resolution = ListProperty()
     preview_fbo = ObjectProperty(None, allownone=True)
+    region_of_interest = ListProperty(list(FULL_FRAME))
+    '''Region of the frame drawn into preview_fbo, see zoom.py.'''
     java_preview_surface_texture = ObjectProperty(None)
     java_preview_surface = ObjectProperty(None)
     java_capture_request = ObjectProperty(None)
     java_surface_list = ObjectProperty(None)
     java_capture_session = ObjectProperty(None)
+    java_image_reader = ObjectProperty(None, allownone=True)
+
+    cpu_preview = BooleanProperty(False)
+    '''True once the preview shader has failed to compile on this device.
+    Frames are then read through an ImageReader and only reach the CPU,
+    through frame_analyzer, and output_texture stays None (see
+    fallback.py).'''
+
+    frame_recorder = ObjectProperty(None, allownone=True)
+    '''recorder.FrameRecorder receiving a copy of every preview frame, or
+    None when not recording.'''
+
+    frame_analyzer = ObjectProperty(None, allownone=True)
+    '''analysis.FrameAnalyzer receiving a downsampled copy of every
+    preview frame, or None when not analyzing.'''
 
     connected = BooleanProperty(False)
 
@@ -145,6 +224,25 @@ class PyCameraDevice(EventDispatcher):
 
     facing = OptionProperty("UNKNOWN", options=["UNKNOWN", "FRONT", "BACK", "EXTERNAL"])
 
+    max_digital_zoom = NumericProperty(1.)
+    freeform_crop = BooleanProperty(False)
+    active_array_size = ListProperty([0, 0])
+
+    power_mode = OptionProperty("normal", options=POWER_MODES)
+    '''In power_saving mode, the preview runs at no more than
+    power_saving_fps, see power.py.'''
+    power_saving_fps = NumericProperty(POWER_SAVING_FPS)
+    fps_ranges = ListProperty()
+    '''(min, max) AE target frame rate ranges the camera supports.'''
+    fps_range = ListProperty()
+    '''Frame rate range requested from the camera, or empty to leave it
+    to the camera.'''
+    continuous_focus = BooleanProperty(True)
+    '''Whether autofocus runs continuously. Otherwise the lens stays
+    where it last focused.'''
+    measured_fps = NumericProperty(0.)
+    '''Rate at which new camera frames have recently been drawn.'''
+
     java_camera_characteristics = ObjectProperty()
     java_camera_manager = ObjectProperty()
     java_camera_device = ObjectProperty()
@@ -152,19 +250,45 @@ class PyCameraDevice(EventDispatcher):
 
     _open_callback = ObjectProperty(None, allownone=True)
 
+    _recording_readback = ObjectProperty(None, allownone=True)
+    _analysis_readback = ObjectProperty(None, allownone=True)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.register_event_type("on_opened")
         self.register_event_type("on_closed")
         self.register_event_type("on_disconnected")
         self.register_event_type("on_error")
-
-        self._java_state_callback_runnable = Runnable(self._java_state_callback)
-        self._java_state_java_callback = MyStateCallback(self._java_state_callback_runnable)
-
-        self._java_capture_session_callback_runnable = Runnable(self._java_capture_session_callback)
+        self.register_event_type("on_first_frame")
+
+        self._preview_event = None
+        self._preview_rectangle = None
+        self._prepared_resolution = None
+        self._first_frame_delivered = False
+        self._close_requested = False
+        self._cadence = CadenceMeter()
+        self._last_frame_timestamp = 0
+        # CONTROL_AE_TARGET_FPS_RANGE of the preview template, restored in
+        # normal power mode
+        self._template_fps_range = None
+        # Size and region of the frames converted for the analyzer, with
+        # cpu_preview
+        self._analysis_size = None
+        self._cpu_region = FULL_FRAME
+        self._converting_image = False
+        # Region of the uncropped stream the camera currently crops to
+        self._sensor_region = FULL_FRAME
+        self._roi_output_size = None
+        self._apply_roi_trigger = Clock.create_trigger(self._apply_region_of_interest, ROI_UPDATE_DELAY)
+
+        # Each device has its own callback objects, so events from
+        # several open cameras can't be confused
+        self._java_state_listener = StateListener(self._java_state_callback)
+        self._java_state_java_callback = MyStateCallback(self._java_state_listener)
+
+        self._java_capture_session_listener = CaptureSessionListener(self._java_capture_session_callback)
         self._java_capture_session_java_callback = MyCaptureSessionCallback(
-            self._java_capture_session_callback_runnable)
+            self._java_capture_session_listener)
 
         self._populate_camera_characteristics()
 
@@ -176,10 +300,93 @@ class PyCameraDevice(EventDispatcher):
         pass
     def on_error(self, instance, error):
         pass
+    def on_first_frame(self, instance):
+        pass
+
+    def _set_state(self, state):
+        check_transition(self.state, state)
+        logger.info("Camera {} state {} -> {}".format(self.camera_id, self.state, state))
+        self.state = state
 
     def close(self):
+        if self.state == "closed":
+            # Resources may have been prepared for a preview that never
+            # started
+            self._release_preview_resources()
+            return
+        if self.state == "closing":
+            return
+        if self.state == "opening":
+            # There's no device to close until it has opened
+            self._close_requested = True
+            return
+        self._close_device()
+
+    def _close_device(self):
+        self.stop_preview()
+        self._set_state("closing")
         self.java_camera_device.close()
 
+    def stop_preview(self):
+        """Stop the preview and release everything it holds, returning to
+        the open state. If no preview was started, only releases any
+        resources from prepare_preview.
+        """
+        if self.state not in ("configuring", "previewing"):
+            self._release_preview_resources()
+            return
+        self.stop_recording()
+        self.stop_analysis()
+        self._apply_roi_trigger.cancel()
+
+        # Stop drawing from this camera's SurfaceTexture before it is
+        # released
+        if self._preview_event is not None:
+            self._preview_event.cancel()
+            resource_ledger.release(self._preview_event)
+            self._preview_event = None
+        self.preview_active = False
+        self.measured_fps = 0.
+
+        if self.java_capture_session is not None:
+            self.java_capture_session.close()
+            resource_ledger.release(self.java_capture_session)
+            self.java_capture_session = None
+        self.java_capture_request = None
+        self.java_surface_list = None
+
+        self._release_preview_resources()
+        self._set_state("open")
+
+    def _release_preview_resources(self):
+        if self.java_image_reader is not None:
+            # Also releases its surface
+            self.java_image_reader.close()
+            resource_ledger.release(self.java_image_reader)
+            self.java_image_reader = None
+        # An image still being converted belongs to the closed reader
+        self._converting_image = False
+        if self.java_preview_surface is not None:
+            self.java_preview_surface.release()
+            resource_ledger.release(self.java_preview_surface)
+            self.java_preview_surface = None
+        if self.java_preview_surface_texture is not None:
+            self.java_preview_surface_texture.release()
+            resource_ledger.release(self.java_preview_surface_texture)
+            self.java_preview_surface_texture = None
+
+        # Kivy frees GL objects once they are no longer referenced
+        resource_ledger.release(self.preview_texture)
+        self.preview_texture = None
+        resource_ledger.release(self.preview_fbo)
+        self.preview_fbo = None
+        self._preview_rectangle = None
+        self.output_texture = None
+        self.region_of_interest = list(FULL_FRAME)
+        self._cpu_region = FULL_FRAME
+        self._sensor_region = FULL_FRAME
+        self._prepared_resolution = None
+
     def _populate_camera_characteristics(self):
         logger.info("Populating camera characteristics")
         self.java_stream_configuration_map = self.java_camera_characteristics.get(
@@ -202,6 +409,20 @@ class PyCameraDevice(EventDispatcher):
             self.facing = "EXTERNAL"
         else:
             raise ValueError("Camera id {} LENS_FACING is unknown value {}".format(self.camera_id, facing))
+
+        active_array = self.java_camera_characteristics.get(
+            CameraCharacteristics.SENSOR_INFO_ACTIVE_ARRAY_SIZE)
+        self.active_array_size = [active_array.width(), active_array.height()]
+        self.max_digital_zoom = self.java_camera_characteristics.get(
+            CameraCharacteristics.SCALER_AVAILABLE_MAX_DIGITAL_ZOOM).floatValue()
+        cropping_type = self.java_camera_characteristics.get(CameraCharacteristics.SCALER_CROPPING_TYPE)
+        self.freeform_crop = cropping_type == ScalerCroppingType.SCALER_CROPPING_TYPE_FREEFORM.value
+        logger.info(f"Got digital zoom {self.max_digital_zoom}, freeform crop {self.freeform_crop}")
+
+        self.fps_ranges = [
+            (fps_range.getLower().intValue(), fps_range.getUpper().intValue()) for fps_range in
+            self.java_camera_characteristics.get(CameraCharacteristics.CONTROL_AE_AVAILABLE_TARGET_FPS_RANGES)]
+        logger.info(f"Got fps ranges {self.fps_ranges}")
         logger.info(f"Finished initing camera {self.camera_id}")
 
     def __str__(self):
@@ -210,6 +431,8 @@ class PyCameraDevice(EventDispatcher):
         return str(self)
 
     def open(self, callback=None):
+        self._set_state("opening")
+        self._close_requested = False
         self._open_callback = callback
         self.java_camera_manager.openCamera(
             self.camera_id,
@@ -217,26 +440,36 @@ class PyCameraDevice(EventDispatcher):
             _global_handler
         )
 
-    def _java_state_callback(self, *args, **kwargs):
-        action = MyStateCallback.camera_action.toString()
-        camera_device = MyStateCallback.camera_device
-
+    def _java_state_callback(self, action, camera_device, error):
         self.java_camera_device = camera_device
 
         logger.info("CALLBACK: camera event {}".format(action))
         if action == "OPENED":
-            self.dispatch("on_opened", self)
+            self._set_state("open")
             self.connected = True
+            if self._close_requested:
+                # close() was called while opening
+                self._close_device()
+                return
+            self.dispatch("on_opened", self)
         elif action == "DISCONNECTED":
             self.dispatch("on_disconnected", self)
             self.connected = False
+            # A disconnected device must still be closed to free it,
+            # unless it is closed or being closed already
+            if self.state not in ("closed", "closing"):
+                self._close_device()
         elif action == "CLOSED":
+            self.stop_preview()
+            if self.state != "closed":
+                self._set_state("closed")
             self.dispatch("on_closed", self)
             self.connected = False
         elif action == "ERROR":
-            error = MyStateCallback.camera_error
             self.dispatch("on_error", self, error)
             self.connected = False
+            if self.state not in ("closed", "closing"):
+                self._close_device()
         elif action == "UNKNOWN":
             print("UNKNOWN camera state callback item")
             self.connected = False
@@ -246,35 +479,63 @@ class PyCameraDevice(EventDispatcher):
         if self._open_callback is not None:
             self._open_callback(self, action)
 
-    def start_preview(self, resolution):
-        if self.java_camera_device is None:
-            raise ValueError("Camera device not yet opened, cannot create preview stream")
+    def prepare_preview(self, resolution):
+        """Create the GL and Android resources for a preview at the given
+        resolution. This doesn't need the device, so can be done while it
+        is opening; start_preview reuses the resources.
+        """
+        if self.state in ("configuring", "previewing"):
+            raise ValueError("Preview already active, can't prepare another without stopping first")
 
-        if resolution not in self.supported_resolutions:
+        resolution = tuple(resolution)
+        if resolution not in [tuple(r) for r in self.supported_resolutions]:
             raise ValueError(
                 "Tried to open preview with resolution {}, not in supported resolutions {}".format(
                     resolution, self.supported_resolutions))
 
-        if self.preview_active:
-            raise ValueError("Preview already active, can't start again without stopping first")
-
-        logger.info("Creating capture stream with resolution {}".format(resolution))
+        if self._prepared_resolution == resolution:
+            return
+        self._release_preview_resources()
 
         self.preview_resolution = resolution
+        self.region_of_interest = list(FULL_FRAME)
         self._prepare_preview_fbo(resolution)
-        self.preview_texture = Texture(
-            width=resolution[0], height=resolution[1], target=GL_TEXTURE_EXTERNAL_OES, colorfmt="rgba")
+        if self.cpu_preview:
+            self.java_image_reader = resource_ledger.acquire("image_reader", ImageReader.newInstance(
+                resolution[0], resolution[1], ImageFormat.YUV_420_888, 2), self)
+            self.java_preview_surface = resource_ledger.acquire(
+                "surface", self.java_image_reader.getSurface(), self)
+            self._prepared_resolution = resolution
+            return
+
+        self.preview_texture = resource_ledger.acquire("texture", Texture(
+            width=resolution[0], height=resolution[1], target=GL_TEXTURE_EXTERNAL_OES, colorfmt="rgba"), self)
         logger.info("Texture id is {}".format(self.preview_texture.id))
-        self.java_preview_surface_texture = SurfaceTexture(int(self.preview_texture.id))
+        self.java_preview_surface_texture = resource_ledger.acquire(
+            "surface_texture", SurfaceTexture(int(self.preview_texture.id)), self)
         self.java_preview_surface_texture.setDefaultBufferSize(*resolution)
-        self.java_preview_surface = Surface(self.java_preview_surface_texture)
+        self.java_preview_surface = resource_ledger.acquire(
+            "surface", Surface(self.java_preview_surface_texture), self)
+        self._prepared_resolution = resolution
+
+    def start_preview(self, resolution):
+        if self.state in ("configuring", "previewing"):
+            raise ValueError("Preview already active, can't start again without stopping first")
+
+        if self.state != "open":
+            raise ValueError("Camera device not open (state {}), cannot create preview stream".format(self.state))
+
+        logger.info("Creating capture stream with resolution {}".format(resolution))
+
+        self.prepare_preview(resolution)
+        self._first_frame_delivered = False
 
         self.java_capture_request = self.java_camera_device.createCaptureRequest(CameraDevice.TEMPLATE_PREVIEW)
         self.java_capture_request.addTarget(self.java_preview_surface)
-        self.java_capture_request.set(
-            CaptureRequest.CONTROL_AF_MODE, ControlAfMode.CONTROL_AF_MODE_CONTINUOUS_PICTURE.value)  # CaptureRequest.CONTROL_AF_MODE_CONTINUOUS_PICTURE)
+        self._template_fps_range = self.java_capture_request.get(CaptureRequest.CONTROL_AE_TARGET_FPS_RANGE)
         self.java_capture_request.set(
             CaptureRequest.CONTROL_AE_MODE, ControlAeMode.CONTROL_AE_MODE_ON.value)  # CaptureRequest.CONTROL_AE_MODE_ON)
+        self._apply_power_settings()
 
         self.java_surface_list = ArrayList()
         self.java_surface_list.add(self.java_preview_surface)
@@ -284,11 +545,14 @@ class PyCameraDevice(EventDispatcher):
             self._java_capture_session_java_callback,
             _global_handler,
         )
+        self._set_state("configuring")
 
-        return self.preview_fbo.texture
+        return None if self.cpu_preview else self.preview_fbo.texture
 
     def _prepare_preview_fbo(self, resolution):
-        self.preview_fbo = Fbo(size=resolution)
+        if self.cpu_preview:
+            return
+        self.preview_fbo = resource_ledger.acquire("fbo", Fbo(size=resolution), self)
         self.preview_fbo['resolution'] = [float(f) for f in resolution]
         self.preview_fbo.shader.fs = """
             #extension GL_OES_EGL_image_external : require
@@ -310,22 +574,271 @@ class PyCameraDevice(EventDispatcher):
                 gl_FragColor = texture2D(texture1, tex_coord0);
             }
         """
+        if not self.preview_fbo.shader.success:
+            # Some devices can't compile GL_OES_EGL_image_external shaders
+            logger.error(f"Preview shader failed to compile for camera {self.camera_id}, "
+                         "falling back to reading frames on the CPU")
+            resource_ledger.release(self.preview_fbo)
+            self.preview_fbo = None
+            self.cpu_preview = True
+            return
         with self.preview_fbo:
-            Rectangle(size=resolution)
+            self._preview_rectangle = Rectangle(size=resolution)
+
+    def _can_crop_on_sensor(self, sensor_region):
+        zoom = 1. / min(sensor_region[2], sensor_region[3])
+        return zoom <= self.max_digital_zoom and (self.freeform_crop or is_centered(sensor_region))
+
+    def set_region_of_interest(self, region=FULL_FRAME, output_size=None):
+        """Draw only region of the frame into the preview Fbo, at the
+        region's size in pixels but no more than output_size, and return
+        the Fbo's texture.
+
+        The crop is done by the camera (SCALER_CROP_REGION) where it
+        supports the region, so the region keeps the stream's full
+        resolution, and otherwise by sampling only the region of the
+        stream. The camera's crop and the Fbo's size are only updated once
+        the region has stayed the same for ROI_UPDATE_DELAY seconds, e.g.
+        at the end of a pinch; until then the region is sampled from the
+        stream as currently cropped. output_texture changes when the Fbo
+        is resized.
+        """
+        if self.state not in ("configuring", "previewing"):
+            raise ValueError("Cannot set the region of interest without an active preview")
+
+        region = tuple(float(value) for value in region)
+        self.region_of_interest = list(region)
+        self._roi_output_size = output_size
+        self._apply_roi_trigger()
+
+        if self.cpu_preview:
+            return None
+        # Parts of the region outside the current crop show stretched
+        # edge pixels until the crop is updated
+        self._preview_rectangle.tex_coords = tex_coords_for_region(region_within(region, self._sensor_region))
+        return self.preview_fbo.texture
 
-    def _java_capture_session_callback(self, *args, **kwargs):
-        event = MyCaptureSessionCallback.camera_capture_event.toString()
+    def _apply_region_of_interest(self, *args):
+        if self.state not in ("configuring", "previewing"):
+            return
+        region = tuple(self.region_of_interest)
+
+        # The camera crops its crop region further to the stream's aspect
+        # ratio, so crop to a region with that aspect ratio and sample
+        # the region of interest from it
+        sensor_region = with_frame_aspect(region)
+        if not self._can_crop_on_sensor(sensor_region):
+            sensor_region = FULL_FRAME
+        if sensor_region == FULL_FRAME:
+            crop = crop_rect(FULL_FRAME, self.active_array_size)
+        else:
+            crop = crop_rect(sensor_region, self.active_array_size, self.preview_resolution)
+        self.java_capture_request.set(CaptureRequest.SCALER_CROP_REGION, Rect(*crop))
+        self._repeat_capture_request()
+        self._sensor_region = sensor_region
+        stream_region = region_within(region, sensor_region)
+
+        if self.cpu_preview:
+            # Applied as frames are converted, see _update_cpu_preview
+            self._cpu_region = stream_region
+            return
+
+        self._preview_rectangle.tex_coords = tex_coords_for_region(stream_region)
+        size = region_pixel_size(region, self.preview_resolution, self._roi_output_size)
+        if tuple(self.preview_fbo.size) != size:
+            # Resizing recreates the Fbo's texture
+            self.preview_fbo.size = size
+            self.preview_fbo['resolution'] = [float(f) for f in size]
+            self._preview_rectangle.size = size
+            self.output_texture = self.preview_fbo.texture
+
+    def _java_capture_session_callback(self, event, capture_session):
         logger.info("CALLBACK: capture event {}".format(event))
 
-        self.java_capture_session = MyCaptureSessionCallback.camera_capture_session
-
-        if event == "READY":
+        if event == "CONFIGURED":
+            if self.state != "configuring":
+                # The preview was stopped before the session was ready
+                capture_session.close()
+                return
+            self.java_capture_session = resource_ledger.acquire("capture_session", capture_session, self)
+        elif event == "READY" and self.state == "configuring" and self.java_capture_session is not None:
             logger.info("Doing READY actions")
             self.java_capture_session.setRepeatingRequest(self.java_capture_request.build(), None, None)
-            Clock.schedule_interval(self._update_preview, 0.)
+            self._schedule_preview_updates()
+            self.preview_active = True
+            self._set_state("previewing")
+        elif event == "CONFIGURE_FAILED" and self.state == "configuring":
+            logger.error("Capture session configuration failed for camera {}".format(self.camera_id))
+            self.stop_preview()
+
+    def _repeat_capture_request(self):
+        if self.state == "previewing":
+            self.java_capture_session.setRepeatingRequest(self.java_capture_request.build(), None, None)
+
+    def _schedule_preview_updates(self):
+        """(Re)schedule drawing of the preview, no faster than the
+        requested frame rate.
+        """
+        if self._preview_event is not None:
+            self._preview_event.cancel()
+            resource_ledger.release(self._preview_event)
+        self._preview_event = resource_ledger.acquire(
+            "scheduled_callback",
+            Clock.schedule_interval(self._update_preview, render_interval(self.fps_range)), self)
+        self._cadence.reset()
+
+    def _apply_power_settings(self):
+        """Set the frame rate range and focus mode for the power mode on
+        the capture request.
+        """
+        if self.power_mode == "power_saving":
+            self.fps_range = choose_fps_range(self.fps_ranges, self.power_saving_fps) or []
+        else:
+            self.fps_range = []
+
+        # Always set explicitly, since the repeating request keeps any
+        # capped range from before a switch back to normal mode
+        if self.fps_range:
+            java_fps_range = Range(Integer.valueOf(self.fps_range[0]), Integer.valueOf(self.fps_range[1]))
+        elif self._template_fps_range is not None:
+            java_fps_range = self._template_fps_range
+        else:
+            full_rate = full_rate_fps_range(self.fps_ranges)
+            java_fps_range = None if full_rate is None else Range(
+                Integer.valueOf(full_rate[0]), Integer.valueOf(full_rate[1]))
+        if java_fps_range is not None:
+            self.java_capture_request.set(CaptureRequest.CONTROL_AE_TARGET_FPS_RANGE, java_fps_range)
+
+        af_mode = (ControlAfMode.CONTROL_AF_MODE_CONTINUOUS_PICTURE if self.continuous_focus else
+                   ControlAfMode.CONTROL_AF_MODE_AUTO)
+        self.java_capture_request.set(CaptureRequest.CONTROL_AF_MODE, af_mode.value)
+
+    def on_power_mode(self, instance, mode):
+        self._update_power_settings()
+
+    def on_power_saving_fps(self, instance, fps):
+        self._update_power_settings()
+
+    def on_continuous_focus(self, instance, continuous):
+        self._update_power_settings()
+
+    def _update_power_settings(self):
+        if self.java_capture_request is None or self.state not in ("configuring", "previewing"):
+            # Applied when the preview starts
+            return
+        fps_range = list(self.fps_range)
+        self._apply_power_settings()
+        self._repeat_capture_request()
+        if self.state == "previewing" and list(self.fps_range) != fps_range:
+            self._schedule_preview_updates()
+
+    def start_recording(self, capacity=300):
+        """Start copying raw preview frames into a ring buffer holding the
+        most recent capacity frames.
+        """
+        from recorder import FrameRecorder
+        from readback import ReadbackRing
+        if self.cpu_preview:
+            raise ValueError("Recording needs the GL preview, which camera {} can't use".format(self.camera_id))
+        width, height = self.preview_resolution
+        self.stop_recording()
+        self.frame_recorder = FrameRecorder(capacity, (height, width, 4))
+        self._recording_readback = resource_ledger.acquire(
+            "readback_ring", ReadbackRing(self.preview_resolution), self)
+
+    def stop_recording(self, filename=None):
+        """Stop recording, writing the buffered frames to filename if
+        given.
+        """
+        if self.frame_recorder is not None and filename is not None:
+            self.frame_recorder.flush(filename)
+        self.frame_recorder = None
+        resource_ledger.release(self._recording_readback)
+        self._recording_readback = None
+
+    def _image_converted(self):
+        self._converting_image = False
+
+    def start_analysis(self, analyzer):
+        """Start passing each preview frame, downsampled to fit within
+        analyzer.max_size, to the plugins of analyzer (see analysis.py).
+        """
+        from readback import ReadbackRing
+        self.stop_analysis()
+        self.frame_analyzer = analyzer
+        size = region_pixel_size(FULL_FRAME, self.preview_resolution, analyzer.max_size)
+        if self.cpu_preview:
+            # Frames are converted straight to this size
+            self._analysis_size = size
+        else:
+            self._analysis_readback = resource_ledger.acquire("readback_ring", ReadbackRing(size), self)
+
+    def stop_analysis(self):
+        self.frame_analyzer = None
+        self._analysis_size = None
+        resource_ledger.release(self._analysis_readback)
+        self._analysis_readback = None
 
     def _update_preview(self, dt):
+        if self.cpu_preview:
+            self._update_cpu_preview()
+            return
+
         self.java_preview_surface_texture.updateTexImage()
         self.preview_fbo.ask_update()
         self.preview_fbo.draw()
         self.output_texture = self.preview_fbo.texture
+
+        # The SurfaceTexture timestamp stays 0 until a camera frame has
+        # arrived
+        timestamp = self.java_preview_surface_texture.getTimestamp()
+        if not self._first_frame_delivered and timestamp != 0:
+            self._first_frame_delivered = True
+            self.dispatch("on_first_frame", self)
+
+        if timestamp != 0 and timestamp != self._last_frame_timestamp:
+            self._last_frame_timestamp = timestamp
+            # SurfaceTexture timestamps are in nanoseconds
+            self._cadence.record(timestamp / 1e9)
+            self.measured_fps = self._cadence.fps
+
+        if self.frame_recorder is not None:
+            # SurfaceTexture timestamps are in nanoseconds
+            frame = self._recording_readback.submit(
+                self.preview_fbo.texture, self.java_preview_surface_texture.getTimestamp() / 1e9)
+            if frame is not None:
+                self.frame_recorder.record(frame.buffer, frame.timestamp)
+
+        # Nothing is read back while no plugins are registered
+        if self.frame_analyzer is not None and self.frame_analyzer.plugins:
+            frame = self._analysis_readback.submit(
+                self.preview_fbo.texture, self.java_preview_surface_texture.getTimestamp() / 1e9)
+            if frame is not None:
+                # Read back bottom row first, as in GL
+                self.frame_analyzer.submit(frame.array[::-1], frame.timestamp)
+
+    def _update_cpu_preview(self):
+        if self._converting_image:
+            # The analyzer still holds the last image; newer ones wait in
+            # the reader, which keeps only the latest
+            return
+        image = self.java_image_reader.acquireLatestImage()
+        if image is None:
+            return
+        timestamp = image.getTimestamp()
+        if self.frame_analyzer is not None and self.frame_analyzer.plugins:
+            # Copying the planes out of Java and converting them is too
+            # slow for the UI thread, so both happen on the analyzer's
+            # pool, which closes the image
+            self._converting_image = True
+            self.frame_analyzer.submit_conversion(
+                partial(_convert_yuv_image, image, self.preview_resolution, self._analysis_size, self._cpu_region),
+                timestamp / 1e9, self._image_converted)
+        else:
+            image.close()
+
+        if not self._first_frame_delivered:
+            self._first_frame_delivered = True
+            self.dispatch("on_first_frame", self)
+        self._cadence.record(timestamp / 1e9)
+        self.measured_fps = self._cadence.fps
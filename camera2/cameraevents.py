@@ -0,0 +1,65 @@
+"""
+Delivery of camera events to the Kivy main thread.
+
+Android invokes the camera callbacks on its own UI thread, not Kivy's.
+The callbacks therefore only post their arguments to a
+CameraEventQueue, which is drained in one batch per frame on the Kivy
+main thread, where the camera objects' state is updated and events are
+dispatched.
+
+Events carry their own arguments and target, so any number of cameras
+can have events in flight at once.
+"""
+
+import traceback
+from collections import deque
+
+from kivy.clock import Clock
+
+
+class CameraEventQueue:
+    """Thread-safe queue of (handler, args) pairs, drained on the main
+    thread.
+    """
+
+    def __init__(self):
+        # deque.append and deque.popleft are atomic, so posting needs
+        # no lock
+        self._events = deque()
+        self._drain_trigger = Clock.create_trigger(self.drain)
+
+        self.events_posted = 0
+        self.events_handled = 0
+        self.batches_drained = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def post(self, handler, *args):
+        """Queue handler(*args) to run on the main thread. Safe to call
+        from any thread.
+        """
+        self._events.append((handler, args))
+        self.events_posted += 1
+        self._drain_trigger()
+
+    def drain(self, *args):
+        """Run the handlers of all events queued so far, in order.
+
+        Events posted by the handlers themselves are left for the next
+        drain.
+        """
+        count = len(self._events)
+        if not count:
+            return
+        self.batches_drained += 1
+        for _ in range(count):
+            handler, event_args = self._events.popleft()
+            self.events_handled += 1
+            try:
+                handler(*event_args)
+            except Exception:
+                traceback.print_exc()
+
+
+camera_event_queue = CameraEventQueue()
@@ -3,8 +3,30 @@ from kivy.uix.floatlayout import FloatLayout
 from kivy.properties import (StringProperty, BooleanProperty, NumericProperty)
 from kivy.clock import Clock
 from kivy.graphics import RenderContext
+from kivy.graphics.transformation import Matrix
 
 import shaders
+from simulation import model_for, error_matrix, DEFAULT_MODEL, DEFAULT_MONOCHROMACY_MODEL
+
+
+# Seconds after a change of simulation settings before the shader is
+# checked, see ColourShaderWidget._validate_shader
+SHADER_VALIDATION_DELAY = 0.5
+
+
+def to_uniform_value(value):
+    """Convert a row-major 3x3 matrix or a 3-vector from simulation.py
+    to a value Kivy can upload as a uniform.
+    """
+    if isinstance(value[0], (int, float)):
+        return [float(v) for v in value]
+
+    # Kivy only uploads 4x4 matrices, stored column-major
+    columns = [[value[row][col] for row in range(3)] + [0.0] for col in range(3)]
+    kivy_matrix = Matrix()
+    kivy_matrix.set(array=columns + [[0.0, 0.0, 0.0, 1.0]])
+    return kivy_matrix
+
 
 class ColourShaderWidget(FloatLayout):
     fs = StringProperty(None)
@@ -19,39 +41,131 @@ class ColourShaderWidget(FloatLayout):
 
     fraction = NumericProperty(1.0)
 
+    severity = NumericProperty(1.0)
+    '''Severity of the simulated deficiency, from 0 (normal vision) to 1
+    (dichromacy).'''
+
+    model = StringProperty(DEFAULT_MODEL)
+    '''Name of the simulation model used for protanopia, deuteranopia and
+    tritanopia, from simulation.models.'''
+
+    monochromacy_model = StringProperty(DEFAULT_MONOCHROMACY_MODEL)
+    '''Name of the simulation model used for monochromacy.'''
+
+    shader_valid = BooleanProperty(True)
+    '''False once a colour blindness shader has failed to compile or to
+    render a test pattern correctly (see fallback.py).'''
+
+    cpu_fallback = BooleanProperty(False)
+    '''If True, the frames drawn are already processed on the CPU, so
+    are drawn unchanged.'''
+
     def __init__(self, *args, **kwargs):
         self.canvas = RenderContext(use_parent_projection=True,
                                     use_parent_modelview=True)
 
+        self._uniforms = {}
+        self._readback_rings = []
+        # (model name, transformation) -> whether its shader rendered
+        # correctly
+        self._validated_shaders = {}
+        # Validation renders and reads back a test pattern, stalling the
+        # GL pipeline, so it waits until the new shader has been drawn
+        # and the settings have stopped changing
+        self._validate_trigger = Clock.create_trigger(self._validate_shader, SHADER_VALIDATION_DELAY)
+
         Clock.schedule_once(self.post_init, 0)
         super().__init__(*args, **kwargs)
 
     def post_init(self, *args):
-        self.fs = shaders.shader_colour_blindness
+        self._update_simulation()
 
     def on_fs(self, instance, value):
         self.canvas.shader.fs = self.fs
+        for ring in self._readback_rings:
+            ring.fs = self.fs
+
+    def _set_uniform(self, name, value):
+        self._uniforms[name] = value
+        self.canvas[name] = value
+        if name == 'transform_cutoff':
+            # Readback rings always transform the whole frame
+            return
+        for ring in self._readback_rings:
+            ring[name] = value
+
+    def add_readback(self, ring):
+        """Make a readback.ReadbackRing render with this widget's shader
+        and uniforms, kept in sync as they change.
+        """
+        self._readback_rings.append(ring)
+        if self.fs is not None:
+            ring.fs = self.fs
+        for name, value in self._uniforms.items():
+            ring[name] = value
+        ring['transform_cutoff'] = float(ring.size[0])
+
+    def remove_readback(self, ring):
+        if ring in self._readback_rings:
+            self._readback_rings.remove(ring)
 
     def on_daltonize(self, instance, value):
-        self.canvas['daltonize'] = 1 if self.daltonize else 0
+        self._set_uniform('daltonize', 1 if self.daltonize else 0)
 
     def on_linearize(self, instance, value):
-        self.canvas['linearize'] = 1 if self.linearize else 0
+        self._set_uniform('linearize', 1 if self.linearize else 0)
 
     def on_transformation(self, instance, value):
-        self.fs = shaders.shader_colour_blindness
-        self.canvas['transformation'] = {
-            'none': 0,
-            'protanopia': 1,
-            'deuteranopia': 2,
-            'tritanopia': 3,
-            'monochromacy': 4}[value]
+        self._set_uniform('transformation', shaders.TRANSFORMATION_UNIFORMS[value])
+        self._update_simulation()
+
+    def on_severity(self, instance, value):
+        self._update_simulation()
+
+    def on_model(self, instance, value):
+        self._update_simulation()
+
+    def on_monochromacy_model(self, instance, value):
+        self._update_simulation()
+
+    def on_cpu_fallback(self, instance, value):
+        self._update_simulation()
+
+    def _update_simulation(self):
+        model = model_for(self.transformation, self.model, self.monochromacy_model)
+        if self.cpu_fallback:
+            self.fs = shaders.shader_normal
+        else:
+            self.fs = shaders.shader_for_model(model)
+
+        uniforms = model.uniforms(self.transformation, self.severity)
+        uniforms['error_matrix'] = error_matrix(self.transformation)
+        for name, value in uniforms.items():
+            self._set_uniform(name, to_uniform_value(value))
+
+        if not self.cpu_fallback:
+            self._validate_trigger()
+
+    def _validate_shader(self, *args):
+        if self.cpu_fallback:
+            return
+        model = model_for(self.transformation, self.model, self.monochromacy_model)
+        key = (model.name, self.transformation)
+        if key in self._validated_shaders:
+            return
+        from fallback import validate_colour_shader
+        valid = validate_colour_shader(
+            self.fs, self._uniforms, self.transformation, self.severity,
+            model=self.model, monochromacy_model=self.monochromacy_model)
+        self._validated_shaders[key] = valid
+        if not valid:
+            self.shader_valid = False
 
     def on_colorimetric_modification(self, instance, value):
-        self.canvas['colorimetric_modification'] = 1 if self.colorimetric_modification else 0
+        self._set_uniform('colorimetric_modification', 1 if self.colorimetric_modification else 0)
 
     def on_fraction(self, instance, value):
-        self.canvas['transform_cutoff'] = self.width * 0.99999
+        self._set_uniform('transform_cutoff', self.width * 0.99999)
 
     def on_size(self, instance, value):
         self.on_fraction(self, self.fraction)
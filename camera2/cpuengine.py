@@ -0,0 +1,281 @@
+"""
+Vectorised NumPy implementation of the colour blindness simulation,
+for processing images outside the GL camera pipeline.
+
+Kernels come from the same model registry (simulation.py) as the
+camera shaders, so an image processed here matches what the camera
+view shows.
+
+Images with few distinct colours (UI screenshots, mockups) are
+detected, and only their unique colours are transformed: each colour
+is packed into a 24-bit key and the unique keys found. A ColourCache
+holding the results of earlier images can be shared across a batch, so
+colours seen before cost nothing.
+"""
+
+import collections
+import threading
+
+import numpy as np
+
+from simulation import model_for, DEFAULT_MODEL, DEFAULT_MONOCHROMACY_MODEL
+
+
+# Images whose sampled pixels are less than this fraction unique are
+# treated as flat-colour images and memoized
+LOW_COLOUR_FRACTION = 0.25
+LOW_COLOUR_SAMPLE_SIZE = 16384
+
+# Below this many pixels, finding the unique colours costs more than
+# transforming every pixel, so images are never memoized automatically,
+# and unique_colours sorts rather than using its 2**24-entry tables
+MIN_MEMOIZE_PIXELS = 1 << 16
+
+# Bounds on a ColourCache: the sets of simulation settings it keeps
+# tables for, and the colours in each table
+MAX_CACHED_SETTINGS = 8
+MAX_CACHED_COLOURS = 1 << 20
+
+
+def pack_rgb(rgb):
+    """Pack a uint8 (..., 3) array into uint32 24-bit colour keys."""
+    # In place, converting one channel at a time, which is several times
+    # faster than converting the whole array
+    keys = rgb[..., 0].astype(np.uint32)
+    keys <<= 8
+    keys |= rgb[..., 1]
+    keys <<= 8
+    keys |= rgb[..., 2]
+    return keys
+
+
+def unpack_keys(keys):
+    """Inverse of pack_rgb, returning a uint8 (..., 3) array."""
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([(keys >> 16) & 0xff, (keys >> 8) & 0xff, keys & 0xff], axis=-1).astype(np.uint8)
+
+
+def is_low_colour(rgb, sample_size=LOW_COLOUR_SAMPLE_SIZE, max_unique_fraction=LOW_COLOUR_FRACTION):
+    """Estimate from an evenly spaced sample of pixels whether an image
+    has few enough distinct colours to be worth memoizing.
+    """
+    if rgb[..., 0].size < MIN_MEMOIZE_PIXELS:
+        return False
+
+    # Stride every spatial axis rather than flattening, which would copy
+    # the RGB channels of an RGBA image
+    spatial_dims = rgb.ndim - 1
+    step = max(1, int((rgb[..., 0].size / sample_size) ** (1. / max(spatial_dims, 1))))
+    sample = pack_rgb(rgb[(slice(None, None, step), ) * spatial_dims]).ravel()
+    return len(np.unique(sample)) <= max_unique_fraction * len(sample)
+
+
+def unique_colours(keys):
+    """Return the sorted unique values of an array of colour keys, and
+    an array of keys' shape giving the index of each key's value in them.
+
+    Large arrays use scratch tables over all 2**24 colours, allocated for
+    the call. Scanning them costs a few milliseconds whatever the number
+    of keys, so arrays of fewer than MIN_MEMOIZE_PIXELS keys are sorted
+    instead.
+    """
+    if keys.size < MIN_MEMOIZE_PIXELS:
+        unique_keys, positions = np.unique(keys, return_inverse=True)
+        return unique_keys.astype(np.uint32), positions.reshape(keys.shape)
+
+    seen = np.zeros(1 << 24, dtype=np.bool_)
+    seen[keys] = True
+    unique_keys = np.flatnonzero(seen).astype(np.uint32)
+    del seen
+
+    positions = np.zeros(1 << 24, dtype=np.int32)
+    positions[unique_keys] = np.arange(len(unique_keys), dtype=np.int32)
+    return unique_keys, np.take(positions, keys)
+
+
+class ColourCache:
+    """Colour -> result tables, one per set of simulation settings,
+    shared across the images of a batch.
+
+    Each table holds the sorted keys of the colours computed so far and
+    their results, so it only grows with the colours actually seen. A
+    table that would grow beyond max_colours is started afresh, and only
+    the max_settings most recently used tables are kept. Safe to share
+    between threads.
+    """
+
+    def __init__(self, max_settings=MAX_CACHED_SETTINGS, max_colours=MAX_CACHED_COLOURS):
+        self.max_settings = max_settings
+        self.max_colours = max_colours
+        # settings -> (sorted uint32 keys, uint8 (n, 3) results), replaced
+        # whole rather than modified, least recently used first
+        self._tables = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.colours_computed = 0
+        self.colours_reused = 0
+
+    def __len__(self):
+        return len(self._tables)
+
+    def transform(self, unique_keys, settings, compute):
+        """Return the uint8 (n, 3) results for a sorted array of unique
+        colour keys, as from unique_colours.
+
+        settings is a hashable identifying the transformation. compute
+        maps a uint8 (n, 3) array of colours to their uint8 results, and
+        is only called for colours not already in the table.
+        """
+        with self._lock:
+            table = self._tables.get(settings)
+            if table is not None:
+                self._tables.move_to_end(settings)
+        table_keys, table_results = table if table is not None else (
+            np.empty(0, dtype=np.uint32), np.empty((0, 3), dtype=np.uint8))
+
+        positions, known = _find_keys(table_keys, unique_keys)
+        results = np.empty((len(unique_keys), 3), dtype=np.uint8)
+        results[known] = table_results[positions[known]]
+
+        missing = ~known
+        missing_count = int(np.count_nonzero(missing))
+        if missing_count:
+            results[missing] = compute(unpack_keys(unique_keys[missing]))
+            self._store(settings, unique_keys[missing], results[missing])
+        with self._lock:
+            self.colours_computed += missing_count
+            self.colours_reused += len(unique_keys) - missing_count
+        return results
+
+    def _store(self, settings, keys, results):
+        with self._lock:
+            table_keys, table_results = self._tables.get(settings, (None, None))
+            if table_keys is None or len(table_keys) + len(keys) > self.max_colours:
+                if len(keys) > self.max_colours:
+                    return
+                table_keys, table_results = keys, results
+            else:
+                # Another thread may have stored some of the same colours
+                positions, known = _find_keys(table_keys, keys)
+                new = ~known
+                table_keys = np.insert(table_keys, positions[new], keys[new])
+                table_results = np.insert(table_results, positions[new], results[new], axis=0)
+            self._tables[settings] = (table_keys, table_results)
+            self._tables.move_to_end(settings)
+            while len(self._tables) > self.max_settings:
+                self._tables.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+
+def _find_keys(table_keys, keys):
+    """Return where each of keys is, or would be inserted, in the sorted
+    table_keys, and whether it is there.
+    """
+    positions = np.searchsorted(table_keys, keys)
+    known = np.zeros(len(keys), dtype=np.bool_)
+    in_range = positions < len(table_keys)
+    known[in_range] = table_keys[positions[in_range]] == keys[in_range]
+    return positions, known
+
+
+def simulate(image, transformation, severity=1.0, linearize=False,
+             model=DEFAULT_MODEL, monochromacy_model=DEFAULT_MONOCHROMACY_MODEL,
+             cache=None, memoize='auto'):
+    """Return a copy of image with the given transformation applied.
+
+    image is a uint8 array of shape (..., 3) or (..., 4); any alpha
+    channel is passed through unchanged. model and monochromacy_model
+    name models from simulation.models, as for ColourShaderWidget.
+
+    If memoize is True, or is 'auto' and the image has few distinct
+    colours, only its unique colours are transformed, using and
+    filling cache (a ColourCache) if given.
+    """
+    image = np.asarray(image)
+    if image.dtype != np.uint8 or image.shape[-1] not in (3, 4):
+        raise ValueError(
+            "Expected a uint8 RGB or RGBA image, got dtype {} and shape {}".format(image.dtype, image.shape))
+
+    simulation_model = model_for(transformation, model, monochromacy_model)
+    kernel = simulation_model.numpy_kernel(transformation, severity)
+
+    def transform(input_rgb):
+        rgb = input_rgb.astype(np.float32) / 255.
+        if linearize:
+            rgb **= 2.2
+
+        output_rgb = kernel(rgb)
+        np.clip(output_rgb, 0., 1., out=output_rgb)
+
+        if linearize:
+            output_rgb **= 1. / 2.2
+
+        return np.rint(output_rgb * 255.).astype(np.uint8)
+
+    input_rgb = image[..., :3]
+    if memoize == 'auto':
+        memoize = is_low_colour(input_rgb)
+
+    output = image.copy()
+    if memoize:
+        unique_keys, positions = unique_colours(pack_rgb(input_rgb))
+        if cache is None:
+            results = transform(unpack_keys(unique_keys))
+        else:
+            settings = (simulation_model.name, transformation, float(severity), bool(linearize))
+            results = cache.transform(unique_keys, settings, transform)
+        # np.take is much faster than fancy indexing for gathering rows
+        output[..., :3] = np.take(results, positions, axis=0)
+    else:
+        output[..., :3] = transform(input_rgb)
+    return output
+
+
+class ColourLUT:
+    """Quantized lookup table of a transformation, for transforming
+    camera frames on the CPU in real time.
+
+    Each channel is quantized to bits bits before lookup (a 1 MB table
+    at the default 6 bits), so results can differ from simulate() by a
+    few levels, or more in the darkest colours with linearize. Arguments
+    are as for simulate().
+    """
+
+    def __init__(self, transformation, severity=1.0, linearize=False,
+                 model=DEFAULT_MODEL, monochromacy_model=DEFAULT_MONOCHROMACY_MODEL, bits=6):
+        self.bits = bits
+        self._shift = 8 - bits
+
+        # Each bin is represented by its middle value
+        levels = (np.arange(1 << bits) << self._shift) | ((1 << self._shift) >> 1)
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).astype(np.uint8)
+        self.table = np.full((len(levels) ** 3, 4), 255, dtype=np.uint8)
+        self.table[:, :3] = simulate(grid.reshape(1, -1, 3), transformation, severity, linearize,
+                                     model, monochromacy_model, memoize=False)[0]
+        # Whole RGBA pixels gather several times faster than channels
+        self._packed_table = self.table.view(np.uint32).ravel()
+
+    def apply(self, image):
+        """Return a transformed copy of a uint8 RGBA image, made opaque."""
+        image = np.asarray(image)
+        if image.dtype != np.uint8 or image.shape[-1] != 4:
+            raise ValueError(
+                "Expected a uint8 RGBA image, got dtype {} and shape {}".format(image.dtype, image.shape))
+
+        keys = (image[..., 0] >> self._shift).astype(np.int32) << (2 * self.bits)
+        keys |= (image[..., 1] >> self._shift).astype(np.int32) << self.bits
+        keys |= image[..., 2] >> self._shift
+        return np.take(self._packed_table, keys).view(np.uint8).reshape(image.shape)
+
+
+def simulate_batch(images, transformation, severity=1.0, cache=None, **kwargs):
+    """Yield simulated copies of images, sharing one ColourCache across
+    them.
+    """
+    if cache is None:
+        cache = ColourCache()
+    for image in images:
+        yield simulate(image, transformation, severity, cache=cache, **kwargs)
@@ -0,0 +1,410 @@
+"""
+Stand-in camera backend with the same interface as camera2.py, for
+running the app on desktop and testing the camera logic without
+Android.
+
+Frames come from framesource.SyntheticFrameSource, and events are
+posted from a background thread through the same CameraEventQueue as
+the Android callbacks, so they arrive on the main thread in the same
+way. Devices follow the same lifecycle states, and record their
+resources in the same ledger, as PyCameraDevice (see lifecycle.py). Any
+number of fake cameras can stream at once.
+"""
+
+import threading
+import logging
+import time
+
+import numpy as np
+
+from kivy.event import EventDispatcher
+from kivy.properties import (
+    BooleanProperty, StringProperty, ObjectProperty, OptionProperty, ListProperty, NumericProperty)
+from kivy.clock import Clock
+
+from cameraevents import camera_event_queue
+from framesource import SyntheticFrameSource
+from lifecycle import CAMERA_STATES, check_transition, resource_ledger
+from zoom import FULL_FRAME, region_pixel_size
+from analysis import downsample
+from framerate import POWER_MODES, POWER_SAVING_FPS, CadenceMeter, choose_fps_range, render_interval
+
+logger = logging.getLogger(__file__)
+
+
+class FakeCameraInterface(EventDispatcher):
+    """Stand-in for camera2.PyCameraInterface, with one back and one
+    front camera by default.
+    """
+
+    cameras = ListProperty()
+
+    def __init__(self, facings=("BACK", "FRONT"),
+                 supported_resolutions=((1920, 1080), (1280, 720), (640, 480)),
+                 fps_ranges=((15, 15), (7, 30), (30, 30)),
+                 use_textures=True, event_delay=0.):
+        super().__init__()
+        self.camera_ids = [str(index) for index in range(len(facings))]
+        for camera_id, facing in zip(self.camera_ids, facings):
+            self.cameras.append(FakeCameraDevice(
+                camera_id=camera_id,
+                facing=facing,
+                supported_resolutions=list(supported_resolutions),
+                fps_ranges=list(fps_ranges),
+                use_textures=use_textures,
+                event_delay=event_delay,
+            ))
+
+    def select_cameras(self, **conditions):
+        return [camera for camera in self.cameras
+                if all(getattr(camera, key) == value for key, value in conditions.items())]
+
+
+class FakeCameraDevice(EventDispatcher):
+    """Stand-in for camera2.PyCameraDevice.
+
+    If use_textures is False, no GL resources are created and frames are
+    only available as NumPy arrays (latest_frame), so the device can be
+    driven headless.
+    """
+
+    camera_id = StringProperty()
+
+    state = OptionProperty("closed", options=CAMERA_STATES)
+
+    output_texture = ObjectProperty(None, allownone=True)
+
+    preview_active = BooleanProperty(False)
+    preview_texture = ObjectProperty(None, allownone=True)
+    preview_resolution = ListProperty()
+    region_of_interest = ListProperty(list(FULL_FRAME))
+
+    connected = BooleanProperty(False)
+
+    supported_resolutions = ListProperty()
+
+    facing = OptionProperty("UNKNOWN", options=["UNKNOWN", "FRONT", "BACK", "EXTERNAL"])
+
+    max_digital_zoom = NumericProperty(1.)
+
+    power_mode = OptionProperty("normal", options=POWER_MODES)
+    power_saving_fps = NumericProperty(POWER_SAVING_FPS)
+    fps_ranges = ListProperty()
+    fps_range = ListProperty()
+    continuous_focus = BooleanProperty(True)
+    measured_fps = NumericProperty(0.)
+    '''Rate at which frames have recently been delivered, by the wall
+    clock.'''
+
+    use_textures = BooleanProperty(True)
+
+    cpu_preview = BooleanProperty(False)
+    '''Simulates a device whose preview shader doesn't compile: no
+    textures are created, and frames only reach the CPU, as with
+    PyCameraDevice.cpu_preview.'''
+
+    event_delay = NumericProperty(0.)
+    '''Seconds before each camera event is posted, from a background
+    thread as on Android.'''
+
+    frame_analyzer = ObjectProperty(None, allownone=True)
+
+    open_failures = NumericProperty(0)
+    '''Number of upcoming open() calls that fail with an ERROR event, for
+    testing recovery.'''
+
+    _open_callback = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register_event_type("on_opened")
+        self.register_event_type("on_closed")
+        self.register_event_type("on_disconnected")
+        self.register_event_type("on_error")
+        self.register_event_type("on_first_frame")
+
+        # Most recent frame, as a (height, width, 4) uint8 array, cropped
+        # to the region of interest
+        self.latest_frame = None
+        self.frames_delivered = 0
+        self._frame_source = None
+        self._preview_event = None
+        # Stands in for the Java capture session
+        self._capture_session = None
+        self._close_requested = False
+        # Row and column indices sampling the region of interest, or None
+        # for the full frame
+        self._roi_rows = None
+        self._roi_columns = None
+        self._analysis_size = None
+        self._cadence = CadenceMeter()
+
+    def on_opened(self, instance):
+        pass
+    def on_closed(self, instance):
+        pass
+    def on_disconnected(self, instance):
+        pass
+    def on_error(self, instance, error):
+        pass
+    def on_first_frame(self, instance):
+        pass
+
+    def __str__(self):
+        return "<FakeCameraDevice id={} facing={}>".format(self.camera_id, self.facing)
+    def __repr__(self):
+        return str(self)
+
+    def _post_later(self, handler, *args):
+        # Android delivers camera callbacks on its own thread
+        timer = threading.Timer(self.event_delay, camera_event_queue.post, (handler, ) + args)
+        timer.daemon = True
+        timer.start()
+
+    def _set_state(self, state):
+        check_transition(self.state, state)
+        logger.info("Fake camera {} state {} -> {}".format(self.camera_id, self.state, state))
+        self.state = state
+
+    def open(self, callback=None):
+        self._set_state("opening")
+        self._close_requested = False
+        self._open_callback = callback
+        if self.open_failures > 0:
+            self.open_failures -= 1
+            self._post_later(self._state_callback, "ERROR", 1)
+        else:
+            self._post_later(self._state_callback, "OPENED", 0)
+
+    def close(self):
+        if self.state == "closed":
+            self._release_preview_resources()
+            return
+        if self.state == "closing":
+            return
+        if self.state == "opening":
+            self._close_requested = True
+            return
+        self._close_device()
+
+    def _close_device(self):
+        self.stop_preview()
+        self._set_state("closing")
+        self._post_later(self._state_callback, "CLOSED", 0)
+
+    def disconnect(self):
+        """Simulate the camera being disconnected, e.g. taken by another
+        app.
+        """
+        self._post_later(self._state_callback, "DISCONNECTED", 0)
+
+    def _state_callback(self, action, error):
+        logger.info("CALLBACK: fake camera {} event {}".format(self.camera_id, action))
+        if action == "OPENED":
+            self._set_state("open")
+            self.connected = True
+            if self._close_requested:
+                self._close_device()
+                return
+            self.dispatch("on_opened", self)
+        elif action == "DISCONNECTED":
+            self.dispatch("on_disconnected", self)
+            self.connected = False
+            if self.state not in ("closed", "closing"):
+                self._close_device()
+        elif action == "CLOSED":
+            self.stop_preview()
+            if self.state != "closed":
+                self._set_state("closed")
+            self.dispatch("on_closed", self)
+            self.connected = False
+        elif action == "ERROR":
+            self.dispatch("on_error", self, error)
+            self.connected = False
+            if self.state not in ("closed", "closing"):
+                self._close_device()
+
+        if self._open_callback is not None:
+            self._open_callback(self, action)
+
+    def prepare_preview(self, resolution):
+        if self.state in ("configuring", "previewing"):
+            raise ValueError("Preview already active, can't prepare another without stopping first")
+
+        resolution = tuple(resolution)
+        if resolution not in [tuple(r) for r in self.supported_resolutions]:
+            raise ValueError(
+                "Tried to open preview with resolution {}, not in supported resolutions {}".format(
+                    resolution, self.supported_resolutions))
+
+        if self._frame_source is not None and tuple(self.preview_resolution) == resolution:
+            return
+        self._release_preview_resources()
+
+        self.preview_resolution = resolution
+        self._frame_source = SyntheticFrameSource(resolution)
+        if self.use_textures and not self.cpu_preview:
+            from kivy.graphics.texture import Texture
+            self.preview_texture = resource_ledger.acquire(
+                "texture", Texture.create(size=resolution, colorfmt='rgba'), self)
+
+    def start_preview(self, resolution):
+        if self.state in ("configuring", "previewing"):
+            raise ValueError("Preview already active, can't start again without stopping first")
+
+        if self.state != "open":
+            raise ValueError("Camera device not open (state {}), cannot create preview stream".format(self.state))
+
+        self.prepare_preview(resolution)
+        self.frames_delivered = 0
+
+        self._post_later(self._capture_session_callback, "CONFIGURED", object())
+        self._set_state("configuring")
+
+        return self.preview_texture
+
+    def _capture_session_callback(self, event, capture_session):
+        logger.info("CALLBACK: fake camera {} capture event {}".format(self.camera_id, event))
+        if event == "CONFIGURED":
+            if self.state != "configuring":
+                return
+            self._capture_session = resource_ledger.acquire("capture_session", capture_session, self)
+            self._post_later(self._capture_session_callback, "READY", capture_session)
+        elif event == "READY" and self.state == "configuring" and capture_session is self._capture_session:
+            self._apply_power_settings()
+            self._schedule_preview_updates()
+            self.preview_active = True
+            self._set_state("previewing")
+
+    def _schedule_preview_updates(self):
+        # Frames are delivered at the top of the requested frame rate
+        # range, as a camera would
+        if self._preview_event is not None:
+            self._preview_event.cancel()
+            resource_ledger.release(self._preview_event)
+        self._preview_event = resource_ledger.acquire(
+            "scheduled_callback",
+            Clock.schedule_interval(self._update_preview, render_interval(self.fps_range)), self)
+        self._cadence.reset()
+
+    def _apply_power_settings(self):
+        if self.power_mode == "power_saving":
+            self.fps_range = choose_fps_range(self.fps_ranges, self.power_saving_fps) or []
+        else:
+            self.fps_range = []
+
+    def on_power_mode(self, instance, mode):
+        self._update_power_settings()
+
+    def on_power_saving_fps(self, instance, fps):
+        self._update_power_settings()
+
+    def _update_power_settings(self):
+        if self.state != "previewing":
+            # Applied when the preview starts
+            return
+        fps_range = list(self.fps_range)
+        self._apply_power_settings()
+        if list(self.fps_range) != fps_range:
+            self._schedule_preview_updates()
+
+    def stop_preview(self):
+        if self.state not in ("configuring", "previewing"):
+            self._release_preview_resources()
+            return
+        if self._preview_event is not None:
+            self._preview_event.cancel()
+            resource_ledger.release(self._preview_event)
+            self._preview_event = None
+        self.preview_active = False
+        self.measured_fps = 0.
+        self.stop_analysis()
+
+        resource_ledger.release(self._capture_session)
+        self._capture_session = None
+
+        self._release_preview_resources()
+        self._set_state("open")
+
+    def _release_preview_resources(self):
+        resource_ledger.release(self.preview_texture)
+        self.preview_texture = None
+        self.output_texture = None
+        self._frame_source = None
+        self.region_of_interest = list(FULL_FRAME)
+        self._roi_rows = self._roi_columns = None
+
+    def set_region_of_interest(self, region=FULL_FRAME, output_size=None):
+        """Deliver only region of each frame, resampled to no more than
+        output_size pixels, as PyCameraDevice.set_region_of_interest.
+        """
+        if self.state not in ("configuring", "previewing"):
+            raise ValueError("Cannot set the region of interest without an active preview")
+
+        region = tuple(float(value) for value in region)
+        self.region_of_interest = list(region)
+
+        resolution_width, resolution_height = self.preview_resolution
+        width, height = region_pixel_size(region, self.preview_resolution, output_size)
+        x, y, region_width, region_height = region
+        # Nearest-neighbour sampling of the region; frame rows run upwards
+        # as in GL
+        self._roi_columns = (
+            (x + (np.arange(width) + 0.5) * region_width / width) * resolution_width).astype(np.intp)
+        self._roi_rows = (
+            (y + (np.arange(height) + 0.5) * region_height / height) * resolution_height).astype(np.intp)
+
+        if self.preview_texture is not None and tuple(self.preview_texture.size) != (width, height):
+            from kivy.graphics.texture import Texture
+            resource_ledger.release(self.preview_texture)
+            self.preview_texture = resource_ledger.acquire(
+                "texture", Texture.create(size=(width, height), colorfmt='rgba'), self)
+            self.output_texture = self.preview_texture
+        return self.preview_texture
+
+    def start_analysis(self, analyzer):
+        """Pass each preview frame, downsampled to fit within
+        analyzer.max_size, to the plugins of analyzer, as
+        PyCameraDevice.start_analysis.
+        """
+        self.frame_analyzer = analyzer
+        self._analysis_size = region_pixel_size(FULL_FRAME, self.preview_resolution, analyzer.max_size)
+
+    def stop_analysis(self):
+        self.frame_analyzer = None
+        self._analysis_size = None
+
+    def _update_preview(self, dt):
+        frame, timestamp = self._frame_source.read()
+        if self._roi_rows is not None:
+            frame = frame[self._roi_rows[:, np.newaxis], self._roi_columns]
+        self.latest_frame = frame
+        self.frames_delivered += 1
+        self._cadence.record(time.perf_counter())
+        self.measured_fps = self._cadence.fps
+        if self.preview_texture is not None:
+            self.preview_texture.blit_buffer(frame.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+            self.output_texture = self.preview_texture
+        if self.frames_delivered == 1:
+            self.dispatch("on_first_frame", self)
+
+        if self.frame_analyzer is not None and self.frame_analyzer.plugins:
+            # Frame rows run upwards as in GL, plugins take them downwards
+            self.frame_analyzer.submit(downsample(frame, self._analysis_size, flip_vertical=True), timestamp)
+
+
+class Permission:
+    """Stand-in for android.permissions.Permission."""
+    CAMERA = "CAMERA"
+
+
+def check_permission(permission):
+    """Stand-in for android.permissions.check_permission; desktop
+    platforms have no runtime permissions.
+    """
+    return True
+
+
+def request_permission(permission, callback=None):
+    if callback is not None:
+        callback([permission], [True])
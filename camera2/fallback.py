@@ -0,0 +1,231 @@
+"""
+CPU rendering fallback, for devices whose GL can't run the camera
+shaders.
+
+Some devices fail to compile the GL_OES_EGL_image_external shader that
+draws the camera's SurfaceTexture, or compile the colour blindness
+shader but render it wrongly, leaving a black or garbled view. The
+colour blindness shaders are therefore checked with
+validate_colour_shader, which renders a test pattern and compares it to
+cpuengine's simulation, and cameras whose preview shader fails to
+compile read their frames through an ImageReader instead (see
+PyCameraDevice.cpu_preview and yuv420_to_rgba).
+
+Either way the app then switches to CPUFallbackRenderer. It is an
+analysis plugin (see analysis.py), so it gets downsampled frames on a
+worker thread, where it transforms them through a cpuengine.ColourLUT.
+The results are uploaded on the main thread with Texture.blit_buffer,
+alternating between two textures so a frame is never uploaded into the
+texture that is still being drawn.
+
+The renderer runs against the fake camera backend, so it can be tried
+on desktop Linux by setting CameraApp.render_mode to 'cpu'.
+"""
+
+import logging
+
+import numpy as np
+
+from kivy.properties import BooleanProperty, NumericProperty, ObjectProperty, StringProperty
+
+import cpuengine
+import shaders
+from analysis import AnalysisPlugin
+from simulation import DEFAULT_MODEL, DEFAULT_MONOCHROMACY_MODEL
+from zoom import FULL_FRAME
+
+logger = logging.getLogger(__file__)
+
+# Largest size frames are rendered at on the CPU
+CPU_RENDER_SIZE = (640, 480)
+
+# Largest difference, in 8-bit levels, between a shader's rendering of
+# the test pattern and cpuengine's, allowing for GPU precision
+VALIDATION_TOLERANCE = 8
+
+
+def test_pattern(size=(16, 16)):
+    """Return a (height, width, 4) uint8 RGBA frame of colours spread
+    over the colour cube.
+    """
+    width, height = size
+    x, y = np.meshgrid(np.arange(width), np.arange(height))
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    frame[..., 0] = x * 255 // (width - 1)
+    frame[..., 1] = y * 255 // (height - 1)
+    frame[..., 2] = (x + y) * 255 // (width + height - 2)
+    frame[..., 3] = 255
+    return frame
+
+
+def validate_colour_shader(fs, uniforms, transformation, severity=1.0,
+                           model=DEFAULT_MODEL, monochromacy_model=DEFAULT_MONOCHROMACY_MODEL,
+                           tolerance=VALIDATION_TOLERANCE):
+    """Return whether the colour blindness shader fs, with the given
+    uniforms (as set on ColourShaderWidget), compiles and renders the
+    test pattern as cpuengine simulates it. Needs a GL context.
+    """
+    from kivy.graphics import Fbo, Rectangle, Color
+    from kivy.graphics.texture import Texture
+
+    pattern = test_pattern()
+    height, width = pattern.shape[:2]
+
+    fbo = Fbo(size=(width, height))
+    fbo.shader.fs = fs
+    if not fbo.shader.success:
+        logger.error("Colour blindness shader for {} failed to compile".format(transformation))
+        return False
+
+    for name, value in uniforms.items():
+        fbo[name] = value
+    fbo['transformation'] = shaders.TRANSFORMATION_UNIFORMS[transformation]
+    fbo['transform_cutoff'] = float(width)
+    for name in ('daltonize', 'linearize', 'colorimetric_modification'):
+        fbo[name] = 0
+
+    texture = Texture.create(size=(width, height), colorfmt='rgba')
+    texture.blit_buffer(pattern.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+    with fbo:
+        Color(1, 1, 1, 1)
+        Rectangle(size=(width, height), texture=texture)
+    fbo.draw()
+
+    # The texture and the Fbo both store the bottom row first, so the
+    # rows line up
+    rendered = np.frombuffer(fbo.pixels, dtype=np.uint8).reshape(height, width, 4)
+    expected = cpuengine.simulate(pattern, transformation, severity, model=model,
+                                  monochromacy_model=monochromacy_model, memoize=False)
+    error = int(np.abs(rendered[..., :3].astype(np.int16) - expected[..., :3]).max())
+    if error > tolerance:
+        logger.error("Colour blindness shader for {} renders incorrectly, off by up to {} levels".format(
+            transformation, error))
+        return False
+    return True
+
+
+def yuv420_to_rgba(planes, resolution, size=None, region=FULL_FRAME):
+    """Convert a YUV_420_888 camera image to a (height, width, 4) uint8
+    RGBA frame of the given size, bottom row first as in GL.
+
+    planes holds (buffer, row_stride, pixel_stride) for the Y, U and V
+    planes of an image of the given resolution. Only region of the image
+    is converted (see zoom.py), sampled at the output pixels, so
+    downsampling costs nothing extra. Colours are converted as full
+    range BT.601, as cameras produce.
+    """
+    width, height = resolution
+    out_width, out_height = size or resolution
+    x, y, region_width, region_height = region
+
+    columns = ((x + (np.arange(out_width) + 0.5) * region_width / out_width) * width).astype(np.intp)
+    # Image rows run downwards, frame rows upwards
+    rows = ((1. - y - (np.arange(out_height) + 0.5) * region_height / out_height) * height).astype(np.intp)
+
+    def sample(plane, plane_rows, plane_columns):
+        buffer, row_stride, pixel_stride = plane
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        return data[plane_rows[:, np.newaxis] * row_stride + plane_columns * pixel_stride].astype(np.float32)
+
+    luma = sample(planes[0], rows, columns)
+    # Chroma is subsampled 2x2
+    u = sample(planes[1], rows // 2, columns // 2) - 128.
+    v = sample(planes[2], rows // 2, columns // 2) - 128.
+
+    frame = np.empty((out_height, out_width, 4), dtype=np.uint8)
+    frame[..., 0] = np.clip(luma + 1.402 * v, 0., 255.)
+    frame[..., 1] = np.clip(luma - 0.344136 * u - 0.714136 * v, 0., 255.)
+    frame[..., 2] = np.clip(luma + 1.772 * u, 0., 255.)
+    frame[..., 3] = 255
+    return frame
+
+
+class CPUFallbackRenderer(AnalysisPlugin):
+    """Analysis plugin rendering the colour blindness simulation of each
+    frame on the CPU, to texture.
+
+    The simulation settings mirror those of ColourShaderWidget; daltonize
+    and colorimetric_modification aren't supported.
+    """
+
+    name = StringProperty('cpu_renderer')
+
+    texture = ObjectProperty(None, allownone=True)
+    '''Texture holding the latest rendered frame.'''
+
+    frames_uploaded = NumericProperty(0)
+
+    transformation = StringProperty('none')
+    severity = NumericProperty(1.0)
+    linearize = BooleanProperty(False)
+    model = StringProperty(DEFAULT_MODEL)
+    monochromacy_model = StringProperty(DEFAULT_MONOCHROMACY_MODEL)
+
+    SETTINGS = ('transformation', 'severity', 'linearize', 'model', 'monochromacy_model')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._textures = [None, None]
+        self._next_texture = 0
+        self._shader_widget = None
+
+        # Snapshot of the settings for the worker thread, replaced whole
+        # on the main thread
+        self._settings = None
+        self._lut = None
+        self._lut_settings = None
+        self._update_settings()
+        for name in self.SETTINGS:
+            self.fbind(name, self._update_settings)
+
+        self.fbind('result', self._upload)
+
+    def _update_settings(self, *args):
+        self._settings = (self.transformation, float(self.severity), bool(self.linearize),
+                          self.model, self.monochromacy_model)
+
+    def follow(self, shader_widget):
+        """Keep the simulation settings in sync with a ColourShaderWidget."""
+        self.unfollow()
+        self._shader_widget = shader_widget
+        for name in self.SETTINGS:
+            setattr(self, name, getattr(shader_widget, name))
+            shader_widget.fbind(name, self._copy_setting, name)
+
+    def unfollow(self):
+        if self._shader_widget is None:
+            return
+        for name in self.SETTINGS:
+            self._shader_widget.funbind(name, self._copy_setting, name)
+        self._shader_widget = None
+
+    def _copy_setting(self, name, instance, value):
+        setattr(self, name, value)
+
+    def analyze(self, frame, timestamp):
+        settings = self._settings
+        # Analysis frames are top row first, textures bottom row first
+        frame = frame[::-1]
+        if settings[0] == 'none':
+            return np.ascontiguousarray(frame)
+
+        if settings != self._lut_settings:
+            self._lut = cpuengine.ColourLUT(*settings)
+            self._lut_settings = settings
+        return self._lut.apply(frame)
+
+    def _upload(self, instance, frame):
+        if frame is None:
+            return
+        from kivy.graphics.texture import Texture
+
+        height, width = frame.shape[:2]
+        texture = self._textures[self._next_texture]
+        if texture is None or tuple(texture.size) != (width, height):
+            texture = Texture.create(size=(width, height), colorfmt='rgba')
+            self._textures[self._next_texture] = texture
+        texture.blit_buffer(frame.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+
+        self._next_texture = 1 - self._next_texture
+        self.texture = texture
+        self.frames_uploaded += 1
@@ -0,0 +1,78 @@
+"""
+Frame rate helpers for power saving capture mode (see power.py).
+
+These are imported by the camera backends at startup, so this module
+must not import NumPy or anything else heavy.
+"""
+
+from collections import deque
+
+POWER_MODES = ['normal', 'power_saving']
+
+POWER_SAVING_FPS = 15
+
+
+def choose_fps_range(ranges, max_fps):
+    """Return the (min, max) range from ranges best suited to running at
+    no more than max_fps, or None if there are no ranges.
+
+    The fastest range capped at max_fps is preferred, then the steadiest
+    (highest min). If every range is faster, the slowest is returned.
+    """
+    ranges = [tuple(fps_range) for fps_range in ranges]
+    if not ranges:
+        return None
+    capped = [fps_range for fps_range in ranges if fps_range[1] <= max_fps]
+    if not capped:
+        return min(ranges, key=lambda fps_range: (fps_range[1], fps_range[0]))
+    return max(capped, key=lambda fps_range: (fps_range[1], fps_range[0]))
+
+
+def full_rate_fps_range(ranges):
+    """Return the (min, max) range from ranges running fastest, or None
+    if there are no ranges. The lowest min is preferred, leaving auto
+    exposure room to slow down in low light.
+    """
+    ranges = [tuple(fps_range) for fps_range in ranges]
+    if not ranges:
+        return None
+    return max(ranges, key=lambda fps_range: (fps_range[1], -fps_range[0]))
+
+
+def render_interval(fps_range):
+    """Return the Clock interval at which to draw the preview of a camera
+    running in fps_range, where None means as often as possible.
+    """
+    if not fps_range:
+        return 0.
+    return 1. / fps_range[1]
+
+
+class CadenceMeter:
+    """Frame rate over the most recent window frames, from their
+    timestamps in seconds.
+    """
+
+    def __init__(self, window=30):
+        self._timestamps = deque(maxlen=window + 1)
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def record(self, timestamp):
+        self._timestamps.append(timestamp)
+
+    def reset(self):
+        self._timestamps.clear()
+
+    @property
+    def intervals(self):
+        timestamps = list(self._timestamps)
+        return [later - earlier for earlier, later in zip(timestamps, timestamps[1:])]
+
+    @property
+    def fps(self):
+        if len(self._timestamps) < 2:
+            return 0.
+        span = self._timestamps[-1] - self._timestamps[0]
+        return (len(self._timestamps) - 1) / span if span > 0 else 0.
@@ -0,0 +1,115 @@
+"""
+Sources of raw RGBA frames for running the processing pipeline without
+a camera, e.g. on a desktop Linux machine.
+"""
+
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from recorder import load_recording
+
+
+class FrameSource(ABC):
+    """Base class for frame sources.
+
+    Subclasses implement read(), returning a (frame, timestamp) tuple,
+    where frame is a uint8 array of shape (height, width, 4) and
+    timestamp is in seconds, or None once the source is exhausted.
+    """
+
+    resolution = (0, 0)
+
+    @abstractmethod
+    def read(self):
+        pass
+
+    def frames(self, realtime=True):
+        """Yield (frame, timestamp) tuples until the source is exhausted.
+
+        If realtime is True, frames are paced to match the gaps between
+        their timestamps, otherwise they are delivered as fast as they
+        are consumed.
+        """
+        first_timestamp = None
+        start_time = None
+        while True:
+            item = self.read()
+            if item is None:
+                return
+
+            frame, timestamp = item
+            if realtime:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                    start_time = time.perf_counter()
+                delay = (timestamp - first_timestamp) - (time.perf_counter() - start_time)
+                if delay > 0:
+                    time.sleep(delay)
+            yield frame, timestamp
+
+
+class SyntheticFrameSource(FrameSource):
+    """Stand-in for the camera, generating scrolling colour bars at a
+    fixed frame rate.
+    """
+
+    bar_colours = np.array([
+        [255, 255, 255], [255, 255, 0], [0, 255, 255], [0, 255, 0],
+        [255, 0, 255], [255, 0, 0], [0, 0, 255], [0, 0, 0]], dtype=np.uint8)
+
+    def __init__(self, resolution=(640, 480), fps=30., count=None):
+        self.resolution = tuple(resolution)
+        self.fps = fps
+        self.count = count
+        self.index = 0
+
+        width, height = self.resolution
+        self._bar_indices = (np.arange(width) * len(self.bar_colours)) // width
+        self._frame = np.empty((height, width, 4), dtype=np.uint8)
+        self._frame[..., 3] = 255
+
+    def read(self):
+        if self.count is not None and self.index >= self.count:
+            return None
+
+        width, height = self.resolution
+        offset = (self.index * 4) % width
+        row = self.bar_colours[np.roll(self._bar_indices, offset)]
+        self._frame[..., :3] = row[np.newaxis, :, :]
+        # A brightness ramp, so the frames aren't flat colour
+        self._frame[..., :3] = (
+            self._frame[..., :3] * np.linspace(0.25, 1., height, dtype=np.float32)[:, np.newaxis, np.newaxis])
+
+        timestamp = self.index / self.fps
+        self.index += 1
+        return self._frame, timestamp
+
+
+class ReplayFrameSource(FrameSource):
+    """Replays a recording made by recorder.FrameRecorder."""
+
+    def __init__(self, filename, loop=False):
+        self.frames_array, self.timestamps = load_recording(filename)
+        self.resolution = (self.frames_array.shape[2], self.frames_array.shape[1])
+        self.loop = loop
+        self.index = 0
+        self._loop_offset = 0.
+
+    def __len__(self):
+        return len(self.frames_array)
+
+    def read(self):
+        if self.index >= len(self.frames_array):
+            if not self.loop or not len(self.frames_array):
+                return None
+            # Keep timestamps increasing across loops
+            frame_interval = (
+                float(np.mean(np.diff(self.timestamps))) if len(self.timestamps) > 1 else 0.)
+            self._loop_offset += float(self.timestamps[-1] - self.timestamps[0]) + frame_interval
+            self.index = 0
+
+        index = self.index
+        self.index += 1
+        return self.frames_array[index], float(self.timestamps[index]) + self._loop_offset
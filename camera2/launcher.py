@@ -0,0 +1,210 @@
+"""
+Asynchronous launching of camera streams.
+
+A CameraLaunch takes a camera from closed to delivering preview frames
+in one coroutine, run on the asyncio event loop the app runs on (see
+App.async_run). The camera is opened straight away, and resolution
+selection and preview resource preparation happen while the device
+opens, rather than after it. Each step waiting on the camera has a
+timeout; a failed attempt closes the camera again and is retried.
+
+Every launch records when it reached each step, so the time to first
+frame of launches, camera switches and resumes can be tracked.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__file__)
+
+LAUNCH_STATES = ['pending', 'opening', 'configuring', 'waiting_for_frame', 'streaming', 'failed', 'cancelled']
+
+# Events meaning the camera won't deliver what is being waited for
+FAILURE_EVENTS = ('on_error', 'on_disconnected', 'on_closed')
+
+# Launch reports kept in CameraApp.launch_history
+LAUNCH_HISTORY_LENGTH = 50
+
+
+class LaunchError(Exception):
+    pass
+
+
+class EventWaiter:
+    """Future resolved by the next dispatch of an EventDispatcher event.
+
+    Handlers are bound on creation, so the waiter must be created before
+    whatever triggers the event.
+    """
+
+    def __init__(self, dispatcher, event, failure_events=FAILURE_EVENTS):
+        self.dispatcher = dispatcher
+        self.event = event
+        self.future = asyncio.get_event_loop().create_future()
+
+        self._handlers = {event: self._succeed}
+        for failure_event in failure_events:
+            self._handlers[failure_event] = self._make_failure_handler(failure_event)
+        dispatcher.bind(**self._handlers)
+
+    def _succeed(self, *args):
+        if not self.future.done():
+            self.future.set_result(args)
+
+    def _make_failure_handler(self, failure_event):
+        def fail(*args):
+            if not self.future.done():
+                self.future.set_exception(LaunchError(
+                    "{} received {} while waiting for {}".format(self.dispatcher, failure_event, self.event)))
+        return fail
+
+    async def wait(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.future, timeout)
+        except asyncio.TimeoutError:
+            raise LaunchError("{} timed out after {}s waiting for {}".format(self.dispatcher, timeout, self.event))
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """Stop waiting, unbinding the handlers."""
+        self.future.cancel()
+        self.dispatcher.unbind(**self._handlers)
+
+
+class CameraLaunch:
+    """One attempt to start streaming from a camera.
+
+    choose_resolution is called with the camera and returns the preview
+    resolution to use, or None if there is none suitable. reason (e.g.
+    'launch', 'switch' or 'resume') is only recorded.
+    """
+
+    def __init__(self, camera, choose_resolution, reason='launch',
+                 open_timeout=5., first_frame_timeout=5., close_timeout=2., retries=1):
+        self.camera = camera
+        self.choose_resolution = choose_resolution
+        self.reason = reason
+        self.open_timeout = open_timeout
+        self.first_frame_timeout = first_frame_timeout
+        self.close_timeout = close_timeout
+        self.retries = retries
+
+        self.state = 'pending'
+        self.resolution = None
+        self.attempts = 0
+        self.error = None
+        self.requested_time = time.perf_counter()
+        # Step name -> seconds after the launch was requested
+        self.timings = {}
+
+    def __repr__(self):
+        return "<CameraLaunch camera={} reason={} state={}>".format(self.camera, self.reason, self.state)
+
+    def _mark(self, step):
+        self.timings[step] = time.perf_counter() - self.requested_time
+
+    @property
+    def time_to_first_frame(self):
+        return self.timings.get('first_frame')
+
+    def report(self):
+        """Return a JSON-serialisable summary of the launch."""
+        return {'camera': self.camera.camera_id, 'reason': self.reason, 'state': self.state,
+                'attempts': self.attempts, 'resolution': self.resolution,
+                'timings': dict(self.timings), 'error': None if self.error is None else str(self.error)}
+
+    async def run(self):
+        """Launch the camera, returning the texture its preview is drawn
+        to once the first frame has arrived.
+
+        Raises LaunchError if every attempt fails. If cancelled, or on
+        any other error, the camera is closed again.
+        """
+        try:
+            # e.g. the same camera relaunched on resume, still closing
+            if self.camera.state != 'closed' and not await self._close_camera():
+                self.state = 'failed'
+                raise LaunchError("{} did not close before launching".format(self.camera))
+
+            while True:
+                self.attempts += 1
+                try:
+                    texture = await self._attempt()
+                except LaunchError as error:
+                    self.error = error
+                    logger.warning("Launch attempt {} of {} failed: {}".format(self.attempts, self, error))
+                    # A camera that didn't close can't be opened again
+                    closed = await self._close_camera()
+                    if not closed or self.resolution is None or self.attempts > self.retries:
+                        self.state = 'failed'
+                        raise
+                else:
+                    self.state = 'streaming'
+                    return texture
+        except asyncio.CancelledError:
+            self.state = 'cancelled'
+            self.camera.close()
+            raise
+        except LaunchError:
+            raise
+        except Exception as error:
+            # e.g. a ValueError from the camera, which retrying won't fix
+            self.state = 'failed'
+            self.error = error
+            self.camera.close()
+            raise
+
+    async def _attempt(self):
+        camera = self.camera
+
+        self.state = 'opening'
+        opened = EventWaiter(camera, 'on_opened')
+        camera.open()
+        self._mark('open_requested')
+
+        # Overlap everything that doesn't need the device with the open
+        try:
+            if self.resolution is None:
+                resolution = self.choose_resolution(camera)
+                if resolution is None:
+                    raise LaunchError("No suitable resolution in {}".format(camera.supported_resolutions))
+                self.resolution = tuple(resolution)
+            camera.prepare_preview(self.resolution)
+            self._mark('prepared')
+        except BaseException:
+            opened.cancel()
+            raise
+
+        await opened.wait(self.open_timeout)
+        self._mark('opened')
+
+        self.state = 'configuring'
+        first_frame = EventWaiter(camera, 'on_first_frame')
+        try:
+            texture = camera.start_preview(self.resolution)
+        except BaseException:
+            first_frame.cancel()
+            raise
+        self._mark('preview_started')
+
+        self.state = 'waiting_for_frame'
+        await first_frame.wait(self.first_frame_timeout)
+        self._mark('first_frame')
+        return texture
+
+    async def _close_camera(self):
+        """Close the camera, returning whether it closed in time."""
+        camera = self.camera
+        if camera.state == 'closed':
+            # Releases anything prepared for the preview
+            camera.close()
+            return True
+        closed = EventWaiter(camera, 'on_closed', ())
+        camera.close()
+        try:
+            await closed.wait(self.close_timeout)
+        except LaunchError:
+            return False
+        return True
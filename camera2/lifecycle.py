@@ -0,0 +1,96 @@
+"""
+Camera lifecycle states, and accounting of the resources each camera
+holds.
+
+A camera device moves through these states:
+
+    closed -> opening -> open -> configuring -> previewing
+                          ^          |              |
+                          +----------+--------------+   (stop_preview)
+
+and from any state other than closed to closing, then closed, when it
+is closed or disconnected. close() in the opening state is deferred
+until the device has opened, so that it can be closed properly.
+
+Every GL object, Android object and scheduled callback a camera creates
+is acquired in resource_ledger, and released when the camera drops it.
+Anything still live once a camera is closed is a leak:
+
+    assert not resource_ledger.live(owner=camera)
+"""
+
+from collections import Counter
+
+CAMERA_STATES = ['closed', 'opening', 'open', 'configuring', 'previewing', 'closing']
+
+TRANSITIONS = {
+    'closed': {'opening'},
+    'opening': {'open', 'closing', 'closed'},
+    'open': {'configuring', 'closing', 'closed'},
+    'configuring': {'previewing', 'open', 'closing', 'closed'},
+    'previewing': {'open', 'closing', 'closed'},
+    'closing': {'closed'},
+}
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def check_transition(current, new):
+    """Raise InvalidTransition unless a camera may move from state current
+    to state new.
+    """
+    if new not in TRANSITIONS[current]:
+        raise InvalidTransition("Camera cannot go from state {} to {}".format(current, new))
+
+
+class ResourceLedger:
+    """Record of the live resources held by cameras, by kind and owner.
+
+    Resources are tracked by identity, so a resource released twice, or
+    never acquired, raises ValueError.
+    """
+
+    def __init__(self):
+        # id(resource) -> (kind, owner, resource); holding the resource
+        # keeps its id from being reused while it is tracked
+        self._live = {}
+        self.acquired = Counter()
+        self.released = Counter()
+
+    def acquire(self, kind, resource, owner=None):
+        """Start tracking resource, and return it."""
+        if id(resource) in self._live:
+            raise ValueError("{} {} was already acquired".format(kind, resource))
+        self._live[id(resource)] = (kind, owner, resource)
+        self.acquired[kind] += 1
+        return resource
+
+    def release(self, resource):
+        """Stop tracking resource. Releasing None does nothing."""
+        if resource is None:
+            return
+        try:
+            kind, _, _ = self._live.pop(id(resource))
+        except KeyError:
+            raise ValueError("{} was released but never acquired, or released twice".format(resource))
+        self.released[kind] += 1
+
+    def live(self, kind=None, owner=None):
+        """Return the live resources, optionally only those of the given
+        kind and/or owner.
+        """
+        return [resource for resource_kind, resource_owner, resource in self._live.values()
+                if (kind is None or resource_kind == kind) and (owner is None or resource_owner is owner)]
+
+    def report(self, owner=None):
+        """Return a dict of the number of live resources of each kind."""
+        return dict(Counter(kind for kind, resource_owner, _ in self._live.values()
+                            if owner is None or resource_owner is owner))
+
+    def __len__(self):
+        return len(self._live)
+
+
+resource_ledger = ResourceLedger()
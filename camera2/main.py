@@ -1,5 +1,6 @@
 
 import time
+import asyncio
 import logging
 from functools import partial
 from enum import Enum
@@ -20,7 +21,11 @@ from kivy.uix.floatlayout import FloatLayout
 from kivy.core.window import Window
 
 from colourswidget import ColourShaderWidget
-from widgets import ColouredToggleButtonContainer, ColouredButton
+from widgets import ColouredToggleButtonContainer, ColouredButton, CachedLayout
+from zoom import FULL_FRAME, MAX_ZOOM, region_for_zoom
+from launcher import CameraLaunch, LaunchError, LAUNCH_HISTORY_LENGTH
+from cameraevents import camera_event_queue
+from framerate import POWER_MODES, POWER_SAVING_FPS, render_interval
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
@@ -28,9 +33,13 @@ handler = logging.StreamHandler()
 handler.setLevel(logging.DEBUG)
 logger.addHandler(handler)
 
-from camera2 import PyCameraInterface
-
-from android.permissions import request_permission, check_permission, Permission
+if platform == "android":
+    from camera2 import PyCameraInterface
+    from android.permissions import request_permission, check_permission, Permission
+else:
+    # Stand-in cameras, so that the app can run on desktop
+    from fakecamera import FakeCameraInterface as PyCameraInterface
+    from fakecamera import request_permission, check_permission, Permission
 
 class PermissionRequestStates(Enum):
     UNKNOWN = "UNKNOWN"
@@ -92,19 +101,91 @@ class CameraDisplayWidget(StencilView):
     tex_coords = ListProperty([0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 0.0, 1.0])
     correct_camera = BooleanProperty(False)
 
+    zoomable = BooleanProperty(False)
+    '''Whether pinching zooms and pans the view.'''
+
+    zoom = NumericProperty(1.)
+    zoom_center = ListProperty([0.5, 0.5])
+    '''Centre of the zoomed view, as a fraction of the camera frame.'''
+
+    region_of_interest = ListProperty(list(FULL_FRAME))
+    '''Region of the camera frame shown, following zoom and zoom_center.
+    The texture should show only this region.'''
+
     _rect_pos = ListProperty([0, 0])
     _rect_size = ListProperty([1, 1])
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+        self._pinch_touches = []
+        self._pinch_start = None
+
         self.bind(
             pos=self._update_rect,
             size=self._update_rect,
             resolution=self._update_rect,
             texture=self._update_rect,
+            zoom=self._update_region_of_interest,
+            zoom_center=self._update_region_of_interest,
         )
 
+    def _update_region_of_interest(self, *args):
+        self.region_of_interest = list(region_for_zoom(self.zoom, self.zoom_center))
+
+    def _frame_position(self, pos):
+        """Return the position in the camera frame, as fractions of the
+        current region of interest, shown at pos.
+        """
+        u = (pos[0] - self._rect_pos[0]) / self._rect_size[0]
+        v = (pos[1] - self._rect_pos[1]) / self._rect_size[1]
+        if self.correct_camera:
+            u = 1. - u
+        return u, v
+
+    def _pinch_geometry(self):
+        (x1, y1), (x2, y2) = (touch.pos for touch in self._pinch_touches)
+        return ((x1 + x2) / 2., (y1 + y2) / 2.), max(1., ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5)
+
+    def on_touch_down(self, touch):
+        if not self.zoomable or not self.collide_point(*touch.pos) or len(self._pinch_touches) >= 2:
+            return super().on_touch_down(touch)
+        self._pinch_touches.append(touch)
+        if len(self._pinch_touches) < 2:
+            return super().on_touch_down(touch)
+
+        midpoint, distance = self._pinch_geometry()
+        u, v = self._frame_position(midpoint)
+        x, y, width, height = self.region_of_interest
+        # The frame position under the pinch stays under it as it moves
+        self._pinch_start = (self.zoom, distance, (x + u * width, y + v * height))
+        return True
+
+    def on_touch_move(self, touch):
+        if self._pinch_start is None or touch not in self._pinch_touches:
+            return super().on_touch_move(touch)
+
+        start_zoom, start_distance, (anchor_x, anchor_y) = self._pinch_start
+        midpoint, distance = self._pinch_geometry()
+        zoom = min(max(start_zoom * distance / start_distance, 1.), MAX_ZOOM)
+        u, v = self._frame_position(midpoint)
+        size = 1. / zoom
+        self.zoom = zoom
+        self.zoom_center = [anchor_x - u * size + size / 2., anchor_y - v * size + size / 2.]
+        return True
+
+    def on_touch_up(self, touch):
+        if touch in self._pinch_touches:
+            self._pinch_touches.remove(touch)
+            if self._pinch_start is not None:
+                self._pinch_start = None
+                return True
+        return super().on_touch_up(touch)
+
+    def reset_zoom(self):
+        self.zoom = 1.
+        self.zoom_center = [0.5, 0.5]
+
     def on_correct_camera(self, instance, correct):
         print("Correct became", correct)
         if correct:
@@ -163,6 +244,11 @@ class CameraApp(App):
 
     current_camera = ObjectProperty(None, allownone=True)
 
+    pip_camera = ObjectProperty(None, allownone=True)
+    '''Camera streaming to the picture-in-picture view, if any.'''
+    pip_texture = ObjectProperty(None, allownone=True)
+    pip_resolution = ListProperty([1, 1])
+
     cameras_to_use = ListProperty()
 
     camera_permission_state = OptionProperty(
@@ -173,6 +259,40 @@ class CameraApp(App):
                  PermissionRequestStates.AWAITING_REQUEST_RESPONSE])
     _camera_permission_state_string = StringProperty("UNKNOWN")
 
+    processed_frame = ObjectProperty(None, allownone=True)
+    '''Latest readback.ReadbackFrame of the processed camera view, while
+    readback is running (see start_readback).'''
+
+    launch_history = ListProperty()
+    '''Reports (see launcher.CameraLaunch.report) of the latest
+    LAUNCH_HISTORY_LENGTH camera launches, switches and resumes, latest
+    last.'''
+
+    time_to_first_frame = NumericProperty(0.)
+    '''Seconds from requesting the latest successful launch to its first
+    frame.'''
+
+    frame_analyzer = ObjectProperty(None, allownone=True)
+    '''analysis.FrameAnalyzer running the plugins added with
+    add_analysis_plugin over the main view's camera frames.'''
+
+    power_mode = OptionProperty("normal", options=POWER_MODES)
+    '''In power_saving mode the cameras run at a reduced frame rate, and
+    the app redraws no faster than the current camera's frame rate range
+    (see power.py).'''
+
+    pause_focus_when_static = BooleanProperty(True)
+    '''Whether to pause continuous autofocus while the scene is static,
+    in power_saving mode.'''
+
+    render_mode = OptionProperty("gpu", options=["gpu", "cpu"])
+    '''How the colour blindness simulation is rendered. Switches to "cpu"
+    by itself if the shaders fail validation or a camera can't use its
+    GL preview (see fallback.py).'''
+
+    _processed_readback = ObjectProperty(None, allownone=True)
+    _streaming_server = ObjectProperty(None, allownone=True)
+
     def on_camera_permission_state(self, instance, state):
         self._camera_permission_state_string = state.value
 
@@ -182,14 +302,21 @@ class CameraApp(App):
         root = RootLayout()
 
         self.camera_interface = PyCameraInterface()
+        # Launch tasks in progress, by view ("main" or "pip")
+        self._launch_tasks = {}
+        self._update_event = None
+        self._static_scene_detector = None
+        self._cpu_renderer = None
+        self._texture_camera = None
+        self._apply_power_mode()
 
-        Clock.schedule_interval(self.update, 0)
+        root.ids.shader_widget.bind(shader_valid=self._on_shader_valid)
 
         self.debug_print_camera_info()
 
         self.inspect_cameras()
 
-        self.restart_stream()
+        self.restart_stream("launch")
 
         return root
 
@@ -204,18 +331,46 @@ class CameraApp(App):
                 self.cameras_to_use.append(camera)
 
     def rotate_cameras(self):
-        self.ensure_camera_closed()
         self.cameras_to_use = self.cameras_to_use[1:] + [self.cameras_to_use[0]]
-        self.attempt_stream_camera(self.cameras_to_use[0])
+        next_camera = self.cameras_to_use[0]
+        if next_camera is self.pip_camera:
+            # Both cameras are already streaming, just swap the views
+            self.swap_picture_in_picture()
+        else:
+            # The current camera keeps streaming until the next one has
+            # delivered its first frame, see _show_camera
+            self.attempt_stream_camera(next_camera, reason="switch")
+
+    def toggle_picture_in_picture(self):
+        if self.pip_camera is not None:
+            self.pip_camera.close()
+            self.pip_camera = None
+            self.pip_texture = None
+            return
 
-    def restart_stream(self):
+        other_cameras = [camera for camera in self.cameras_to_use if camera is not self.current_camera]
+        if other_cameras:
+            self.attempt_stream_camera(other_cameras[0], pip=True, reason="pip")
+
+    def swap_picture_in_picture(self):
+        self.root.ids.cdw.reset_zoom()
+        self.current_camera, self.pip_camera = self.pip_camera, self.current_camera
+        self.texture, self.pip_texture = self.pip_texture, self.texture
+        self.camera_resolution, self.pip_resolution = self.pip_resolution, self.camera_resolution
+        if self.render_mode == "cpu":
+            # The main view's texture was the CPU renderer's, which now
+            # follows the other camera
+            self.pip_texture = self.pip_camera.output_texture
+        self.root.ids.cdw.correct_camera = self.current_camera.facing == "FRONT"
+        self.root.ids.pip_cdw.correct_camera = self.pip_camera.facing == "FRONT"
+        self.set_region_of_interest(FULL_FRAME)
+        self._analyze_camera(self.current_camera, self.pip_camera)
+
+    def restart_stream(self, reason="restart"):
         self.ensure_camera_closed()
-        Clock.schedule_once(self._restart_stream, 0)
-
-    def _restart_stream(self, dt):
         logger.info("On restart, state is {}".format(self.camera_permission_state))
         if self.camera_permission_state in (PermissionRequestStates.UNKNOWN, PermissionRequestStates.HAVE_PERMISSION):
-            self.attempt_stream_camera(self.cameras_to_use[0])
+            self.attempt_stream_camera(self.cameras_to_use[0], reason=reason)
         else:
             logger.warning(
                 "Did not attempt to restart camera stream as state is {}".format(self.camera_permission_state))
@@ -230,55 +385,150 @@ class CameraApp(App):
     def stream_camera_index(self, index):
         self.attempt_stream_camera(self.camera_interface.cameras[index])
 
-    def attempt_stream_camera(self, camera):
-        """Start streaming from the given camera, if we have the CAMERA
-        permission, otherwise request the permission first.
-        """
+    def attempt_stream_camera(self, camera, pip=False, reason="switch"):
+        """Start streaming from the given camera in the background,
+        requesting the CAMERA permission first if we don't have it.
 
+        If pip is True, stream to the picture-in-picture view instead of
+        the main view. Any launch in progress for the same view is
+        cancelled.
+        """
+        view = "pip" if pip else "main"
+        previous_task = self._launch_tasks.pop(view, None)
+        if previous_task is not None:
+            previous_task.cancel()
+
+        task = asyncio.ensure_future(self._launch_camera(camera, pip, reason))
+        task.add_done_callback(partial(self._launch_task_done, view))
+        self._launch_tasks[view] = task
+
+    def _launch_task_done(self, view, task):
+        if self._launch_tasks.get(view) is task:
+            del self._launch_tasks[view]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Camera launch crashed", exc_info=task.exception())
+
+    def cancel_launches(self):
+        for task in self._launch_tasks.values():
+            task.cancel()
+        self._launch_tasks.clear()
+
+    async def _ensure_camera_permission(self):
         if check_permission(Permission.CAMERA):
-            self.stream_camera(camera)
-        else:
-            self.camera_permission_state = PermissionRequestStates.AWAITING_REQUEST_RESPONSE
-            request_permission(Permission.CAMERA, partial(self._request_permission_callback, camera))
+            return True
 
-    def _request_permission_callback(self, camera, permissions, alloweds):
-        # Assume  that we  received info  about exactly  1 permission,
-        # since we only ever ask for CAMERA
-        allowed = alloweds[0]
+        self.camera_permission_state = PermissionRequestStates.AWAITING_REQUEST_RESPONSE
+        future = asyncio.get_event_loop().create_future()
+
+        def set_result(allowed):
+            if not future.done():
+                future.set_result(allowed)
+
+        # Assume that we receive info about exactly 1 permission, since we
+        # only ever ask for CAMERA. The callback may come from another
+        # thread.
+        request_permission(Permission.CAMERA, lambda permissions, alloweds: camera_event_queue.post(
+            set_result, alloweds[0]))
+        allowed = await future
 
         if allowed:
             self.camera_permission_state = PermissionRequestStates.HAVE_PERMISSION
-            self.stream_camera(camera)
         else:
             self.camera_permission_state = PermissionRequestStates.DO_NOT_HAVE_PERMISSION
             print("PERMISSION FORBIDDEN")
+        return allowed
+
+    async def _launch_camera(self, camera, pip, reason):
+        if not await self._ensure_camera_permission():
+            return
 
-    def stream_camera(self, camera):
-        resolution = self.select_resolution(Window.size, camera.supported_resolutions, best=(1920, 1080))
+        launch = CameraLaunch(camera, partial(self._choose_resolution, pip), reason)
+        try:
+            texture = await launch.run()
+        except LaunchError as error:
+            logger.error(f"Could not start camera {camera}: {error}")
+            return
+        finally:
+            self.launch_history.append(launch.report())
+            del self.launch_history[:-LAUNCH_HISTORY_LENGTH]
+
+        self.time_to_first_frame = launch.time_to_first_frame
+        logger.info(f"Camera {camera} {reason}: first frame after {launch.time_to_first_frame:.3f}s")
+        self._show_camera(camera, launch.resolution, pip, texture)
+
+    def _choose_resolution(self, pip, camera):
+        if pip:
+            # The picture-in-picture view is small, so don't ask for more
+            # than it can show
+            window_size = (Window.width / 4, Window.height / 4)
+            resolution = self.select_resolution(window_size, camera.supported_resolutions)
+        else:
+            window_size = Window.size
+            resolution = self.select_resolution(window_size, camera.supported_resolutions, best=(1920, 1080))
         if resolution is None:
             logger.error(f"Found no good resolution in {camera.supported_resolutions} for Window.size {Window.size}")
-            return
         else:
             logger.info(f"Chose resolution {resolution} from choices {camera.supported_resolutions}")
-        self.camera_resolution = resolution
-        camera.open(callback=self._stream_camera_open_callback)
+        return resolution
+
+    def _show_camera(self, camera, resolution, pip, texture):
+        logger.info(f"Showing preview of camera {camera}")
+        if pip:
+            self.root.ids.pip_cdw.correct_camera = camera.facing == "FRONT"
+            self.pip_resolution = resolution
+            self.pip_texture = texture
+            self.pip_camera = camera
+            return
 
-    def _stream_camera_open_callback(self, camera, action):
-        if action == "OPENED":
-            logger.info("Camera opened, preparing to start preview")
-            Clock.schedule_once(partial(self._stream_camera_start_preview, camera), 0)
-        else:
-            logger.info("Ignoring camera event {action}")
+        previous_camera = self.current_camera
 
-    def _stream_camera_start_preview(self, camera, *args):
-        logger.info("Starting preview of camera {camera}")
         if camera.facing == "FRONT":
             self.root.ids.cdw.correct_camera = True
         else:
             self.root.ids.cdw.correct_camera = False
-        self.texture = camera.start_preview(tuple(self.camera_resolution))
-
+        self.camera_resolution = resolution
+        self.root.ids.cdw.reset_zoom()
+        if camera.cpu_preview:
+            # Its frames can only be shown through the CPU renderer
+            self.render_mode = "cpu"
+        if self.render_mode == "gpu":
+            self.texture = texture
         self.current_camera = camera
+        # Render the preview no larger than it is displayed
+        self.set_region_of_interest(FULL_FRAME)
+        self._analyze_camera(camera, previous_camera)
+
+        # Only now that the new camera is streaming, stop the old one
+        if previous_camera is not None and previous_camera is not camera:
+            previous_camera.close()
+
+    def on_current_camera(self, instance, camera):
+        # A camera's texture is replaced when its preview is resized for a
+        # new region of interest, after a delay
+        if self._texture_camera is not None:
+            self._texture_camera.unbind(output_texture=self._on_camera_texture,
+                                        fps_range=self._on_camera_fps_range)
+        self._texture_camera = camera
+        if camera is not None:
+            camera.bind(output_texture=self._on_camera_texture,
+                        fps_range=self._on_camera_fps_range)
+        if self._update_event is not None:
+            self._schedule_update()
+
+    def _on_camera_texture(self, camera, texture):
+        if camera is self.current_camera and texture is not None and self.render_mode == "gpu":
+            self.texture = texture
+
+    def set_region_of_interest(self, region):
+        """Show only region of the current camera's frame, which is then
+        processed at no more than the displayed resolution.
+        """
+        camera = self.current_camera
+        if camera is None or camera.state not in ("configuring", "previewing"):
+            return
+        texture = camera.set_region_of_interest(region, self.root.ids.cdw._rect_size)
+        if self.render_mode == "gpu":
+            self.texture = texture
 
     def select_resolution(self, window_size, resolutions, best=None):
         if best in resolutions:
@@ -302,10 +552,193 @@ class CameraApp(App):
     def update(self, dt):
         self.root.canvas.ask_update()
 
+        if self._processed_readback is not None and self.texture is not None:
+            frame = self._processed_readback.submit(self.texture, time.time())
+            if frame is not None:
+                self.processed_frame = frame
+
+    def start_readback(self, size=None, depth=2):
+        """Start reading the processed camera view back to the CPU,
+        updating processed_frame each frame.
+        """
+        if self._processed_readback is not None:
+            return
+        from readback import ReadbackRing
+        ring = ReadbackRing(size or self.camera_resolution, depth)
+        self.root.ids.shader_widget.add_readback(ring)
+        self._processed_readback = ring
+        # Mirrored like the view, for the front camera
+        self.root.ids.cdw.bind(tex_coords=self._update_readback_tex_coords)
+        self._update_readback_tex_coords(self.root.ids.cdw, self.root.ids.cdw.tex_coords)
+
+    def _update_readback_tex_coords(self, instance, tex_coords):
+        if self._processed_readback is not None:
+            self._processed_readback.tex_coords = tex_coords
+
+    def stop_readback(self):
+        if self._processed_readback is None:
+            return
+        self.root.ids.shader_widget.remove_readback(self._processed_readback)
+        self.root.ids.cdw.unbind(tex_coords=self._update_readback_tex_coords)
+        self._processed_readback = None
+        self.processed_frame = None
+
+    def start_streaming(self, port=8080, host="127.0.0.1"):
+        """Stream the processed camera view as MJPEG over HTTP."""
+        if self._streaming_server is not None:
+            return
+        from streaming import StreamingServer
+        self.start_readback()
+        self._streaming_server = StreamingServer(host, port, flip_vertical=True)
+        self._streaming_server.start_in_thread()
+        self.bind(processed_frame=self._stream_processed_frame)
+        logger.info(f"Streaming on {self._streaming_server.url}")
+
+    def stop_streaming(self):
+        if self._streaming_server is None:
+            return
+        self.unbind(processed_frame=self._stream_processed_frame)
+        self._streaming_server.stop_in_thread()
+        self._streaming_server = None
+
+    def _stream_processed_frame(self, instance, frame):
+        if frame is not None:
+            self._streaming_server.submit_frame(frame.array)
+
+    def add_analysis_plugin(self, plugin):
+        """Run an analysis.AnalysisPlugin over the frames of the camera in
+        the main view, posting its results to plugin.result.
+        """
+        if self.frame_analyzer is None:
+            from analysis import FrameAnalyzer
+            self.frame_analyzer = FrameAnalyzer()
+            self._analyze_camera(self.current_camera)
+        self.frame_analyzer.register(plugin)
+
+    def remove_analysis_plugin(self, plugin):
+        self.frame_analyzer.unregister(plugin)
+
+    def _analyze_camera(self, camera, previous_camera=None):
+        if self.frame_analyzer is None:
+            return
+        if previous_camera is not None and previous_camera.frame_analyzer is self.frame_analyzer:
+            previous_camera.stop_analysis()
+        if camera is not None and camera.preview_active:
+            camera.start_analysis(self.frame_analyzer)
+
+    def on_power_mode(self, instance, mode):
+        if self._update_event is not None:
+            self._apply_power_mode()
+
+    def on_pause_focus_when_static(self, instance, value):
+        if self._update_event is not None:
+            self._apply_power_mode()
+
+    def _apply_power_mode(self):
+        power_saving = self.power_mode == "power_saving"
+        for camera in self.camera_interface.cameras:
+            camera.power_mode = self.power_mode
+
+        self._schedule_update()
+
+        pause_focus = power_saving and self.pause_focus_when_static
+        if pause_focus and self._static_scene_detector is None:
+            from power import StaticSceneDetector
+            self._static_scene_detector = StaticSceneDetector()
+            self._static_scene_detector.bind(result=self._on_static_scene)
+            self.add_analysis_plugin(self._static_scene_detector)
+        elif not pause_focus and self._static_scene_detector is not None:
+            self.remove_analysis_plugin(self._static_scene_detector)
+            self._static_scene_detector = None
+            self._on_static_scene(None, False)
+
+    def _on_camera_fps_range(self, camera, fps_range):
+        if camera is self.current_camera and self._update_event is not None:
+            self._schedule_update()
+
+    def _schedule_update(self):
+        """Redraw at the current camera's frame rate in power_saving mode,
+        otherwise as often as possible.
+        """
+        if self.power_mode == "power_saving":
+            camera = self.current_camera
+            if camera is not None and camera.fps_range:
+                interval = render_interval(camera.fps_range)
+            else:
+                # Until the camera has chosen its range
+                interval = 1. / (camera.power_saving_fps if camera is not None else POWER_SAVING_FPS)
+        else:
+            interval = 0
+
+        if self._update_event is not None:
+            if self._update_event.timeout == interval:
+                return
+            self._update_event.cancel()
+        self._update_event = Clock.schedule_interval(self.update, interval)
+
+    def _on_static_scene(self, detector, static):
+        # Applies to every camera, so that a camera started while the
+        # scene was static doesn't keep its focus paused
+        for camera in self.camera_interface.cameras:
+            camera.continuous_focus = not static
+
     def ensure_camera_closed(self):
+        self.cancel_launches()
         if self.current_camera is not None:
             self.current_camera.close()
             self.current_camera = None
+        if self.pip_camera is not None:
+            self.pip_camera.close()
+            self.pip_camera = None
+            self.pip_texture = None
+
+    def on_render_mode(self, instance, mode):
+        if self.root is not None:
+            self._apply_render_mode()
+
+    def _on_shader_valid(self, shader_widget, valid):
+        if not valid:
+            logger.error("Colour blindness shader failed validation, rendering on the CPU instead")
+            self.render_mode = "cpu"
+
+    def _apply_render_mode(self):
+        shader_widget = self.root.ids.shader_widget
+        cpu = self.render_mode == "cpu"
+        shader_widget.cpu_fallback = cpu
+
+        if cpu and self._cpu_renderer is None:
+            from analysis import FrameAnalyzer
+            from fallback import CPUFallbackRenderer, CPU_RENDER_SIZE
+            if self.frame_analyzer is None:
+                self.frame_analyzer = FrameAnalyzer(CPU_RENDER_SIZE)
+            else:
+                # Every plugin gets the larger frames the renderer needs
+                self.frame_analyzer.max_size = CPU_RENDER_SIZE
+            self._analyze_camera(self.current_camera)
+
+            self._cpu_renderer = CPUFallbackRenderer()
+            self._cpu_renderer.follow(shader_widget)
+            self._cpu_renderer.bind(texture=self._show_cpu_frame)
+            self.frame_analyzer.register(self._cpu_renderer)
+        elif not cpu and self._cpu_renderer is not None:
+            self.frame_analyzer.unregister(self._cpu_renderer)
+            self._cpu_renderer.unfollow()
+            self._cpu_renderer.unbind(texture=self._show_cpu_frame)
+            self._cpu_renderer = None
+            # Show the camera's own texture again
+            self.set_region_of_interest(self.root.ids.cdw.region_of_interest)
+
+    def _show_cpu_frame(self, renderer, texture):
+        if texture is not None:
+            self.texture = texture
+
+    def on_start(self):
+        if self.render_mode == "cpu":
+            self._apply_render_mode()
+
+    def on_stop(self):
+        if self.frame_analyzer is not None:
+            self.frame_analyzer.shutdown()
 
     def on_pause(self):
 
@@ -316,8 +749,9 @@ class CameraApp(App):
 
     def on_resume(self):
         logger.info("Opening camera due to resume")
-        self.restart_stream()
+        self.restart_stream("resume")
 
 
 if __name__ == "__main__":
-    CameraApp().run()
+    # Camera launches are coroutines, run on the app's event loop
+    asyncio.run(CameraApp().async_run(async_lib="asyncio"))
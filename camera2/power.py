@@ -0,0 +1,53 @@
+"""
+Power saving capture mode.
+
+Capturing and drawing at the camera's full frame rate heats phones up
+over long sessions, until they throttle. In power saving mode a camera
+asks for a lower frame rate, chosen from the AE target FPS ranges it
+advertises (CONTROL_AE_AVAILABLE_TARGET_FPS_RANGES), and only redraws
+its preview at that rate. Continuous autofocus can also be paused while
+the scene is static, detected by StaticSceneDetector running as an
+analysis plugin (see analysis.py).
+
+Cameras measure the cadence of the frames they draw with a CadenceMeter
+and expose it as measured_fps, so the cap can be checked against the
+fake backend. The frame rate helpers live in framerate.py, which the
+camera backends import at startup without NumPy; this module is only
+imported once the scene detector is needed.
+"""
+
+import numpy as np
+
+from kivy.properties import StringProperty
+
+from analysis import AnalysisPlugin
+
+
+class StaticSceneDetector(AnalysisPlugin):
+    """Analysis plugin whose result is True once the mean brightness
+    change between frames has stayed below threshold (in 8-bit levels)
+    for hold_time seconds.
+    """
+
+    name = StringProperty('static_scene')
+
+    def __init__(self, threshold=2., hold_time=1., **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+        self.hold_time = hold_time
+        self._previous = None
+        self._static_since = None
+
+    def analyze(self, frame, timestamp):
+        # Every other pixel is plenty to see movement
+        luma = frame[::2, ::2, :3].mean(axis=-1, dtype=np.float32)
+        previous, self._previous = self._previous, luma
+
+        if previous is None or previous.shape != luma.shape or \
+                float(np.abs(luma - previous).mean()) >= self.threshold:
+            self._static_since = None
+            return False
+
+        if self._static_since is None:
+            self._static_since = timestamp
+        return timestamp - self._static_since >= self.hold_time
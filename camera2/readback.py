@@ -0,0 +1,187 @@
+"""
+Pipelined readback of rendered frames to the CPU.
+
+Reading an Fbo straight after drawing it (Fbo.pixels) stalls until the
+GPU has finished that frame. ReadbackRing instead rotates through depth
+Fbos: frame k is drawn into slot k % depth, and its pixels are only
+read when the slot comes round again, depth frames later. By then
+the GPU has long since finished it, so the read doesn't wait on the
+frame currently being rendered.
+
+GLES2 has no pixel buffer objects, so the read itself is still a
+glReadPixels; the pipelining removes the stall, not the copy. Ready
+frames wrap the returned buffer without further copies.
+
+The ring draws the source texture again, with its own copy of the
+shader, rather than reading back what is on screen: the screen shows
+the view at window size, and possibly only part transformed (see
+ColourShaderWidget.fraction). With the colour shader set, the
+simulation therefore runs twice per frame while readback is active,
+once at the ring's size.
+
+StandInReadbackRing has the same interface but takes NumPy frames, for
+running consumers headless without a GL context.
+"""
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class ReadbackFrame:
+    """A frame read back from the GPU.
+
+    buffer holds the raw RGBA bytes, bottom row first as in GL.
+    """
+
+    __slots__ = ('index', 'timestamp', 'size', 'buffer')
+
+    def __init__(self, index, timestamp, size, buffer):
+        self.index = index
+        self.timestamp = timestamp
+        self.size = size
+        self.buffer = buffer
+
+    @property
+    def memoryview(self):
+        return memoryview(self.buffer)
+
+    @property
+    def array(self):
+        """Read-only (height, width, 4) uint8 view of the frame."""
+        width, height = self.size
+        return np.frombuffer(self.buffer, dtype=np.uint8).reshape(height, width, 4)
+
+    def __repr__(self):
+        return "<ReadbackFrame index={} size={}>".format(self.index, self.size)
+
+
+class _ReadbackRingBase(ABC):
+    """Slot rotation shared by the GL and stand-in rings."""
+
+    def __init__(self, size, depth=2):
+        if depth < 1:
+            raise ValueError("Readback depth must be at least 1, got {}".format(depth))
+        self.size = tuple(int(value) for value in size)
+        self.depth = depth
+        self.frames_submitted = 0
+        self.frames_read = 0
+        # (index, timestamp) of the frame in each slot, or None
+        self._slots = [None] * depth
+
+    def submit(self, source, timestamp=None):
+        """Render source into the next slot, and return the frame read
+        back from that slot before it is overwritten (submitted depth
+        frames ago), or None while the pipeline is filling.
+        """
+        slot = self.frames_submitted % self.depth
+
+        ready = None
+        if self._slots[slot] is not None:
+            index, ready_timestamp = self._slots[slot]
+            ready = ReadbackFrame(index, ready_timestamp, self.size, self._read_slot(slot))
+            self.frames_read += 1
+
+        self._draw_slot(slot, source)
+        self._slots[slot] = (self.frames_submitted, timestamp)
+        self.frames_submitted += 1
+        return ready
+
+    @property
+    def latency(self):
+        """Number of frames between a submission and its readback."""
+        return self.depth
+
+    def reset(self):
+        self._slots = [None] * self.depth
+
+    @abstractmethod
+    def _draw_slot(self, slot, source):
+        pass
+
+    @abstractmethod
+    def _read_slot(self, slot):
+        pass
+
+
+class ReadbackRing(_ReadbackRingBase):
+    """Rotates through depth Fbos of the given size, each drawing the
+    submitted texture scaled to fill it.
+
+    If fs is given, it is used as the fragment shader of every Fbo, and
+    uniforms can be set on the ring as on a RenderContext. tex_coords
+    are applied as on a Rectangle, e.g. to mirror the frames.
+    """
+
+    def __init__(self, size, depth=2, fs=None):
+        from kivy.graphics import Fbo, Rectangle, Color
+
+        super().__init__(size, depth)
+        self.fbos = []
+        self._rectangles = []
+        self._tex_coords = None
+        for _ in range(depth):
+            fbo = Fbo(size=self.size)
+            with fbo:
+                Color(1, 1, 1, 1)
+                self._rectangles.append(Rectangle(size=self.size))
+            self.fbos.append(fbo)
+
+        if fs is not None:
+            self.fs = fs
+
+    @property
+    def fs(self):
+        return self.fbos[0].shader.fs
+
+    @fs.setter
+    def fs(self, value):
+        for fbo in self.fbos:
+            fbo.shader.fs = value
+
+    def __setitem__(self, name, value):
+        for fbo in self.fbos:
+            fbo[name] = value
+
+    @property
+    def tex_coords(self):
+        return self._tex_coords
+
+    @tex_coords.setter
+    def tex_coords(self, value):
+        self._tex_coords = value
+        if value is not None:
+            for rectangle in self._rectangles:
+                rectangle.tex_coords = value
+
+    def _draw_slot(self, slot, texture):
+        rectangle = self._rectangles[slot]
+        if rectangle.texture is not texture:
+            # Setting the texture resets the tex_coords to its own
+            rectangle.texture = texture
+            if self._tex_coords is not None:
+                rectangle.tex_coords = self._tex_coords
+        fbo = self.fbos[slot]
+        fbo.ask_update()
+        fbo.draw()
+
+    def _read_slot(self, slot):
+        return self.fbos[slot].pixels
+
+
+class StandInReadbackRing(_ReadbackRingBase):
+    """Headless stand-in for ReadbackRing, taking (height, width, 4)
+    uint8 arrays instead of textures.
+    """
+
+    def __init__(self, size, depth=2):
+        super().__init__(size, depth)
+        width, height = self.size
+        self._buffers = [np.zeros((height, width, 4), dtype=np.uint8) for _ in range(depth)]
+
+    def _draw_slot(self, slot, frame):
+        np.copyto(self._buffers[slot], frame)
+
+    def _read_slot(self, slot):
+        # Like Fbo.pixels, hand out a fresh immutable buffer
+        return self._buffers[slot].tobytes()
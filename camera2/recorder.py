@@ -0,0 +1,72 @@
+"""
+Recording of raw preview frames, for reproducing performance problems
+away from the device.
+
+FrameRecorder copies each frame into a fixed-size ring buffer allocated
+up front, so recording doesn't allocate per frame, and writes the
+buffered frames to a compressed .npz file on demand. The file can be
+replayed with framesource.ReplayFrameSource or replay.py.
+"""
+
+import numpy as np
+
+
+class FrameRecorder:
+    """Ring buffer holding the most recent capacity frames of the given
+    (height, width, channels) shape, with their timestamps.
+    """
+
+    def __init__(self, capacity, frame_shape):
+        if capacity < 1:
+            raise ValueError("FrameRecorder capacity must be at least 1, got {}".format(capacity))
+
+        self.capacity = capacity
+        self.frame_shape = tuple(frame_shape)
+        self.frames = np.zeros((capacity, ) + self.frame_shape, dtype=np.uint8)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self._next_index = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def record(self, pixels, timestamp):
+        """Copy a frame into the buffer, overwriting the oldest frame if
+        the buffer is full.
+
+        pixels may be any buffer of the right size (e.g. the bytes from
+        Fbo.pixels) or an array of the frame shape.
+        """
+        frame = np.frombuffer(pixels, dtype=np.uint8) if not isinstance(pixels, np.ndarray) else pixels
+        self.frames[self._next_index] = frame.reshape(self.frame_shape)
+        self.timestamps[self._next_index] = timestamp
+
+        self._next_index = (self._next_index + 1) % self.capacity
+        self.count += 1
+
+    def ordered(self):
+        """Return (frames, timestamps) for the buffered frames, oldest
+        first.
+        """
+        if self.count < self.capacity:
+            return self.frames[:self.count], self.timestamps[:self.count]
+        order = np.roll(np.arange(self.capacity), -self._next_index)
+        return self.frames[order], self.timestamps[order]
+
+    def flush(self, filename):
+        """Write the buffered frames to filename and empty the buffer."""
+        frames, timestamps = self.ordered()
+        np.savez_compressed(filename, frames=frames, timestamps=timestamps)
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self._next_index = 0
+
+
+def load_recording(filename):
+    """Return (frames, timestamps) from a file written by
+    FrameRecorder.flush.
+    """
+    with np.load(filename) as data:
+        return data['frames'], data['timestamps']
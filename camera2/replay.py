@@ -0,0 +1,134 @@
+"""
+Replay a recording made by recorder.FrameRecorder through the
+processing pipeline, and report per-frame timing.
+
+The gl engine renders each frame through the same colour blindness
+shader as the camera view, via an offscreen Fbo. On a Linux machine
+without a display, run with SDL_VIDEODRIVER=offscreen to use Mesa's
+software renderer. The cpu engine uses cpuengine.simulate instead.
+
+Usage:
+    python replay.py recording.npz [--engine gl|cpu] [--max-speed]
+                     [--transformation protanopia] [--severity 1.0]
+                     [--model machado] [--loops 1]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from framesource import ReplayFrameSource
+from simulation import model_for, error_matrix, DEFAULT_MODEL
+
+
+class CPUPipeline:
+    def __init__(self, resolution, transformation, severity, model):
+        self.transformation = transformation
+        self.severity = severity
+        self.model = model
+
+    def process(self, frame):
+        import cpuengine
+        return cpuengine.simulate(frame, self.transformation, self.severity, model=self.model)
+
+    def finish(self):
+        pass
+
+
+class GLPipeline:
+    def __init__(self, resolution, transformation, severity, model):
+        from kivy.base import EventLoop
+        EventLoop.ensure_window()
+
+        from kivy.graphics import Fbo, Rectangle, Color
+        from kivy.graphics.texture import Texture
+        import shaders
+        from colourswidget import to_uniform_value
+
+        self.texture = Texture.create(size=resolution, colorfmt='rgba')
+        self.fbo = Fbo(size=resolution)
+
+        simulation_model = model_for(transformation, model)
+        self.fbo.shader.fs = shaders.shader_for_model(simulation_model)
+        if not self.fbo.shader.success:
+            raise RuntimeError("Failed to compile the shader for model {}".format(simulation_model.name))
+
+        uniforms = simulation_model.uniforms(transformation, severity)
+        uniforms['error_matrix'] = error_matrix(transformation)
+        for name, value in uniforms.items():
+            self.fbo[name] = to_uniform_value(value)
+        self.fbo['transform_cutoff'] = float(resolution[0])
+        self.fbo['daltonize'] = 0
+        self.fbo['linearize'] = 0
+        self.fbo['colorimetric_modification'] = 0
+
+        with self.fbo:
+            Color(1, 1, 1, 1)
+            Rectangle(size=resolution, texture=self.texture)
+
+    def process(self, frame):
+        self.texture.blit_buffer(np.ascontiguousarray(frame).tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+        self.fbo.ask_update()
+        self.fbo.draw()
+        return self.fbo
+
+    def finish(self):
+        from kivy.graphics.opengl import glFinish
+        glFinish()
+
+
+engines = {'cpu': CPUPipeline, 'gl': GLPipeline}
+
+
+def replay(filename, engine='gl', realtime=True, transformation='protanopia',
+           severity=1.0, model=DEFAULT_MODEL, loops=1):
+    """Run a recording through the pipeline, returning the per-frame
+    processing times in seconds.
+    """
+    source = ReplayFrameSource(filename, loop=loops > 1)
+    pipeline = engines[engine](source.resolution, transformation, severity, model)
+
+    durations = []
+    total_frames = len(source) * loops
+    for frame, timestamp in source.frames(realtime=realtime):
+        start = time.perf_counter()
+        pipeline.process(frame)
+        pipeline.finish()
+        durations.append(time.perf_counter() - start)
+        if len(durations) >= total_frames:
+            break
+    return np.array(durations)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('filename')
+    parser.add_argument('--engine', choices=sorted(engines), default='gl')
+    parser.add_argument('--max-speed', action='store_true',
+                        help='Process frames as fast as possible instead of at the recorded rate')
+    parser.add_argument('--transformation', default='protanopia')
+    parser.add_argument('--severity', type=float, default=1.0)
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--loops', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    durations = replay(args.filename, engine=args.engine, realtime=not args.max_speed,
+                       transformation=args.transformation, severity=args.severity,
+                       model=args.model, loops=args.loops)
+
+    if not len(durations):
+        print("Recording contains no frames")
+        return 1
+
+    print("frames: {}".format(len(durations)))
+    print("mean: {:.3f} ms, median: {:.3f} ms, p95: {:.3f} ms, max: {:.3f} ms".format(
+        *(1000 * value for value in (
+            np.mean(durations), np.median(durations), np.percentile(durations, 95), np.max(durations)))))
+    print("throughput: {:.1f} frames/s".format(len(durations) / np.sum(durations)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+"""
+Registry of colour blindness simulation models, shared by the GLSL
+shaders and the NumPy engine.
+
+Each model is defined once, as data (row-major matrices acting on RGB).
+The matrices are meant for linear RGB, but are applied to the camera's
+gamma-encoded values unless linearize is set. shaders.shader_for_model
+generates a specialised fragment shader from a model's GLSL snippet,
+and the model's numpy_kernel builds the equivalent vectorised function,
+so the two can't drift apart.
+
+Available models:
+
+- 'machado': anomalous trichromacy and dichromacy, from Machado,
+  Oliveira and Fernandes, "A Physiologically-based Model for Simulation
+  of Color Vision Deficiency", IEEE TVCG 15(6), 2009. Each deficiency
+  has a table of matrices precomputed at severities 0.0, 0.1, ..., 1.0.
+- 'vienot': dichromacy, from Viénot, Brettel and Mollon, "Digital Video
+  Colourmaps for Checking the Legibility of Displays by Dichromats",
+  Color Research and Application 24, 1999, including its compression
+  of RGB into the dichromat's gamut before projecting.
+- 'brettel': dichromacy, from Brettel, Viénot and Mollon,
+  "Computerized simulation of color appearance for dichromats", JOSA A
+  14(10), 1997. Two projections, selected per pixel by which side of a
+  separating plane the colour lies on.
+- 'achromatopsia': rod monochromacy, i.e. luminance only.
+- 'blue_cone_monochromacy': only S cones and rods remain.
+
+Severity is supported by every model: intermediate severities are
+linearly interpolated between the nearest table entries, or between the
+identity and the full-severity matrix for models with no table.
+"""
+
+IDENTITY = ((1.0, 0.0, 0.0),
+            (0.0, 1.0, 0.0),
+            (0.0, 0.0, 1.0))
+
+MACHADO_PROTANOMALY = (
+    IDENTITY,
+    ((0.856167, 0.182038, -0.038205), (0.029342, 0.955115, 0.015544), (-0.002880, -0.001563, 1.004443)),
+    ((0.734766, 0.334872, -0.069637), (0.051840, 0.919198, 0.028963), (-0.004928, -0.004209, 1.009137)),
+    ((0.630323, 0.465641, -0.095964), (0.069181, 0.890046, 0.040773), (-0.006308, -0.007724, 1.014032)),
+    ((0.539009, 0.579343, -0.118352), (0.082546, 0.866121, 0.051332), (-0.007136, -0.011959, 1.019095)),
+    ((0.458064, 0.679578, -0.137642), (0.092785, 0.846313, 0.060902), (-0.007494, -0.016807, 1.024301)),
+    ((0.385450, 0.769005, -0.154455), (0.100526, 0.829802, 0.069673), (-0.007442, -0.022190, 1.029632)),
+    ((0.319627, 0.849633, -0.169261), (0.106241, 0.815969, 0.077790), (-0.007025, -0.028051, 1.035076)),
+    ((0.259411, 0.923008, -0.182420), (0.110296, 0.804340, 0.085364), (-0.006276, -0.034346, 1.040622)),
+    ((0.203876, 0.990338, -0.194214), (0.112975, 0.794542, 0.092483), (-0.005222, -0.041043, 1.046265)),
+    ((0.152286, 1.052583, -0.204868), (0.114503, 0.786281, 0.099216), (-0.003882, -0.048116, 1.051998)),
+)
+
+MACHADO_DEUTERANOMALY = (
+    IDENTITY,
+    ((0.866435, 0.177704, -0.044139), (0.049567, 0.939063, 0.011370), (-0.003453, 0.007233, 0.996220)),
+    ((0.760729, 0.319078, -0.079807), (0.090568, 0.889315, 0.020117), (-0.006027, 0.013325, 0.992702)),
+    ((0.675425, 0.433850, -0.109275), (0.125303, 0.847755, 0.026942), (-0.007950, 0.018572, 0.989378)),
+    ((0.605511, 0.528560, -0.134071), (0.155318, 0.812366, 0.032316), (-0.009376, 0.023176, 0.986200)),
+    ((0.547494, 0.607765, -0.155259), (0.181692, 0.781742, 0.036566), (-0.010410, 0.027275, 0.983136)),
+    ((0.498864, 0.674741, -0.173604), (0.205199, 0.754872, 0.039929), (-0.011131, 0.030969, 0.980162)),
+    ((0.457771, 0.731899, -0.189670), (0.226409, 0.731012, 0.042579), (-0.011595, 0.034333, 0.977261)),
+    ((0.422823, 0.781057, -0.203881), (0.245752, 0.709602, 0.044646), (-0.011843, 0.037423, 0.974421)),
+    ((0.392952, 0.823610, -0.216562), (0.263559, 0.690210, 0.046232), (-0.011910, 0.040281, 0.971630)),
+    ((0.367322, 0.860646, -0.227968), (0.280085, 0.672501, 0.047413), (-0.011820, 0.042940, 0.968881)),
+)
+
+MACHADO_TRITANOMALY = (
+    IDENTITY,
+    ((0.926670, 0.092514, -0.019184), (0.021191, 0.964503, 0.014306), (0.008437, 0.054813, 0.936750)),
+    ((0.895720, 0.133330, -0.029050), (0.029997, 0.945400, 0.024603), (0.013027, 0.104707, 0.882266)),
+    ((0.905871, 0.127791, -0.033662), (0.026856, 0.941251, 0.031893), (0.013410, 0.148296, 0.838294)),
+    ((0.948035, 0.089490, -0.037526), (0.014364, 0.946792, 0.038844), (0.010853, 0.193991, 0.795156)),
+    ((1.017277, 0.027029, -0.044306), (-0.006113, 0.958479, 0.047634), (0.006379, 0.248708, 0.744913)),
+    ((1.104996, -0.046633, -0.058363), (-0.032137, 0.971635, 0.060503), (0.001336, 0.317922, 0.680742)),
+    ((1.193214, -0.109812, -0.083402), (-0.058496, 0.979410, 0.079086), (-0.002346, 0.403492, 0.598854)),
+    ((1.257728, -0.139648, -0.118081), (-0.078003, 0.975409, 0.102594), (-0.003316, 0.501214, 0.502102)),
+    ((1.278864, -0.125333, -0.153531), (-0.084748, 0.957674, 0.127074), (-0.000989, 0.601151, 0.399838)),
+    ((1.255528, -0.076749, -0.178779), (-0.078411, 0.930809, 0.147602), (0.004733, 0.691367, 0.303900)),
+)
+
+# Viénot et al. work in LMS space. These are the matrices the camera
+# shader originally applied per pixel, folded into RGB below.
+VIENOT_RGB_TO_LMS = ((17.8824, 43.5161, 4.11935),
+                     (3.45565, 27.1554, 3.86714),
+                     (0.0299566, 0.184309, 1.46709))
+
+VIENOT_LMS_TO_RGB = ((0.0809444, -0.130504, 0.116721),
+                     (-0.010248533, 0.05401932666, -0.113614708),
+                     (-0.000365297, -0.00412161, 0.6935114))
+
+VIENOT_LMS_CORRECTIONS = {
+    # remove red (L component)
+    'protanopia': ((0.0, 2.02344, -2.52581),
+                   (0.0, 1.0, 0.0),
+                   (0.0, 0.0, 1.0)),
+    # remove green (M component)
+    'deuteranopia': ((1.0, 0.0, 0.0),
+                     (0.494207, 0.0, 1.24827),
+                     (0.0, 0.0, 1.0)),
+    # remove blue (S component)
+    'tritanopia': ((1.0, 0.0, 0.0),
+                   (0.0, 1.0, 0.0),
+                   (-0.012245, 0.072035, 0.0)),
+}
+
+# Viénot et al. first compress RGB into the range a dichromat can see,
+# so that simulated colours stay in gamut, as (scale, offset) applied to
+# each channel before the LMS projection. The paper gives no step for
+# tritanopia.
+VIENOT_RGB_COMPRESSION = {
+    'protanopia': (0.992052, 0.003974),
+    'deuteranopia': (0.957237, 0.0213814),
+}
+
+# Brettel et al. projections folded into linear sRGB, as
+# (matrix_1, matrix_2, separation_plane_normal). matrix_1 applies where
+# dot(rgb, normal) >= 0.
+BRETTEL_PROJECTIONS = {
+    'protanopia': (
+        ((0.14510, 1.20165, -0.34675), (0.10447, 0.85316, 0.04237), (0.00429, -0.00603, 1.00174)),
+        ((0.14115, 1.16782, -0.30897), (0.10495, 0.85730, 0.03776), (0.00431, -0.00586, 1.00155)),
+        (0.00048, 0.00416, -0.00464)),
+    'deuteranopia': (
+        ((0.36198, 0.86755, -0.22953), (0.26099, 0.64512, 0.09389), (-0.01975, 0.02686, 0.99289)),
+        ((0.37009, 0.88540, -0.25549), (0.25767, 0.63782, 0.10451), (-0.01950, 0.02741, 0.99209)),
+        (-0.00293, -0.00645, 0.00938)),
+    'tritanopia': (
+        ((1.01354, 0.14268, -0.15622), (-0.01181, 0.87561, 0.13619), (0.07707, 0.81208, 0.11085)),
+        ((0.93337, 0.19999, -0.13336), (0.05809, 0.82565, 0.11626), (-0.37923, 1.13825, 0.24098)),
+        (0.03960, -0.02831, -0.01129)),
+}
+
+# Relative luminance of linear sRGB (Rec. 709 weights)
+ACHROMATOPSIA_WEIGHTS = (0.2126, 0.7152, 0.0722)
+
+# Luminance as seen through S cones and rods only
+BLUE_CONE_MONOCHROMACY_WEIGHTS = (0.01775, 0.10945, 0.87262)
+
+# Daltonization redistributes the simulation error into the channels
+# that remain visible
+ERROR_MATRICES = {
+    'protanopia': ((0.0, 0.0, 0.0),
+                   (0.7, 1.0, 0.0),
+                   (0.7, 0.0, 1.0)),
+    'deuteranopia': ((1.0, 0.7, 0.0),
+                     (0.0, 0.0, 0.0),
+                     (0.0, 0.7, 1.0)),
+    'tritanopia': ((1.0, 0.0, 0.7),
+                   (0.0, 1.0, 0.7),
+                   (0.0, 0.0, 0.0)),
+}
+
+ZERO = ((0.0, 0.0, 0.0),
+        (0.0, 0.0, 0.0),
+        (0.0, 0.0, 0.0))
+
+
+def matrix_product(*matrices):
+    """Return the product of the given 3x3 matrices, left to right."""
+    result = matrices[0]
+    for matrix in matrices[1:]:
+        result = tuple(
+            tuple(sum(result[row][k] * matrix[k][col] for k in range(3)) for col in range(3))
+            for row in range(3))
+    return result
+
+
+def interpolate_table(table, severity):
+    """Linearly interpolate a table of matrices evenly spaced over
+    severities 0 to 1. Severity is clamped to [0, 1].
+    """
+    severity = min(1.0, max(0.0, float(severity)))
+    position = severity * (len(table) - 1)
+    index = min(int(position), len(table) - 2)
+    weight = position - index
+
+    lower = table[index]
+    upper = table[index + 1]
+    return tuple(
+        tuple((1.0 - weight) * lower[row][col] + weight * upper[row][col] for col in range(3))
+        for row in range(3))
+
+
+def error_matrix(transformation):
+    """Return the daltonization error matrix for the given
+    transformation.
+    """
+    return ERROR_MATRICES.get(transformation, ZERO)
+
+
+class LinearModel:
+    """A model applying one 3x3 matrix per transformation.
+
+    tables maps each transformation to a sequence of matrices evenly
+    spaced over severities 0 to 1.
+    """
+
+    kind = 'linear'
+
+    glsl_uniforms = """
+uniform mat4 simulation_matrix;
+"""
+
+    glsl_simulate = """
+    vec3 colour_blind_rgb = (simulation_matrix * vec4(input_rgb, 0.0)).xyz;
+"""
+
+    def __init__(self, name, description, tables):
+        self.name = name
+        self.description = description
+        self.tables = tables
+
+    @property
+    def transformations(self):
+        return ['none'] + list(self.tables)
+
+    def matrix(self, transformation, severity=1.0):
+        if transformation == 'none':
+            return IDENTITY
+        if transformation not in self.tables:
+            raise ValueError("Model {} does not support transformation {}".format(self.name, transformation))
+        return interpolate_table(self.tables[transformation], severity)
+
+    def uniforms(self, transformation, severity=1.0):
+        """Return the shader uniform values for the given transformation,
+        as row-major 3x3 matrices and 3-vectors.
+        """
+        return {'simulation_matrix': self.matrix(transformation, severity)}
+
+    def numpy_kernel(self, transformation, severity=1.0):
+        """Return a function applying this model to a float array of
+        RGB values with shape (..., 3), linear if linearize is set.
+        """
+        import numpy as np
+        matrix_t = np.array(self.matrix(transformation, severity), dtype=np.float32).T
+
+        def kernel(rgb):
+            return rgb @ matrix_t
+        return kernel
+
+
+class BrettelModel(LinearModel):
+    """A model applying one of two 3x3 matrices per pixel, depending on
+    which side of a separating plane the input colour lies.
+
+    projections maps each transformation to (matrix_1, matrix_2,
+    normal), with matrix_1 applying where dot(rgb, normal) >= 0.
+    """
+
+    kind = 'brettel'
+
+    glsl_uniforms = """
+uniform mat4 simulation_matrix;
+uniform mat4 simulation_matrix_2;
+uniform vec3 separation_normal;
+"""
+
+    glsl_simulate = """
+    vec3 colour_blind_rgb;
+    if (dot(input_rgb, separation_normal) >= 0.0) {
+        colour_blind_rgb = (simulation_matrix * vec4(input_rgb, 0.0)).xyz;
+    } else {
+        colour_blind_rgb = (simulation_matrix_2 * vec4(input_rgb, 0.0)).xyz;
+    }
+"""
+
+    def __init__(self, name, description, projections):
+        self.projections = projections
+        super().__init__(
+            name, description,
+            {transformation: (IDENTITY, matrix_1) for transformation, (matrix_1, _, _) in projections.items()})
+        self.tables_2 = {
+            transformation: (IDENTITY, matrix_2) for transformation, (_, matrix_2, _) in projections.items()}
+
+    def matrix_2(self, transformation, severity=1.0):
+        if transformation == 'none':
+            return IDENTITY
+        return interpolate_table(self.tables_2[transformation], severity)
+
+    def separation_normal(self, transformation):
+        if transformation == 'none':
+            return (0.0, 0.0, 0.0)
+        return self.projections[transformation][2]
+
+    def uniforms(self, transformation, severity=1.0):
+        return {'simulation_matrix': self.matrix(transformation, severity),
+                'simulation_matrix_2': self.matrix_2(transformation, severity),
+                'separation_normal': self.separation_normal(transformation)}
+
+    def numpy_kernel(self, transformation, severity=1.0):
+        import numpy as np
+        matrix_1_t = np.array(self.matrix(transformation, severity), dtype=np.float32).T
+        matrix_2_t = np.array(self.matrix_2(transformation, severity), dtype=np.float32).T
+        normal = np.array(self.separation_normal(transformation), dtype=np.float32)
+
+        def kernel(rgb):
+            side = (rgb @ normal)[..., np.newaxis] >= 0.
+            return np.where(side, rgb @ matrix_1_t, rgb @ matrix_2_t)
+        return kernel
+
+
+class VienotModel(LinearModel):
+    """A linear model whose input is first scaled and offset per
+    transformation.
+
+    compression maps transformations to (scale, offset), applied to every
+    channel; others are uncompressed. Like the matrix, the step is
+    interpolated from the identity by severity.
+    """
+
+    kind = 'vienot'
+
+    glsl_uniforms = """
+uniform mat4 simulation_matrix;
+uniform vec3 simulation_scale;
+uniform vec3 simulation_offset;
+"""
+
+    glsl_simulate = """
+    vec3 compressed_rgb = simulation_scale * input_rgb + simulation_offset;
+    vec3 colour_blind_rgb = (simulation_matrix * vec4(compressed_rgb, 0.0)).xyz;
+"""
+
+    def __init__(self, name, description, tables, compression):
+        super().__init__(name, description, tables)
+        self.compression = compression
+
+    def compression_step(self, transformation, severity=1.0):
+        """Return the (scale, offset) applied before the matrix."""
+        scale, offset = self.compression.get(transformation, (1.0, 0.0))
+        severity = min(1.0, max(0.0, float(severity)))
+        return 1.0 + severity * (scale - 1.0), severity * offset
+
+    def uniforms(self, transformation, severity=1.0):
+        scale, offset = self.compression_step(transformation, severity)
+        return {'simulation_matrix': self.matrix(transformation, severity),
+                'simulation_scale': (scale,) * 3,
+                'simulation_offset': (offset,) * 3}
+
+    def numpy_kernel(self, transformation, severity=1.0):
+        import numpy as np
+        matrix_t = np.array(self.matrix(transformation, severity), dtype=np.float32).T
+        scale, offset = (np.float32(value) for value in self.compression_step(transformation, severity))
+
+        def kernel(rgb):
+            return (rgb * scale + offset) @ matrix_t
+        return kernel
+
+
+models = {}
+
+
+def register_model(model):
+    """Add a model to the registry, replacing any existing model with the
+    same name.
+    """
+    models[model.name] = model
+    return model
+
+
+def get_model(name):
+    try:
+        return models[name]
+    except KeyError:
+        raise ValueError("Unknown simulation model {}, choose from {}".format(name, sorted(models)))
+
+
+register_model(LinearModel(
+    'machado', 'Machado et al. (2009) anomalous trichromacy',
+    {'protanopia': MACHADO_PROTANOMALY,
+     'deuteranopia': MACHADO_DEUTERANOMALY,
+     'tritanopia': MACHADO_TRITANOMALY}))
+
+register_model(VienotModel(
+    'vienot', 'Viénot et al. (1999) dichromacy',
+    {transformation: (IDENTITY, matrix_product(VIENOT_LMS_TO_RGB, correction, VIENOT_RGB_TO_LMS))
+     for transformation, correction in VIENOT_LMS_CORRECTIONS.items()},
+    VIENOT_RGB_COMPRESSION))
+
+register_model(BrettelModel(
+    'brettel', 'Brettel et al. (1997) dichromacy', BRETTEL_PROJECTIONS))
+
+register_model(LinearModel(
+    'achromatopsia', 'Achromatopsia (rod monochromacy)',
+    {'monochromacy': (IDENTITY, (ACHROMATOPSIA_WEIGHTS,) * 3)}))
+
+register_model(LinearModel(
+    'blue_cone_monochromacy', 'Blue cone monochromacy',
+    {'monochromacy': (IDENTITY, (BLUE_CONE_MONOCHROMACY_WEIGHTS,) * 3)}))
+
+DEFAULT_MODEL = 'machado'
+DEFAULT_MONOCHROMACY_MODEL = 'achromatopsia'
+
+
+def model_for(transformation, model=DEFAULT_MODEL, monochromacy_model=DEFAULT_MONOCHROMACY_MODEL):
+    """Return the registered model to use for the given transformation."""
+    if transformation == 'monochromacy':
+        return get_model(monochromacy_model)
+    return get_model(model)
+
+
+def simulation_matrix(transformation, severity=1.0, model=DEFAULT_MODEL):
+    """Return the 3x3 (row-major) RGB matrix simulating the given
+    transformation at the given severity, for a linear model.
+    """
+    return model_for(transformation, model).matrix(transformation, severity)
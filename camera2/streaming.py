@@ -0,0 +1,291 @@
+"""
+Streaming of the processed camera view to local clients as MJPEG over
+HTTP, e.g. for showing the simulation on a big screen.
+
+Frames are submitted from any thread with StreamingServer.submit_frame.
+Only the latest submitted frame is kept, and each frame is JPEG-encoded
+once, however many clients are connected. Every client has a queue
+holding at most one encoded frame: a client that can't keep up has its
+stale frame replaced rather than buffering without bound. With no
+clients on /stream, frames are only encoded when /snapshot.jpg is
+requested.
+
+Run directly to stream the stand-in frame source on localhost:
+
+    python streaming.py [--port 8080] [--transformation protanopia]
+                        [--resolution 640x480] [--fps 30]
+
+then open http://localhost:8080/ in a browser.
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+BOUNDARY = b'colourblindframe'
+
+INDEX_PAGE = b'''<!DOCTYPE html>
+<html>
+<head><title>ColourBlind</title></head>
+<body style="margin: 0; background: black;">
+<img src="/stream" style="width: 100vw; height: 100vh; object-fit: contain;">
+</body>
+</html>
+'''
+
+
+def encode_jpeg(frame, quality=80, flip_vertical=False):
+    """Return the JPEG bytes of an RGB or RGBA uint8 frame."""
+    from PIL import Image
+
+    rgb = frame[..., :3]
+    if flip_vertical:
+        # Frames read back from GL are stored bottom row first
+        rgb = rgb[::-1]
+    output = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(rgb)).save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+class MJPEGClient:
+    """A connected client, with a single-slot queue of encoded frames."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=1)
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+    def offer(self, jpeg):
+        if self.queue.full():
+            # The client hasn't taken the previous frame yet, drop it
+            self.queue.get_nowait()
+            self.frames_dropped += 1
+        self.queue.put_nowait(jpeg)
+
+
+class StreamingServer:
+    """Asyncio HTTP server broadcasting submitted frames as MJPEG."""
+
+    def __init__(self, host='127.0.0.1', port=8080, quality=80, flip_vertical=False):
+        self.host = host
+        self.port = port
+        self.quality = quality
+        self.flip_vertical = flip_vertical
+
+        self.clients = set()
+        self._connection_tasks = set()
+        self.frames_submitted = 0
+        self.frames_encoded = 0
+        self.latest_jpeg = None
+
+        self._latest_frame = None
+        self._frame_lock = threading.Lock()
+        self._loop = None
+        self._server = None
+        self._new_frame = None
+        self._encoding = None
+        self._encoder_task = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    async def start(self):
+        # submit_frame uses the event once the loop is set, from any thread
+        self._new_frame = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Port 0 binds an arbitrary free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._encoder_task = asyncio.ensure_future(self._encode_frames())
+        logger.info("Streaming on {}".format(self.url))
+
+    async def stop(self):
+        tasks = list(self._connection_tasks)
+        if self._encoder_task is not None:
+            tasks.append(self._encoder_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """Run the server on its own event loop in a daemon thread,
+        returning once it is accepting connections.
+        """
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            self._ready.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True, name='StreamingServer')
+        self._thread.start()
+        self._ready.wait()
+
+    def stop_in_thread(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def submit_frame(self, frame):
+        """Submit a uint8 RGB(A) frame for streaming. Safe to call from any
+        thread; the frame must not be modified afterwards.
+        """
+        with self._frame_lock:
+            self._latest_frame = frame
+            self.frames_submitted += 1
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._new_frame.set)
+
+    async def _encode_frames(self):
+        while True:
+            await self._new_frame.wait()
+            self._new_frame.clear()
+            if not self.clients:
+                # Left for a snapshot request to encode
+                continue
+
+            await self._encode_latest_frame()
+
+    async def _encode_latest_frame(self):
+        """Encode the latest submitted frame and offer it to every /stream
+        client, returning its JPEG, or None if it has already been
+        encoded.
+        """
+        with self._frame_lock:
+            frame = self._latest_frame
+            self._latest_frame = None
+        if frame is None:
+            if self._encoding is not None:
+                # Taken by another caller, which is still encoding it
+                return await asyncio.shield(self._encoding)
+            return None
+
+        # Encode off the event loop so that slow encoding doesn't block
+        # the connections
+        self._encoding = self._loop.run_in_executor(
+            None, encode_jpeg, frame, self.quality, self.flip_vertical)
+        try:
+            jpeg = await asyncio.shield(self._encoding)
+        finally:
+            self._encoding = None
+        self.frames_encoded += 1
+        self.latest_jpeg = jpeg
+        # A frame encoded for a snapshot is streamed too
+        for client in self.clients:
+            client.offer(jpeg)
+        return jpeg
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connection_tasks.add(task)
+        try:
+            request_line = await reader.readline()
+            # Discard the headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            path = parts[1] if len(parts) >= 2 else ''
+
+            if path == '/':
+                self._write_response(writer, b'200 OK', b'text/html', INDEX_PAGE)
+            elif path == '/snapshot.jpg':
+                # Without /stream clients, frames are only encoded here
+                jpeg = await self._encode_latest_frame() or self.latest_jpeg
+                if jpeg is not None:
+                    self._write_response(writer, b'200 OK', b'image/jpeg', jpeg)
+                else:
+                    self._write_response(writer, b'404 Not Found', b'text/plain', b'No frame yet\n')
+            elif path == '/stream':
+                await self._stream(writer)
+            else:
+                self._write_response(writer, b'404 Not Found', b'text/plain', b'Not found\n')
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by stop(). Finish normally, since asyncio's stream
+            # server logs an error for handler tasks that end cancelled.
+            pass
+        finally:
+            self._connection_tasks.discard(task)
+            writer.close()
+
+    def _write_response(self, writer, status, content_type, body):
+        writer.write(b'HTTP/1.0 ' + status + b'\r\n'
+                     b'Content-Type: ' + content_type + b'\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                     b'\r\n' + body)
+
+    async def _stream(self, writer):
+        writer.write(b'HTTP/1.0 200 OK\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=' + BOUNDARY + b'\r\n'
+                     b'\r\n')
+
+        client = MJPEGClient(writer)
+        self.clients.add(client)
+        if self.latest_jpeg is not None:
+            client.offer(self.latest_jpeg)
+        try:
+            while True:
+                jpeg = await client.queue.get()
+                writer.write(b'--' + BOUNDARY + b'\r\n'
+                             b'Content-Type: image/jpeg\r\n'
+                             b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n'
+                             b'\r\n' + jpeg + b'\r\n')
+                await writer.drain()
+                client.frames_sent += 1
+        finally:
+            self.clients.discard(client)
+
+
+def main(argv=None):
+    import cpuengine
+    from framesource import SyntheticFrameSource
+
+    parser = argparse.ArgumentParser(description="Stream the stand-in camera as MJPEG")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--transformation', default='protanopia')
+    parser.add_argument('--severity', type=float, default=1.0)
+    parser.add_argument('--resolution', default='640x480')
+    parser.add_argument('--fps', type=float, default=30.)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    resolution = tuple(int(value) for value in args.resolution.split('x'))
+    source = SyntheticFrameSource(resolution, fps=args.fps)
+    server = StreamingServer(args.host, args.port)
+    server.start_in_thread()
+    print("Streaming on {}".format(server.url))
+
+    try:
+        for frame, timestamp in source.frames(realtime=True):
+            server.submit_frame(cpuengine.simulate(frame, args.transformation, args.severity))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop_in_thread()
+
+
+if __name__ == "__main__":
+    main()
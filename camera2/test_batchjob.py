@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import cpuengine
+from batchjob import BatchJob, Coordinator, Manifest, encode_message, read_message, run_worker
+
+TRANSFORMATIONS = ('protanopia', 'tritanopia')
+
+
+@pytest.fixture
+def images(tmp_path):
+    random = np.random.default_rng(0)
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    for index in range(10):
+        rgb = random.integers(0, 256, size=(24, 32, 3), dtype=np.uint8)
+        Image.fromarray(rgb).save(directory / 'image{}.png'.format(index))
+    return directory
+
+
+def make_job(images, output):
+    return BatchJob([str(images)], str(output), transformations=TRANSFORMATIONS, shard_size=3)
+
+
+def run(job, local_workers=2):
+    return asyncio.run(asyncio.wait_for(Coordinator(job).run(local_workers), 120))
+
+
+def shard_entries(job):
+    return [entry for entry in Manifest(job.manifest_path).entries() if entry['type'] == 'shard']
+
+
+def test_interrupted_run_resumes(images, tmp_path):
+    output = tmp_path / 'output'
+    job = make_job(images, output)
+    report = run(job)
+    assert report['shards_processed'] == len(job.shards) == 4
+    assert report['shards_failed'] == []
+
+    # Simulate a crash after two shards: later entries never written, the
+    # last one cut short, and outputs of the unfinished shards missing
+    with open(job.manifest_path) as fileh:
+        lines = fileh.readlines()
+    kept = lines[:3]
+    completed = {json.loads(line)['shard'] for line in kept[1:]}
+    with open(job.manifest_path, 'w') as fileh:
+        fileh.writelines(kept)
+        fileh.write(lines[3][:10])
+    for index, shard in enumerate(job.shards):
+        if index not in completed:
+            for image in shard:
+                for transformation in TRANSFORMATIONS:
+                    os.remove(job.output_path(job.output_name(image), transformation))
+
+    job = make_job(images, output)
+    report = run(job)
+    assert report['shards_skipped'] == 2
+    assert report['shards_processed'] == 2
+    assert report['shards_failed'] == []
+    assert sorted(entry['shard'] for entry in shard_entries(job)) == list(range(len(job.shards)))
+
+    for image in job.images:
+        rgb = np.asarray(Image.open(image).convert('RGB'))
+        for transformation in TRANSFORMATIONS:
+            with Image.open(job.output_path(job.output_name(image), transformation)) as simulated:
+                np.testing.assert_array_equal(np.asarray(simulated), cpuengine.simulate(rgb, transformation))
+    assert not [name for name in os.listdir(output / 'protanopia') if name.endswith('.tmp')]
+
+    # Nothing left to do, so no workers are started
+    report = run(make_job(images, output))
+    assert report['shards_skipped'] == len(job.shards)
+    assert report['shards_processed'] == 0
+
+
+def test_different_job_is_refused(images, tmp_path):
+    output = tmp_path / 'output'
+    run(make_job(images, output), local_workers=1)
+
+    job = BatchJob([str(images)], str(output), transformations=TRANSFORMATIONS, severity=0.5, shard_size=3)
+    with pytest.raises(ValueError):
+        run(job)
+
+
+def test_unreadable_shard_is_left_for_next_run(images, tmp_path):
+    job = make_job(images, tmp_path / 'output')
+    coordinator = Coordinator(job)
+    start = coordinator.start
+
+    async def start_then_remove_image():
+        await start()
+        os.remove(job.images[-1])
+    coordinator.start = start_then_remove_image
+
+    report = asyncio.run(asyncio.wait_for(coordinator.run(2), 120))
+    assert report['shards_failed'] == [len(job.shards) - 1]
+    assert report['shards_processed'] == len(job.shards) - 1
+    assert sorted(entry['shard'] for entry in shard_entries(job)) == list(range(len(job.shards) - 1))
+
+
+def test_worker_with_unexpected_reply_is_dropped(images, tmp_path):
+    job = make_job(images, tmp_path / 'output')
+    coordinator = Coordinator(job)
+
+    async def main():
+        run_task = asyncio.ensure_future(coordinator.run())
+        while coordinator._server is None:
+            await asyncio.sleep(0.01)
+
+        reader, writer = await asyncio.open_connection(coordinator.host, coordinator.port)
+        writer.write(encode_message({'type': 'hello', 'worker': 'confused'}))
+        header, _ = await read_message(reader)
+        writer.write(encode_message({'type': 'result', 'shard': header['shard'] + 1, 'outputs': []}))
+        # The coordinator hangs up rather than sending another shard
+        assert await asyncio.wait_for(reader.read(), 10) == b''
+        writer.close()
+
+        shards = await asyncio.to_thread(run_worker, coordinator.host, coordinator.port, 'worker')
+        return shards, await asyncio.wait_for(run_task, 120)
+
+    shards, report = asyncio.run(main())
+    assert shards == len(job.shards)
+    assert report['shards_processed'] == len(job.shards)
+    assert report['shards_failed'] == []
+    assert report['workers']['confused']['shards'] == 0
@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+import pytest
+
+import cpuengine
+from audit import DEFICIENCIES
+
+
+def palette_image(shape, colours, seed=0):
+    """Return a uint8 image of the given (..., channels) shape, using
+    only the given number of random colours.
+    """
+    random = np.random.default_rng(seed)
+    palette = random.integers(0, 256, size=(colours, shape[-1]), dtype=np.uint8)
+    return palette[random.integers(0, colours, size=shape[:-1])]
+
+
+@pytest.mark.parametrize('transformation', DEFICIENCIES)
+@pytest.mark.parametrize('linearize', [False, True])
+@pytest.mark.parametrize('channels', [3, 4])
+@pytest.mark.parametrize('size', [(120, 160), (300, 400)])
+def test_memoize_matches_direct(transformation, linearize, channels, size):
+    image = palette_image(size + (channels, ), 500)
+    direct = cpuengine.simulate(image, transformation, 0.7, linearize, memoize=False)
+
+    memoized = cpuengine.simulate(image, transformation, 0.7, linearize, memoize=True)
+    np.testing.assert_array_equal(memoized, direct)
+
+    cache = cpuengine.ColourCache()
+    for _ in range(2):
+        cached = cpuengine.simulate(image, transformation, 0.7, linearize, cache=cache, memoize=True)
+        np.testing.assert_array_equal(cached, direct)
+    assert cache.colours_computed == cache.colours_reused == len(np.unique(cpuengine.pack_rgb(image[..., :3])))
+
+
+def test_small_images_are_not_memoized_automatically():
+    image = palette_image((64, 64, 3), 4)
+    assert not cpuengine.is_low_colour(image)
+    assert cpuengine.is_low_colour(np.tile(image, (8, 8, 1)))
+
+
+def test_cache_reuses_colours_across_images():
+    cache = cpuengine.ColourCache()
+    first = palette_image((64, 64, 3), 300, seed=1)
+    second = np.concatenate([first, palette_image((64, 64, 3), 300, seed=2)])
+
+    for image in (first, second):
+        direct = cpuengine.simulate(image, 'deuteranopia', memoize=False)
+        np.testing.assert_array_equal(
+            cpuengine.simulate(image, 'deuteranopia', cache=cache, memoize=True), direct)
+
+    first_colours = len(np.unique(cpuengine.pack_rgb(first)))
+    second_colours = len(np.unique(cpuengine.pack_rgb(second)))
+    assert cache.colours_reused == first_colours
+    assert cache.colours_computed == second_colours
+
+    # Every colour is now looked up in the merged table
+    np.testing.assert_array_equal(
+        cpuengine.simulate(second, 'deuteranopia', cache=cache, memoize=True),
+        cpuengine.simulate(second, 'deuteranopia', memoize=False))
+    assert cache.colours_computed == second_colours
+
+
+def test_cache_bounds():
+    cache = cpuengine.ColourCache(max_settings=2, max_colours=400)
+    for seed in range(3):
+        image = palette_image((64, 64, 3), 300, seed=seed)
+        for transformation in DEFICIENCIES:
+            direct = cpuengine.simulate(image, transformation, memoize=False)
+            np.testing.assert_array_equal(
+                cpuengine.simulate(image, transformation, cache=cache, memoize=True), direct)
+            assert len(cache) <= 2
+            assert all(len(keys) <= 400 for keys, _ in cache._tables.values())
+
+
+def test_cache_shared_between_threads():
+    cache = cpuengine.ColourCache(max_colours=2000)
+    images = [palette_image((100, 100, 3), 1000, seed=seed) for seed in range(8)]
+    expected = [cpuengine.simulate(image, 'protanopia', memoize=False) for image in images]
+    results = [None] * len(images)
+
+    def simulate(index):
+        results[index] = cpuengine.simulate(images[index], 'protanopia', cache=cache, memoize=True)
+
+    threads = [threading.Thread(target=simulate, args=(index, )) for index in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for result, direct in zip(results, expected):
+        np.testing.assert_array_equal(result, direct)
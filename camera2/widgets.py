@@ -2,8 +2,12 @@ from kivy.uix.behaviors import ButtonBehavior, ToggleButtonBehavior
 from kivy.uix.button import Button
 from kivy.uix.anchorlayout import AnchorLayout
 from kivy.uix.label import Label
+from kivy.uix.relativelayout import RelativeLayout
 from kivy.properties import (ListProperty, NumericProperty, BooleanProperty)
 from kivy.metrics import dp
+from kivy.graphics import Canvas, Fbo, Color, Rectangle, ClearColor, ClearBuffers, Callback
+from kivy.graphics.opengl import (glBlendFunc, glBlendFuncSeparate, GL_ONE,
+                                  GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
 class ColouredButton(ButtonBehavior, Label):
     background_normal = ListProperty([1, 1, 1, 1])
@@ -40,3 +44,72 @@ class ButtonCheckbox(ButtonBehavior, Label):
         if not self.handle_touch:
             return False
         return super(ButtonCheckbox, self).on_touch_down(touch)
+
+
+class CachedLayout(RelativeLayout):
+    """RelativeLayout that renders its children into an Fbo, and draws
+    the result as a single textured quad.
+
+    The Fbo is only redrawn when an instruction inside it changes
+    (e.g. a button state, text or size), so redrawing the parent
+    canvas every frame costs one Rectangle instead of the children's
+    full instruction list, stencil operations included. Moving the
+    layout only changes the Translate of the RelativeLayout, so it
+    doesn't invalidate the cache.
+    """
+
+    def __init__(self, **kwargs):
+        self.canvas = Canvas()
+        with self.canvas:
+            self.fbo = Fbo(size=(1, 1), with_stencilbuffer=True)
+            Color(1, 1, 1, 1)
+            # The Fbo contents have premultiplied alpha (see
+            # _set_fbo_blend_func), so composite them accordingly
+            Callback(self._set_premultiplied_blend_func)
+            self.fbo_rectangle = Rectangle(size=(1, 1), texture=self.fbo.texture)
+            Callback(self._set_default_blend_func)
+
+        with self.fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Callback(self._set_fbo_blend_func)
+
+        super().__init__(**kwargs)
+
+        self.fbind('size', self._update_fbo_size)
+        self._update_fbo_size()
+
+    def _update_fbo_size(self, *args):
+        size = (max(1, int(self.width)), max(1, int(self.height)))
+        self.fbo.size = size
+        self.fbo_rectangle.size = size
+        # Resizing an Fbo replaces its texture
+        self.fbo_rectangle.texture = self.fbo.texture
+
+    def _set_fbo_blend_func(self, instruction):
+        glBlendFuncSeparate(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+
+    def _set_premultiplied_blend_func(self, instruction):
+        glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+
+    def _set_default_blend_func(self, instruction):
+        glBlendFuncSeparate(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE)
+
+    def add_widget(self, *args, **kwargs):
+        # Add the widget to our Fbo instead of the normal canvas
+        c = self.canvas
+        self.canvas = self.fbo
+        super().add_widget(*args, **kwargs)
+        self.canvas = c
+
+    def remove_widget(self, *args, **kwargs):
+        c = self.canvas
+        self.canvas = self.fbo
+        super().remove_widget(*args, **kwargs)
+        self.canvas = c
+
+    def clear_widgets(self, *args, **kwargs):
+        c = self.canvas
+        self.canvas = self.fbo
+        super().clear_widgets(*args, **kwargs)
+        self.canvas = c
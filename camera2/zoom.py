@@ -0,0 +1,111 @@
+"""
+Digital zoom, as a region of interest of the camera frame.
+
+Regions are (x, y, width, height) tuples in fractions of the frame, with
+y measured upwards as in texture coordinates. Cameras render only the
+region of interest into their preview Fbo, at the region's size in
+pixels but no more than the size it is displayed at, so processing gets
+cheaper as the view zooms in.
+
+Where the camera can crop on the sensor (SCALER_CROP_REGION), regions
+are mapped onto the sensor's active array through the part of it the
+stream shows: a stream whose aspect ratio differs from the array's,
+e.g. 16:9 from a 4:3 sensor, only shows a centred crop of it.
+"""
+
+FULL_FRAME = (0., 0., 1., 1.)
+
+MAX_ZOOM = 8.
+
+# Seconds a region of interest must stay unchanged, e.g. at the end of a
+# pinch, before the camera's crop and the preview Fbo are updated for it
+ROI_UPDATE_DELAY = 0.15
+
+
+def region_for_zoom(zoom, center=(0.5, 0.5)):
+    """Return the region of interest showing the frame zoomed by zoom
+    about center, moved as little as needed to stay inside the frame.
+    """
+    zoom = max(1., float(zoom))
+    size = 1. / zoom
+    x = min(max(center[0] - size / 2., 0.), 1. - size)
+    y = min(max(center[1] - size / 2., 0.), 1. - size)
+    return (x, y, size, size)
+
+
+def tex_coords_for_region(region):
+    """Return Rectangle tex_coords drawing only the given region."""
+    x, y, width, height = region
+    return [x, y, x + width, y, x + width, y + height, x, y + height]
+
+
+def region_pixel_size(region, resolution, max_size=None):
+    """Return the (width, height) in pixels of region of a frame of the
+    given resolution, scaled down to fit within max_size if given.
+    """
+    width = region[2] * resolution[0]
+    height = region[3] * resolution[1]
+    if max_size is not None:
+        scale = min(1., max_size[0] / width, max_size[1] / height)
+        width *= scale
+        height *= scale
+    return (max(1, int(round(width))), max(1, int(round(height))))
+
+
+def region_within(region, outer):
+    """Return region as fractions of outer, both given as fractions of
+    the same frame.
+    """
+    x, y, width, height = region
+    outer_x, outer_y, outer_width, outer_height = outer
+    return ((x - outer_x) / outer_width, (y - outer_y) / outer_height,
+            width / outer_width, height / outer_height)
+
+
+def with_frame_aspect(region):
+    """Return the smallest region with the frame's aspect ratio (equal
+    width and height fractions) containing region, moved as little as
+    needed to stay inside the frame.
+    """
+    x, y, width, height = region
+    size = min(1., max(width, height))
+    new_x = min(max(x + width / 2. - size / 2., 0.), 1. - size)
+    new_y = min(max(y + height / 2. - size / 2., 0.), 1. - size)
+    return (new_x, new_y, size, size)
+
+
+def stream_field_of_view(array_size, stream_size=None):
+    """Return the (left, top, width, height) rectangle, in pixels, of a
+    sensor array of the given size shown by an uncropped stream of
+    stream_size, both in the sensor's orientation. The stream's aspect
+    ratio is fitted by cropping the array about its centre.
+    """
+    array_width, array_height = array_size
+    if stream_size is None:
+        return (0., 0., float(array_width), float(array_height))
+    aspect = stream_size[0] / stream_size[1]
+    width = min(float(array_width), array_height * aspect)
+    height = min(float(array_height), array_width / aspect)
+    return ((array_width - width) / 2., (array_height - height) / 2., width, height)
+
+
+def crop_rect(region, array_size, stream_size=None):
+    """Return the (left, top, right, bottom) pixel rectangle of region of
+    a stream of stream_size within a sensor array of the given size,
+    whose rows run downwards.
+
+    The stream is delivered in the sensor's orientation, so region needs
+    no rotation. If stream_size is None the stream is taken to show the
+    whole array.
+    """
+    x, y, width, height = region
+    left, top, view_width, view_height = stream_field_of_view(array_size, stream_size)
+    return (int(round(left + x * view_width)),
+            int(round(top + (1. - y - height) * view_height)),
+            int(round(left + (x + width) * view_width)),
+            int(round(top + (1. - y) * view_height)))
+
+
+def is_centered(region, tolerance=1e-3):
+    x, y, width, height = region
+    return abs(x + width / 2. - 0.5) < tolerance and abs(y + height / 2. - 0.5) < tolerance
@@ -2,7 +2,6 @@
 package net.inclem.camera2;
 
 import android.hardware.camera2.CameraCaptureSession;
-import java.lang.Runnable;
 import android.util.Log;
 import android.view.Surface;
 
@@ -10,7 +9,11 @@ import android.view.Surface;
 public class MyCaptureSessionCallback extends CameraCaptureSession.StateCallback {
 	private static final String TAG = "pythonMyCaptureSessionCallback";
 
-    Runnable callback;
+    public interface Listener {
+        void onCaptureSessionEvent(String event, CameraCaptureSession session);
+    }
+
+    Listener listener;
 
     public enum CameraCaptureEvents {
         ACTIVE,
@@ -23,65 +26,59 @@ public class MyCaptureSessionCallback extends CameraCaptureSession.StateCallback
         UNKNOWN
     }
 
-    public static CameraCaptureSession camera_capture_session = null;
-    public static CameraCaptureEvents camera_capture_event = CameraCaptureEvents.UNKNOWN;
+    // Per-instance, so that several cameras can stream at once
+    public CameraCaptureSession camera_capture_session = null;
+    public CameraCaptureEvents camera_capture_event = CameraCaptureEvents.UNKNOWN;
 
-    public MyCaptureSessionCallback(Runnable the_callback)
+    public MyCaptureSessionCallback(Listener the_listener)
     {
-        callback = the_callback;
+        listener = the_listener;
+    }
+
+    private void deliver(CameraCaptureSession session, CameraCaptureEvents event)
+    {
+        this.camera_capture_session = session;
+        this.camera_capture_event = event;
+        this.listener.onCaptureSessionEvent(event.toString(), session);
     }
 
     @Override
     public void onActive(CameraCaptureSession session)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.ACTIVE;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.ACTIVE);
     }
 
     @Override
     public void onCaptureQueueEmpty(CameraCaptureSession session)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.CAPTURE_QUEUE_EMPTY;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.CAPTURE_QUEUE_EMPTY);
     }
 
     @Override
     public void onClosed(CameraCaptureSession session)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.CLOSED;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.CLOSED);
     }
 
     public void onConfigureFailed(CameraCaptureSession session)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.CONFIGURE_FAILED;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.CONFIGURE_FAILED);
     }
 
     public void onConfigured(CameraCaptureSession session)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.CONFIGURED;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.CONFIGURED);
     }
 
     @Override
     public void onReady(CameraCaptureSession session)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.READY;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.READY);
     }
 
     @Override
     public void onSurfacePrepared(CameraCaptureSession session, Surface surface)
     {
-        this.camera_capture_session = session;
-        this.camera_capture_event = CameraCaptureEvents.SURFACE_PREPARED;
-        this.callback.run();
+        deliver(session, CameraCaptureEvents.SURFACE_PREPARED);
     }
 }
@@ -1,14 +1,17 @@
 package net.inclem.camera2;
 
 import android.hardware.camera2.CameraDevice;
-import java.lang.Runnable;
 import android.util.Log;
 
 
 public class MyStateCallback extends CameraDevice.StateCallback {
 	private static final String TAG = "pythonMyStateCallback";
 
-    Runnable callback;
+    public interface Listener {
+        void onStateEvent(String action, CameraDevice camera, int error);
+    }
+
+    Listener listener;
 
     public enum CameraActions {
         CLOSED,
@@ -18,46 +21,46 @@ public class MyStateCallback extends CameraDevice.StateCallback {
         UNKNOWN
     };
 
-    public static CameraDevice camera_device = null;
-    public static CameraActions camera_action = CameraActions.UNKNOWN;
-    public static int camera_error = 0;
+    // Per-instance, so that several cameras can be open at once
+    public CameraDevice camera_device = null;
+    public CameraActions camera_action = CameraActions.UNKNOWN;
+    public int camera_error = 0;
+
+    public MyStateCallback(Listener the_listener)
+    {
+        listener = the_listener;
+    }
 
-    public MyStateCallback(Runnable the_callback)
+    private void deliver(CameraDevice cam, CameraActions action, int error)
     {
-        callback = the_callback;
+        this.camera_device = cam;
+        this.camera_action = action;
+        this.camera_error = error;
+        this.listener.onStateEvent(action.toString(), cam, error);
     }
 
     public void onClosed(CameraDevice cam)
     {
         Log.v(TAG, "onClosed");
-        this.camera_device = cam;
-        this.camera_action = CameraActions.CLOSED;
-        this.callback.run();
+        deliver(cam, CameraActions.CLOSED, 0);
     }
 
     public void onDisconnected(CameraDevice cam)
     {
         Log.v(TAG, "onDisconnected");
-        this.camera_device = cam;
-        this.camera_action = CameraActions.DISCONNECTED;
-        this.callback.run();
+        deliver(cam, CameraActions.DISCONNECTED, 0);
     }
 
     public void onOpened(CameraDevice cam)
     {
         Log.v(TAG, "onOpened");
-        this.camera_device = cam;
-        this.camera_action = CameraActions.OPENED;
-        this.callback.run();
+        deliver(cam, CameraActions.OPENED, 0);
     }
 
     @Override
     public void onError(CameraDevice cam, int error)
     {
         Log.v(TAG, "onError");
-        this.camera_device = cam;
-        this.camera_action = CameraActions.ERROR;
-        this.camera_error = error;
-        this.callback.run();
+        deliver(cam, CameraActions.ERROR, error);
     }
 }
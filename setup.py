@@ -3,7 +3,7 @@ from distutils.core import setup
 from setuptools import find_packages
 
 options = {'apk': {'debug': None,
-                   'requirements': 'sdl2,pyjnius,kivy==master,python3',
+                   'requirements': 'sdl2,pyjnius,kivy==master,python3,numpy,pillow',
                    'android-api': 29,
                    'ndk-api': 21,
                    'ndk-dir': '/home/sandy/android/android-ndk-r20',